@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark of cleartext signature canonicalization.
+
+Compares the bytes-level streaming canonicalizer with the former str
+based implementation on a generated XML metadata file.
+
+Usage:
+    python benchmarks/cleartext.py [--size-mb 100] [--repeat 3]
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sign.utils.cleartext import CleartextCanonicalizer  # noqa: E402
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def make_document(size: int) -> bytes:
+    """Returns repodata-like XML of about the given size."""
+    package = (
+        '  <package type="rpm">\n'
+        '    <name>package-{0}</name>\n'
+        '    <arch>x86_64</arch>\n'
+        '    <version epoch="0" ver="1.{0}" rel="1.el9"/>\n'
+        '    <checksum type="sha256" pkgid="YES">{1}</checksum>\n'
+        '    <summary>Package number {0}  </summary>\n'
+        '    <description>Line of the description\t\n'
+        '-- dashed line of the description\n'
+        '    </description>\n'
+        '  </package>\n'
+    )
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<metadata>\n']
+    length = len(parts[0])
+    number = 0
+    while length < size:
+        checksum = hashlib.sha256(b'%d' % number).hexdigest()
+        part = package.format(number, checksum)
+        parts.append(part)
+        length += len(part)
+        number += 1
+    parts.append('</metadata>\n')
+    return ''.join(parts).encode()
+
+
+def legacy(content: bytes):
+    """Former implementation: str decoding, split and re-join."""
+    hasher = hashlib.sha256()
+    try:
+        text = content.decode('utf-8')
+    except UnicodeDecodeError:
+        text = content.decode('latin-1')
+    normalized = text.replace('\r\n', '\n').replace('\r', '\n')
+    lines = [line.rstrip() for line in normalized.split('\n')]
+    hasher.update('\r\n'.join(lines).encode('utf-8'))
+    # wrap_signature_as_pgp decoded and split the content again
+    text = content.decode('utf-8')
+    escaped = '\n'.join(
+        '- ' + line if line.startswith('-') else line
+        for line in text.split('\n')
+    )
+    return hasher.digest(), escaped
+
+
+def streaming(content: bytes):
+    """Canonicalizer fed with 1 MiB chunks as uploads arrive."""
+    hasher = hashlib.sha256()
+    canonicalizer = CleartextCanonicalizer(hasher)
+    output = bytearray()
+    for start in range(0, len(content), CHUNK_SIZE):
+        output += canonicalizer.update(content[start:start + CHUNK_SIZE])
+    output += canonicalizer.finish()
+    return hasher.digest(), output
+
+
+def measure(function, content: bytes, repeat: int):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(content)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size-mb', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    content = make_document(args.size_mb * 1024 * 1024)
+    size_mb = len(content) / 1024 / 1024
+    lines = content.count(b'\n')
+    print(f'document: {size_mb:.1f} MiB, {lines} lines')
+    for name, function in (('legacy', legacy), ('streaming', streaming)):
+        seconds, peak = measure(function, content, args.repeat)
+        print(
+            f'{name:>10}: {seconds:6.3f} s, {size_mb / seconds:7.1f} MiB/s, '
+            f'peak memory {peak / 1024 / 1024:7.1f} MiB'
+        )
+
+
+if __name__ == '__main__':
+    main()
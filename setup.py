@@ -3,13 +3,12 @@ from setuptools import find_packages, setup
 setup(
     name='sign',
     version='0.1.0',
-    packages=find_packages(include=['sign']),
+    packages=find_packages(include=['sign', 'sign.*']),
     install_requires=[
         'python-gnupg >= 0.5.6',
         'plumbum >= 1.10.0',
         'fastapi[all] >= 0.128.0',
         'aiofiles >= 22.1.0',
-        'pexpect >= 4.8.0',
         'SQLAlchemy >= 1.4.42, < 3.0',
         'bcrypt >= 4.0.1',
         'pyjwt >= 2.4.0',
@@ -22,7 +21,14 @@ setup(
     extras_require={
         'kms': [
             'boto3 >= 1.26.0',
-            'PGPy13 >= 0.6.1rc1',
+            'cryptography >= 3.4',
+        ],
+        'softkey': [
+            'cryptography >= 3.4',
+        ],
+        'client': [
+            'requests >= 2.28.0',
+            'httpx >= 0.24.0',
         ],
     },
 )
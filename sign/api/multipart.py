@@ -0,0 +1,143 @@
+"""
+Incremental parsing of multipart/form-data uploads.
+"""
+
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, List, Optional, Tuple
+
+from fastapi import Request, UploadFile
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.datastructures import Headers
+
+from sign.errors import FileTooBigError, MultipartError
+
+# same as the multipart parser of Starlette
+MULTIPART_SPOOL_SIZE = 1024 * 1024
+
+
+def _decode(value: bytes) -> str:
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value.decode('latin-1')
+
+
+class _Part:
+    def __init__(self):
+        self.headers: List[Tuple[bytes, bytes]] = []
+        self.header_name = b''
+        self.header_value = b''
+        self.upload: Optional[UploadFile] = None
+        self.size = 0
+
+
+async def iter_uploads(
+    request: Request,
+    field_name: str,
+    max_file_size: int,
+    spool_max_size: int = MULTIPART_SPOOL_SIZE,
+) -> AsyncIterator[UploadFile]:
+    """
+    Yields files of a multipart request body as soon as each has arrived.
+
+    The body is read only while the next file is requested, so a consumer
+    which stops asking for files stops the upload as well. Files are
+    spooled like Starlette does and are rewound before they are yielded.
+    Form fields and files of other fields are skipped.
+
+    Raises
+    ------
+    MultipartError
+        If the body isn't valid multipart/form-data.
+    FileTooBigError
+        If a file is bigger than max_file_size.
+    """
+    content_type, params = parse_options_header(
+        request.headers.get('content-type', '')
+    )
+    if content_type != b'multipart/form-data' or b'boundary' not in params:
+        raise MultipartError('multipart/form-data body is expected')
+
+    # parser callbacks are synchronous, so they only record what has
+    # happened and the file writes are awaited afterwards
+    events: List[Tuple[str, _Part, bytes]] = []
+    part = _Part()
+
+    def on_part_begin():
+        nonlocal part
+        part = _Part()
+
+    def on_header_field(data: bytes, start: int, end: int):
+        part.header_name += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        part.header_value += data[start:end]
+
+    def on_header_end():
+        part.headers.append((part.header_name.lower(), part.header_value))
+        part.header_name = b''
+        part.header_value = b''
+
+    def on_headers_finished():
+        headers = dict(part.headers)
+        _, options = parse_options_header(
+            headers.get(b'content-disposition', b'')
+        )
+        if options.get(b'name') != field_name.encode():
+            return
+        if b'filename' not in options:
+            return
+        part.upload = UploadFile(
+            file=SpooledTemporaryFile(max_size=spool_max_size),
+            filename=_decode(options[b'filename']),
+            headers=Headers(raw=part.headers),
+        )
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if part.upload is not None:
+            events.append(('data', part, data[start:end]))
+
+    def on_part_end():
+        if part.upload is not None:
+            events.append(('end', part, b''))
+
+    parser = MultipartParser(
+        params[b'boundary'],
+        {
+            'on_part_begin': on_part_begin,
+            'on_header_field': on_header_field,
+            'on_header_value': on_header_value,
+            'on_header_end': on_header_end,
+            'on_headers_finished': on_headers_finished,
+            'on_part_data': on_part_data,
+            'on_part_end': on_part_end,
+        },
+    )
+    unfinished: Optional[UploadFile] = None
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except FormParserError as error:
+                raise MultipartError(f'malformed multipart body: {error}')
+            for event, event_part, data in events:
+                upload = event_part.upload
+                if event == 'data':
+                    unfinished = upload
+                    event_part.size += len(data)
+                    if event_part.size > max_file_size:
+                        raise FileTooBigError
+                    await upload.write(data)
+                    continue
+                unfinished = None
+                await upload.seek(0)
+                yield upload
+            events.clear()
+        try:
+            parser.finalize()
+        except FormParserError as error:
+            raise MultipartError(f'malformed multipart body: {error}')
+    finally:
+        if unfinished is not None:
+            await unfinished.close()
@@ -1,14 +1,29 @@
+import asyncio
 import logging
-from typing import List
+import math
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Request,
+    UploadFile,
+    status,
+)
 from fastapi.responses import PlainTextResponse
 
 from sign.api.dependencies import get_backend, get_current_user
+from sign.api.multipart import MULTIPART_SPOOL_SIZE, iter_uploads
 from sign.api.schema import (
     BatchSignResponse,
+    DigestSignRequest,
     ErrMessage,
     FileSignResult,
+    QueueStatus,
     TokenRequest,
     TokenResponse,
 )
@@ -17,16 +32,75 @@ from sign.auth.jwt import JWT
 from sign.config import settings
 from sign.db.helpers import get_user
 from sign.db.models import User
-from sign.errors import FileTooBigError, UserNotFoundError
+from sign.errors import (
+    DigestSigningError,
+    FileTooBigError,
+    IdempotencyConflictError,
+    IdempotencyMismatchError,
+    LockTimeoutError,
+    MultipartError,
+    QueueRejectedError,
+    UserNotFoundError,
+)
 from sign.signing.backend import SigningBackend
+from sign.utils.idempotency import IdempotencyStore, request_fingerprint
+from sign.utils.sha2 import HashState
+from sign.utils.spool import hash_upload
 
 router = APIRouter()
 
+# max seconds between the creation time of a client's final digest and now
+DIGEST_TIME_SKEW = 3600
+
+
+def key_busy_error(keyid: str, error: LockTimeoutError) -> HTTPException:
+    if isinstance(error, QueueRejectedError):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=(
+                f'key {keyid} is busy, {error.depth} requests are queued, '
+                f'try again later'
+            ),
+            headers={'Retry-After': str(math.ceil(error.retry_after))},
+        )
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=f'key {keyid} is busy, try again later',
+    )
+
+
+def idempotency_error(error: Exception) -> HTTPException:
+    if isinstance(error, IdempotencyMismatchError):
+        return HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(error),
+        )
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=str(error),
+    )
+
+
+def idempotency_scope(
+    user: User,
+    endpoint: str,
+    idempotency_key: Optional[str],
+) -> Optional[str]:
+    # keys of different users and endpoints never collide
+    if idempotency_key is None:
+        return None
+    return f'{user.id}:{endpoint}:{idempotency_key}'
+
+
 jwt = JWT(
     secret=settings.jwt_secret_key,
     expire_minutes=settings.jwt_expire_minutes,
     hash_algoritm=settings.jwt_algoritm,
 )
+idempotency = IdempotencyStore(
+    settings.idempotency_dir,
+    ttl=settings.idempotency_ttl,
+)
 
 
 @router.get('/ping')
@@ -41,54 +115,355 @@ async def sign(
     file: UploadFile,
     sign_type: str = 'detach-sign',
     sign_algo: str = 'SHA256',
+    timeout: Optional[float] = None,
+    idempotency_key: Optional[str] = Header(default=None),
+    user: User = Depends(get_current_user),
+    backend: SigningBackend = Depends(get_backend),
+) -> str:
+    """
+    Sign the uploaded file.
+
+    A retry with the same Idempotency-Key header and file gets the
+    signature of the original request, waiting for it if it still runs.
+    """
+    if not backend.key_exists(keyid):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'key {keyid} does not exist',
+        )
+    fingerprint = None
+    if idempotency_key is not None:
+        fingerprint = request_fingerprint(
+            keyid, sign_type, sign_algo, await hash_upload(file)
+        )
+    try:
+        async with idempotency.claim(
+            idempotency_scope(user, 'sign', idempotency_key), timeout
+        ) as idempotent:
+            if idempotent.replayed:
+                answer = idempotent.replay(fingerprint)
+            else:
+                answer = await backend.sign(
+                    keyid,
+                    file,
+                    detach_sign=sign_type == 'detach-sign',
+                    digest_algo=sign_algo,
+                    timeout=timeout,
+                )
+                await idempotent.complete(fingerprint, answer)
+    except FileTooBigError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'file size exceeds {settings.max_upload_bytes} bytes',
+        )
+    except LockTimeoutError as error:
+        raise key_busy_error(keyid, error)
+    except (IdempotencyConflictError, IdempotencyMismatchError) as error:
+        raise idempotency_error(error)
+    if idempotent.replayed:
+        logging.info(
+            "user %s got stored signature of file %s with key %s",
+            user.email, file.filename, keyid,
+        )
+        return answer
+    logging.info(
+        "user %s has signed file %s with key %s",
+        user.email, file.filename, keyid,
+    )
+    return answer
+
+
+@router.post(
+    '/sign-stream',
+    response_class=PlainTextResponse,
+    responses={
+        status.HTTP_400_BAD_REQUEST: {"model": ErrMessage},
+        status.HTTP_413_REQUEST_ENTITY_TOO_LARGE: {"model": ErrMessage},
+    },
+    openapi_extra={
+        'requestBody': {
+            'required': True,
+            'content': {
+                'application/octet-stream': {
+                    'schema': {'type': 'string', 'format': 'binary'},
+                },
+            },
+        },
+    },
+)
+async def sign_stream(
+    request: Request,
+    keyid: str,
+    filename: Optional[str] = None,
+    sign_type: str = 'detach-sign',
+    sign_algo: str = 'SHA256',
+    timeout: Optional[float] = None,
     user: User = Depends(get_current_user),
     backend: SigningBackend = Depends(get_backend),
 ) -> str:
+    """
+    Sign the raw request body (application/octet-stream).
+
+    The body is passed to the signing backend chunk by chunk as it
+    arrives, without multipart parsing and spooling of the upload.
+    """
     if not backend.key_exists(keyid):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f'key {keyid} does not exist',
         )
+    content_length = request.headers.get('content-length', '')
+    if (
+        content_length.isdigit()
+        and int(content_length) > settings.max_upload_bytes
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f'file size exceeds {settings.max_upload_bytes} bytes',
+        )
     try:
-        answer = await backend.sign(
+        answer = await backend.sign_stream(
             keyid,
-            file,
+            request.stream(),
+            filename=filename,
             detach_sign=sign_type == 'detach-sign',
             digest_algo=sign_algo,
+            timeout=timeout,
         )
     except FileTooBigError:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             detail=f'file size exceeds {settings.max_upload_bytes} bytes',
         )
+    except LockTimeoutError as error:
+        raise key_busy_error(keyid, error)
     logging.info(
-        "user %s has signed file %s with key %s",
-        user.email, file.filename, keyid,
+        "user %s has signed stream %s with key %s",
+        user.email, filename, keyid,
     )
     return answer
 
 
-@router.post('/sign-batch', response_model=BatchSignResponse,
+@router.post('/sign-digest', response_class=PlainTextResponse,
              responses={status.HTTP_400_BAD_REQUEST: {"model": ErrMessage}})
+async def sign_digest(
+    sign_request: DigestSignRequest,
+    user: User = Depends(get_current_user),
+    backend: SigningBackend = Depends(get_backend),
+) -> str:
+    """
+    Sign a binary document hashed by the client (detached signature).
+
+    The client sends the hash state of the document after its last full
+    block (``hash_state``) and the signature trailer is hashed here, so
+    the file itself is never uploaded. If enabled, a final digest
+    including the trailer (``digest``) made for ``creation_time`` is
+    accepted too.
+    """
+    keyid = sign_request.keyid
+    if not backend.key_exists(keyid):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'key {keyid} does not exist',
+        )
+    hash_state = digest = creation_time = None
+    try:
+        if sign_request.hash_state is not None:
+            hash_state = HashState(
+                algorithm=sign_request.sign_algo,
+                state=bytes.fromhex(sign_request.hash_state.state),
+                length=sign_request.hash_state.length,
+                tail=bytes.fromhex(sign_request.hash_state.tail),
+            )
+        if sign_request.digest is not None:
+            digest = bytes.fromhex(sign_request.digest)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='hash state and digest must be hex encoded',
+        )
+    if digest is not None:
+        if not settings.sign_digest_allow_raw:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail='signing of final digests is disabled',
+            )
+        if (
+            sign_request.creation_time is None
+            or abs(time.time() - sign_request.creation_time)
+            > DIGEST_TIME_SKEW
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=(
+                    f'digest requires creation_time within '
+                    f'{DIGEST_TIME_SKEW} seconds from now'
+                ),
+            )
+        creation_time = datetime.fromtimestamp(
+            sign_request.creation_time, tz=timezone.utc
+        )
+    try:
+        answer = await backend.sign_hash(
+            keyid,
+            digest_algo=sign_request.sign_algo,
+            hash_state=hash_state,
+            digest=digest,
+            creation_time=creation_time,
+            filename=sign_request.filename,
+        )
+    except DigestSigningError as error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(error),
+        )
+    except LockTimeoutError as error:
+        raise key_busy_error(keyid, error)
+    logging.info(
+        "user %s has signed digest of %s with key %s",
+        user.email, sign_request.filename, keyid,
+    )
+    return answer
+
+
+async def _sign_uploads(
+    backend: SigningBackend,
+    keyid: str,
+    uploads: AsyncIterator[UploadFile],
+    parts_in_flight: int,
+    **sign_kwargs,
+) -> List[Tuple[str, str]]:
+    """
+    Signs files while the following ones are still being received.
+
+    At most ``parts_in_flight`` files are received or signed at a time,
+    the upload waits for a free slot. The backend applies its own per-key
+    limit on top of it. Stops at the first failure.
+    """
+    slots = asyncio.Semaphore(max(1, parts_in_flight))
+    tasks = []
+
+    async def sign_upload(upload: UploadFile) -> Tuple[str, str]:
+        try:
+            signature = await backend.sign_batch_part(
+                keyid, upload, **sign_kwargs
+            )
+            return upload.filename, signature
+        finally:
+            slots.release()
+
+    try:
+        while True:
+            await slots.acquire()
+            for task in tasks:
+                if task.done() and not task.cancelled() and task.exception():
+                    raise task.exception()
+            try:
+                upload = await uploads.__anext__()
+            except StopAsyncIteration:
+                break
+            tasks.append(asyncio.ensure_future(sign_upload(upload)))
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await uploads.aclose()
+        raise
+
+
+def _batch_response(
+    user: User,
+    keyid: str,
+    results_data: List[Tuple[str, str]],
+) -> BatchSignResponse:
+    if not results_data:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='No files provided for signing',
+        )
+
+    file_results = []
+    for filename, signature in results_data:
+        file_results.append(FileSignResult(
+            filename=filename,
+            success=True,
+            signature=signature,
+        ))
+        logging.info(
+            "user %s successfully signed file %s with key %s",
+            user.email, filename, keyid,
+        )
+
+    return BatchSignResponse(
+        results=file_results,
+        total=len(results_data),
+        successful=len(results_data),
+    )
+
+
+async def _hash_uploads(
+    uploads: AsyncIterator[UploadFile],
+    hashes: List[Tuple[str, str]],
+) -> AsyncIterator[UploadFile]:
+    """Records name and SHA-256 of every upload passing through."""
+    try:
+        async for upload in uploads:
+            hashes.append((upload.filename, await hash_upload(upload)))
+            yield upload
+    finally:
+        await uploads.aclose()
+
+
+@router.post(
+    '/sign-batch',
+    response_model=BatchSignResponse,
+    responses={status.HTTP_400_BAD_REQUEST: {"model": ErrMessage}},
+    openapi_extra={
+        'requestBody': {
+            'required': True,
+            'content': {
+                'multipart/form-data': {
+                    'schema': {
+                        'type': 'object',
+                        'required': ['files'],
+                        'properties': {
+                            'files': {
+                                'type': 'array',
+                                'items': {'type': 'string', 'format': 'binary'},
+                            },
+                        },
+                    },
+                },
+            },
+        },
+    },
+)
 async def sign_batch(
+    request: Request,
     keyid: str,
-    files: List[UploadFile] = File(...),
     sign_type: str = 'detach-sign',
     sign_algo: str = 'SHA256',
+    timeout: Optional[float] = None,
+    idempotency_key: Optional[str] = Header(default=None),
     user: User = Depends(get_current_user),
     backend: SigningBackend = Depends(get_backend),
 ) -> BatchSignResponse:
     """
     Sign multiple files asynchronously.
 
-    Processes all files concurrently using async operations for better
-    performance. Fails immediately if any file fails (fail-fast behavior).
+    The multipart body is parsed incrementally and every file is signed
+    as soon as it has arrived, so uploading and signing overlap. Fails
+    immediately if any file fails (fail-fast behavior). A retry with the
+    same Idempotency-Key header and files gets the results of the
+    original request, waiting for it if it still runs.
 
     Args:
         keyid: The key ID to use for signing
-        files: List of files to sign
+        files: List of files to sign (multipart field)
         sign_type: Signature type ('detach-sign' or 'clear-sign')
         sign_algo: Digest algorithm (default: 'SHA256')
+        timeout: Seconds to wait for a busy key (default: lock timeout)
+        idempotency_key: Key identifying retries of the request
         user: Authenticated user (from JWT token)
 
     Returns:
@@ -97,12 +472,6 @@ async def sign_batch(
     Raises:
         HTTPException: If any file fails to sign
     """
-    if not files:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail='No files provided for signing',
-        )
-
     if not backend.key_exists(keyid):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -110,39 +479,85 @@ async def sign_batch(
         )
 
     logging.info(
-        "user %s initiated batch signing of %d files with key %s",
-        user.email, len(files), keyid,
+        "user %s initiated batch signing with key %s", user.email, keyid,
+    )
+
+    uploads = iter_uploads(
+        request,
+        'files',
+        settings.max_upload_bytes,
+        spool_max_size=(
+            settings.get_spool_memory_threshold() or MULTIPART_SPOOL_SIZE
+        ),
     )
+    # content of the batch is known only once the whole body is read
+    hashes: List[Tuple[str, str]] = []
+    if idempotency_key is not None:
+        uploads = _hash_uploads(uploads, hashes)
 
     try:
-        results_data = await backend.sign_batch(
-            keyid=keyid,
-            files=files,
-            detach_sign=sign_type == 'detach-sign',
-            digest_algo=sign_algo,
+        async with idempotency.claim(
+            idempotency_scope(user, 'sign-batch', idempotency_key), timeout
+        ) as idempotent:
+            if idempotent.replayed:
+                async for upload in uploads:
+                    await upload.close()
+                response = BatchSignResponse(**idempotent.replay(
+                    request_fingerprint(keyid, sign_type, sign_algo, hashes)
+                ))
+                logging.info(
+                    "user %s got stored results of batch signing "
+                    "with key %s",
+                    user.email, keyid,
+                )
+                return response
+            results_data = await _sign_uploads(
+                backend,
+                keyid,
+                uploads,
+                settings.batch_parts_in_flight,
+                detach_sign=sign_type == 'detach-sign',
+                digest_algo=sign_algo,
+                timeout=timeout,
+            )
+            response = _batch_response(user, keyid, results_data)
+            await idempotent.complete(
+                request_fingerprint(keyid, sign_type, sign_algo, hashes),
+                response.model_dump(),
+            )
+    except MultipartError as error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(error),
         )
     except FileTooBigError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f'file size exceeds {settings.max_upload_bytes} bytes',
         )
+    except LockTimeoutError as error:
+        raise key_busy_error(keyid, error)
+    except (IdempotencyConflictError, IdempotencyMismatchError) as error:
+        raise idempotency_error(error)
+    return response
 
-    file_results = []
-    for filename, signature in results_data:
-        file_results.append(FileSignResult(
-            filename=filename,
-            success=True,
-            signature=signature,
-        ))
-        logging.info(
-            "user %s successfully signed file %s with key %s",
-            user.email, filename, keyid,
-        )
 
-    return BatchSignResponse(
-        results=file_results,
-        total=len(files),
-        successful=len(files),
+@router.get('/queue', response_model=QueueStatus,
+            responses={status.HTTP_400_BAD_REQUEST: {"model": ErrMessage}})
+async def queue(
+    keyid: str,
+    user: User = Depends(get_current_user),
+    backend: SigningBackend = Depends(get_backend),
+) -> QueueStatus:
+    if not backend.key_exists(keyid):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'key {keyid} does not exist',
+        )
+    return QueueStatus(
+        keyid=keyid,
+        depth=await backend.queue_depth(keyid),
+        limit=backend.concurrency_limit(keyid),
     )
 
 
@@ -39,3 +39,29 @@ class BatchSignResponse(BaseModel):
     results: List[FileSignResult]
     total: int
     successful: int
+
+
+class PartialHash(BaseModel):
+    # hex encoded state words of the hash after the last full block
+    state: str
+    # number of bytes processed into the state
+    length: int
+    # hex encoded bytes after the last full block
+    tail: str = ''
+
+
+class DigestSignRequest(BaseModel):
+    keyid: str
+    sign_algo: str = 'SHA256'
+    filename: Optional[str] = None
+    hash_state: Optional[PartialHash] = None
+    # hex encoded final digest including the signature trailer
+    digest: Optional[str] = None
+    # unix time of the signature, required with digest
+    creation_time: Optional[int] = None
+
+
+class QueueStatus(BaseModel):
+    keyid: str
+    depth: int
+    limit: Optional[int] = None
@@ -7,6 +7,7 @@ from fastapi import FastAPI
 from sign.api.routes import router
 from sign.config import settings
 from sign.db.helpers import db_is_connected
+from sign.signing.backend import close_signing_backend
 
 logging.basicConfig(
     level="INFO",
@@ -49,3 +50,11 @@ async def startup_event():
         "Application startup failed due to database connectivity issues"
     )
     sys.exit(1)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Release connections held by the signing backend.
+    """
+    await close_signing_backend()
@@ -0,0 +1,16 @@
+from sign.client.base import SignClientError
+
+__all__ = ['AsyncSignClient', 'SignClient', 'SignClientError']
+
+
+def __getattr__(name: str):
+    # the HTTP libraries are optional, import them only when used
+    if name == 'SignClient':
+        from sign.client.sync import SignClient
+
+        return SignClient
+    if name == 'AsyncSignClient':
+        from sign.client.aio import AsyncSignClient
+
+        return AsyncSignClient
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,299 @@
+"""
+Asynchronous sign-file client.
+
+Requires: httpx (the "client" extra)
+"""
+
+import asyncio
+import os
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import httpx
+except ImportError as e:
+    raise ImportError(
+        "httpx is required for the async sign-file client. "
+        "Install with: pip install sign[client]"
+    ) from e
+
+from sign.client.base import (
+    AUTH_ERRORS,
+    BATCH_CONCURRENCY,
+    BATCH_SIZE,
+    CHUNK_SIZE,
+    POOL_SIZE,
+    RETRIES,
+    TIMEOUT,
+    MultipartBody,
+    SignClientError,
+    Token,
+    batch_results,
+    chunked,
+    error_detail,
+    file_hash_state,
+    hash_state_json,
+    idempotency_key,
+)
+
+
+async def _read_file(path: str) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    file = await loop.run_in_executor(None, open, path, 'rb')
+    try:
+        while chunk := await loop.run_in_executor(None, file.read, CHUNK_SIZE):
+            yield chunk
+    finally:
+        file.close()
+
+
+async def _read_multipart(multipart: MultipartBody) -> AsyncIterator[bytes]:
+    for section in multipart.sections:
+        if isinstance(section, bytes):
+            yield section
+            continue
+        async for chunk in _read_file(section):
+            yield chunk
+
+
+class AsyncSignClient:
+    """
+    Asynchronous client of the sign-file service.
+
+    Same as ``SignClient``, but built on an httpx.AsyncClient, so many
+    files are signed concurrently by one event loop.
+
+    Usage:
+        async with AsyncSignClient(url, email, password) as client:
+            signature = await client.sign_file('repomd.xml', keyid)
+            signatures = await client.sign_files(rpm_paths, keyid)
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        email: str,
+        password: str,
+        pool_size: int = POOL_SIZE,
+        timeout: float = TIMEOUT,
+        retries: int = RETRIES,
+        batch_size: int = BATCH_SIZE,
+        batch_concurrency: int = BATCH_CONCURRENCY,
+    ):
+        """
+        Args:
+            base_url: URL of the service
+            email: Email of the service user
+            password: Password of the service user
+            pool_size: Max connections kept alive
+            timeout: Seconds to wait for a response
+            retries: Retries of a request after connection errors
+            batch_size: Files signed by one /sign-batch request
+            batch_concurrency: /sign-batch requests sent at once
+        """
+        self._credentials = {'email': email, 'password': password}
+        self._retries = retries
+        self._batch_size = batch_size
+        self._batch_concurrency = batch_concurrency
+        self._client = httpx.AsyncClient(
+            base_url=base_url.rstrip('/'),
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+            ),
+        )
+        self._token: Optional[Token] = None
+        self._token_lock = asyncio.Lock()
+
+    async def __aenter__(self) -> 'AsyncSignClient':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self._client.aclose()
+
+    @staticmethod
+    def _check(response: httpx.Response) -> httpx.Response:
+        if response.status_code >= 400:
+            raise SignClientError(
+                response.status_code, error_detail(response.content)
+            )
+        return response
+
+    async def token(self, renew: bool = False) -> str:
+        """Returns a valid JWT token, requests a new one if needed."""
+        async with self._token_lock:
+            if renew or self._token is None or not self._token.fresh():
+                response = self._check(
+                    await self._client.post('/token', json=self._credentials)
+                )
+                body = response.json()
+                self._token = Token(body['token'], body['exp'])
+            return self._token.token
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        headers: Optional[Dict[str, str]] = None,
+        content=None,
+        **kwargs,
+    ) -> httpx.Response:
+        """
+        Sends an authorized request.
+
+        ``content`` returns a new async iterator of the streamed body for
+        every attempt. A rejected token is renewed once.
+        """
+        headers = dict(headers or {})
+        renew = False
+        attempt = 0
+        while True:
+            headers['Authorization'] = f'Bearer {await self.token(renew)}'
+            try:
+                response = await self._client.request(
+                    method,
+                    path,
+                    headers=headers,
+                    content=content() if content else None,
+                    **kwargs,
+                )
+            except httpx.TransportError:
+                attempt += 1
+                if attempt > self._retries:
+                    raise
+                continue
+            if response.status_code in AUTH_ERRORS and not renew:
+                renew = True
+                continue
+            return self._check(response)
+
+    async def sign_file(
+        self,
+        path: str,
+        keyid: str,
+        sign_type: str = 'detach-sign',
+        sign_algo: str = 'SHA256',
+        key_timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Signs the file streamed from disk (/sign-stream).
+
+        Args:
+            path: Path of the file
+            keyid: Key to sign with
+            sign_type: 'detach-sign' or 'clear-sign'
+            sign_algo: Digest algorithm
+            key_timeout: Seconds the service waits for a busy key
+
+        Returns:
+            ASCII-armored signature
+        """
+        params = {
+            'keyid': keyid,
+            'filename': os.path.basename(path),
+            'sign_type': sign_type,
+            'sign_algo': sign_algo,
+        }
+        if key_timeout is not None:
+            params['timeout'] = key_timeout
+        response = await self._request(
+            'POST',
+            '/sign-stream',
+            content=lambda: _read_file(path),
+            params=params,
+            headers={
+                'Content-Type': 'application/octet-stream',
+                'Content-Length': str(os.path.getsize(path)),
+            },
+        )
+        return response.text
+
+    async def _sign_batch(
+        self,
+        paths: Sequence[str],
+        params: Dict[str, str],
+        slots: asyncio.Semaphore,
+    ) -> List[Tuple[str, str]]:
+        multipart = MultipartBody('files', paths)
+        async with slots:
+            response = await self._request(
+                'POST',
+                '/sign-batch',
+                content=lambda: _read_multipart(multipart),
+                params=params,
+                headers={
+                    'Content-Type': multipart.content_type,
+                    'Content-Length': str(len(multipart)),
+                    'Idempotency-Key': idempotency_key(),
+                },
+            )
+        return batch_results(paths, response.json())
+
+    async def sign_files(
+        self,
+        paths: Sequence[str],
+        keyid: str,
+        sign_type: str = 'detach-sign',
+        sign_algo: str = 'SHA256',
+        key_timeout: Optional[float] = None,
+    ) -> List[Tuple[str, str]]:
+        """
+        Signs the files with concurrent /sign-batch requests.
+
+        Files are split into batches of ``batch_size``, at most
+        ``batch_concurrency`` batches are uploaded at a time.
+
+        Returns:
+            List of (path, signature) in the order of the paths
+        """
+        params = {
+            'keyid': keyid,
+            'sign_type': sign_type,
+            'sign_algo': sign_algo,
+        }
+        if key_timeout is not None:
+            params['timeout'] = key_timeout
+        slots = asyncio.Semaphore(self._batch_concurrency)
+        results = await asyncio.gather(*(
+            self._sign_batch(batch, params, slots)
+            for batch in chunked(list(paths), self._batch_size)
+        ))
+        return [result for batch in results for result in batch]
+
+    async def sign_digest(
+        self,
+        path: str,
+        keyid: str,
+        sign_algo: str = 'SHA256',
+    ) -> str:
+        """
+        Signs the file hashed locally without uploading it (/sign-digest).
+
+        Returns:
+            ASCII-armored detached signature
+        """
+        loop = asyncio.get_running_loop()
+        state = await loop.run_in_executor(
+            None, file_hash_state, path, sign_algo
+        )
+        response = await self._request(
+            'POST',
+            '/sign-digest',
+            json={
+                'keyid': keyid,
+                'sign_algo': sign_algo,
+                'filename': os.path.basename(path),
+                'hash_state': hash_state_json(state),
+            },
+        )
+        return response.text
+
+    async def queue_depth(self, keyid: str) -> int:
+        """Returns number of requests queued for the key on the host."""
+        response = await self._request(
+            'GET', '/queue', params={'keyid': keyid}
+        )
+        return response.json()['depth']
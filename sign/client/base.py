@@ -0,0 +1,211 @@
+"""
+Parts of the sign-file clients shared by the sync and async variants.
+"""
+
+import ctypes
+import ctypes.util
+import json
+import os
+import struct
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+from sign.utils.sha2 import HashState, Sha2
+
+CHUNK_SIZE = 1024 * 1024
+BATCH_SIZE = 20
+BATCH_CONCURRENCY = 4
+POOL_SIZE = 10
+TIMEOUT = 300
+RETRIES = 2
+# a token is renewed this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 60
+
+# HTTP statuses of requests whose token has expired or was revoked
+AUTH_ERRORS = (401, 403)
+
+
+class SignClientError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f'{status_code}: {detail}')
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class Token:
+    token: str
+    # unix time of expiration
+    exp: int
+
+    def fresh(self, margin: float = TOKEN_REFRESH_MARGIN) -> bool:
+        return time.time() < self.exp - margin
+
+
+def error_detail(body: Union[str, bytes]) -> str:
+    """Returns ``detail`` of an error response, the body if it has none."""
+    try:
+        detail = json.loads(body)['detail']
+    except (ValueError, KeyError, TypeError):
+        return body.decode() if isinstance(body, bytes) else body
+    return detail if isinstance(detail, str) else json.dumps(detail)
+
+
+def chunked(items: Sequence[str], size: int) -> List[Sequence[str]]:
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def idempotency_key() -> str:
+    return uuid.uuid4().hex
+
+
+class MultipartBody:
+    """
+    multipart/form-data body of files read from disk while it is sent.
+
+    ``sections`` are the literal parts of the body and the paths of the
+    files in between, so sync and async senders read the files their
+    own way. The length is known upfront, so no chunked encoding is used.
+    """
+
+    def __init__(self, field_name: str, paths: Sequence[str]):
+        self.boundary = uuid.uuid4().hex
+        self.sections: List[Union[bytes, str]] = []
+        for path in paths:
+            filename = os.path.basename(path).replace('"', '%22')
+            self.sections.append(
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{field_name}"; '
+                f'filename="{filename}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n'.encode()
+            )
+            self.sections.append(path)
+            self.sections.append(b'\r\n')
+        self.sections.append(f'--{self.boundary}--\r\n'.encode())
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self) -> int:
+        return sum(
+            len(section) if isinstance(section, bytes)
+            else os.path.getsize(section)
+            for section in self.sections
+        )
+
+    def __iter__(self) -> Iterator[bytes]:
+        for section in self.sections:
+            if isinstance(section, bytes):
+                yield section
+                continue
+            with open(section, 'rb') as file:
+                while chunk := file.read(CHUNK_SIZE):
+                    yield chunk
+
+
+class _NativeSha2:
+    """
+    SHA-2 of OpenSSL's libcrypto exposing the intermediate state.
+
+    The SHA256_CTX and SHA512_CTX structures start with the eight state
+    words, which are the only part of the context read here. Only full
+    blocks are fed to the hash, so the byte counters and the block buffer
+    of the context never matter.
+    """
+
+    _lib: Optional[ctypes.CDLL] = None
+    _loaded = False
+
+    @classmethod
+    def load(cls) -> Optional[ctypes.CDLL]:
+        if cls._loaded:
+            return cls._lib
+        cls._loaded = True
+        name = ctypes.util.find_library('crypto')
+        try:
+            lib = ctypes.CDLL(name) if name else None
+        except OSError:
+            lib = None
+        # the low level API may be missing in future OpenSSL versions
+        if lib is not None and hasattr(lib, 'SHA512_Update'):
+            for function in (lib.SHA256_Update, lib.SHA512_Update):
+                function.argtypes = (
+                    ctypes.c_void_p,
+                    ctypes.c_char_p,
+                    ctypes.c_size_t,
+                )
+            cls._lib = lib
+        return cls._lib
+
+    def __init__(self, lib: ctypes.CDLL, algorithm: str):
+        wide = algorithm != 'SHA256'
+        # SHA384 shares the context and the update function with SHA512
+        self._update = lib.SHA512_Update if wide else lib.SHA256_Update
+        self._context = ctypes.create_string_buffer(256)
+        getattr(lib, f'{algorithm}_Init')(self._context)
+        self._word_type = ctypes.c_uint64 if wide else ctypes.c_uint32
+        self._word_format = '>8Q' if wide else '>8L'
+
+    def update(self, data: bytes):
+        self._update(self._context, data, len(data))
+
+    def state(self) -> bytes:
+        words = (self._word_type * 8).from_buffer(self._context)
+        return struct.pack(self._word_format, *words)
+
+
+def file_hash_state(
+    path: str,
+    algorithm: str = 'SHA256',
+    chunk_size: int = CHUNK_SIZE,
+) -> HashState:
+    """
+    Returns the SHA-2 state of the file for the /sign-digest endpoint.
+
+    The file is hashed by libcrypto if it is available, the pure Python
+    implementation is used otherwise (which is slow for large files).
+    """
+    algorithm = algorithm.upper()
+    lib = _NativeSha2.load()
+    if lib is None or algorithm not in ('SHA256', 'SHA384', 'SHA512'):
+        hasher = Sha2(algorithm)
+        with open(path, 'rb') as file:
+            while chunk := file.read(chunk_size):
+                hasher.update(chunk)
+        return hasher.export()
+
+    block_size = 64 if algorithm == 'SHA256' else 128
+    hasher = _NativeSha2(lib, algorithm)
+    length = 0
+    tail = b''
+    with open(path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            data = tail + chunk if tail else chunk
+            # only whole blocks are hashed, so no data stays in the context
+            full = len(data) - len(data) % block_size
+            hasher.update(data[:full])
+            tail = data[full:]
+            length += full
+    return HashState(algorithm, hasher.state(), length, tail)
+
+
+def hash_state_json(state: HashState) -> dict:
+    return {
+        'state': state.state.hex(),
+        'length': state.length,
+        'tail': state.tail.hex(),
+    }
+
+
+def batch_results(
+    paths: Sequence[str],
+    response: dict,
+) -> List[Tuple[str, str]]:
+    """Pairs the paths with signatures of a /sign-batch response."""
+    return [
+        (path, result['signature'])
+        for path, result in zip(paths, response['results'])
+    ]
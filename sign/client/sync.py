@@ -0,0 +1,285 @@
+"""
+Synchronous sign-file client.
+
+Requires: requests (the "client" extra)
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError as e:
+    raise ImportError(
+        "requests is required for the sign-file client. "
+        "Install with: pip install sign[client]"
+    ) from e
+
+from sign.client.base import (
+    AUTH_ERRORS,
+    BATCH_CONCURRENCY,
+    BATCH_SIZE,
+    CHUNK_SIZE,
+    POOL_SIZE,
+    RETRIES,
+    TIMEOUT,
+    MultipartBody,
+    SignClientError,
+    Token,
+    batch_results,
+    chunked,
+    error_detail,
+    file_hash_state,
+    hash_state_json,
+    idempotency_key,
+)
+
+
+class _FileBody:
+    """File streamed as a request body, requests sends its length."""
+
+    def __init__(self, path: str):
+        self._path = path
+
+    def __len__(self) -> int:
+        return os.path.getsize(self._path)
+
+    def __iter__(self):
+        with open(self._path, 'rb') as file:
+            while chunk := file.read(CHUNK_SIZE):
+                yield chunk
+
+
+class SignClient:
+    """
+    Client of the sign-file service.
+
+    Connections are kept alive in a pool shared by all threads, the JWT
+    token is requested once and renewed shortly before it expires. Files
+    are streamed from disk, never read into memory as a whole. Batches
+    carry an Idempotency-Key, so a batch retried after a connection
+    error isn't signed twice.
+
+    Usage:
+        with SignClient('http://localhost:8000', email, password) as client:
+            signature = client.sign_file('repomd.xml', keyid)
+            signatures = client.sign_files(rpm_paths, keyid)
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        email: str,
+        password: str,
+        pool_size: int = POOL_SIZE,
+        timeout: float = TIMEOUT,
+        retries: int = RETRIES,
+        batch_size: int = BATCH_SIZE,
+        batch_concurrency: int = BATCH_CONCURRENCY,
+    ):
+        """
+        Args:
+            base_url: URL of the service
+            email: Email of the service user
+            password: Password of the service user
+            pool_size: Max connections kept alive
+            timeout: Seconds to wait for a response
+            retries: Retries of a request after connection errors
+            batch_size: Files signed by one /sign-batch request
+            batch_concurrency: /sign-batch requests sent at once
+        """
+        self._base_url = base_url.rstrip('/')
+        self._credentials = {'email': email, 'password': password}
+        self._timeout = timeout
+        self._retries = retries
+        self._batch_size = batch_size
+        self._batch_concurrency = batch_concurrency
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._token: Optional[Token] = None
+        self._token_lock = threading.Lock()
+
+    def __enter__(self) -> 'SignClient':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._session.close()
+
+    def _check(self, response: requests.Response) -> requests.Response:
+        if response.status_code >= 400:
+            raise SignClientError(
+                response.status_code, error_detail(response.content)
+            )
+        return response
+
+    def token(self, renew: bool = False) -> str:
+        """Returns a valid JWT token, requests a new one if needed."""
+        with self._token_lock:
+            if renew or self._token is None or not self._token.fresh():
+                response = self._check(self._session.post(
+                    f'{self._base_url}/token',
+                    json=self._credentials,
+                    timeout=self._timeout,
+                ))
+                body = response.json()
+                self._token = Token(body['token'], body['exp'])
+            return self._token.token
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs,
+    ) -> requests.Response:
+        """
+        Sends an authorized request.
+
+        Streamed bodies are read from disk again for every attempt.
+        A rejected token is renewed once.
+        """
+        headers = dict(headers or {})
+        renew = False
+        attempt = 0
+        while True:
+            headers['Authorization'] = f'Bearer {self.token(renew)}'
+            try:
+                response = self._session.request(
+                    method,
+                    f'{self._base_url}{path}',
+                    headers=headers,
+                    timeout=self._timeout,
+                    **kwargs,
+                )
+            except requests.ConnectionError:
+                attempt += 1
+                if attempt > self._retries:
+                    raise
+                continue
+            if response.status_code in AUTH_ERRORS and not renew:
+                renew = True
+                continue
+            return self._check(response)
+
+    def sign_file(
+        self,
+        path: str,
+        keyid: str,
+        sign_type: str = 'detach-sign',
+        sign_algo: str = 'SHA256',
+        key_timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Signs the file streamed from disk (/sign-stream).
+
+        Args:
+            path: Path of the file
+            keyid: Key to sign with
+            sign_type: 'detach-sign' or 'clear-sign'
+            sign_algo: Digest algorithm
+            key_timeout: Seconds the service waits for a busy key
+
+        Returns:
+            ASCII-armored signature
+        """
+        params = {
+            'keyid': keyid,
+            'filename': os.path.basename(path),
+            'sign_type': sign_type,
+            'sign_algo': sign_algo,
+        }
+        if key_timeout is not None:
+            params['timeout'] = key_timeout
+        return self._request(
+            'POST',
+            '/sign-stream',
+            data=_FileBody(path),
+            params=params,
+            headers={'Content-Type': 'application/octet-stream'},
+        ).text
+
+    def _sign_batch(
+        self,
+        paths: Sequence[str],
+        params: Dict[str, str],
+    ) -> List[Tuple[str, str]]:
+        multipart = MultipartBody('files', paths)
+        response = self._request(
+            'POST',
+            '/sign-batch',
+            data=multipart,
+            params=params,
+            headers={
+                'Content-Type': multipart.content_type,
+                'Idempotency-Key': idempotency_key(),
+            },
+        )
+        return batch_results(paths, response.json())
+
+    def sign_files(
+        self,
+        paths: Sequence[str],
+        keyid: str,
+        sign_type: str = 'detach-sign',
+        sign_algo: str = 'SHA256',
+        key_timeout: Optional[float] = None,
+    ) -> List[Tuple[str, str]]:
+        """
+        Signs the files with concurrent /sign-batch requests.
+
+        Files are split into batches of ``batch_size``, at most
+        ``batch_concurrency`` batches are uploaded at a time.
+
+        Returns:
+            List of (path, signature) in the order of the paths
+        """
+        params = {
+            'keyid': keyid,
+            'sign_type': sign_type,
+            'sign_algo': sign_algo,
+        }
+        if key_timeout is not None:
+            params['timeout'] = key_timeout
+        batches = chunked(list(paths), self._batch_size)
+        with ThreadPoolExecutor(self._batch_concurrency) as executor:
+            results = executor.map(
+                lambda batch: self._sign_batch(batch, params), batches
+            )
+            return [result for batch in results for result in batch]
+
+    def sign_digest(
+        self,
+        path: str,
+        keyid: str,
+        sign_algo: str = 'SHA256',
+    ) -> str:
+        """
+        Signs the file hashed locally without uploading it (/sign-digest).
+
+        Returns:
+            ASCII-armored detached signature
+        """
+        state = file_hash_state(path, sign_algo)
+        return self._request(
+            'POST',
+            '/sign-digest',
+            json={
+                'keyid': keyid,
+                'sign_algo': sign_algo,
+                'filename': os.path.basename(path),
+                'hash_state': hash_state_json(state),
+            },
+        ).text
+
+    def queue_depth(self, keyid: str) -> int:
+        """Returns number of requests queued for the key on the host."""
+        response = self._request('GET', '/queue', params={'keyid': keyid})
+        return response.json()['depth']
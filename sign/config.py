@@ -13,6 +13,18 @@ MAX_UPLOAD_BYTES_DEFAULT = 100000000
 PASS_DB_DEV_PASS_DEFAULT = ""
 PASS_DB_DEV_MODE_DEFAULT = False
 TMP_FILE_DIR_DEFAULT = "/tmp"
+SPOOL_BACKEND_DEFAULT = "disk"
+BATCH_PARTS_IN_FLIGHT_DEFAULT = 4
+SPOOL_MEMORY_THRESHOLD_DEFAULT = 16 * 1024 * 1024
+SIGNATURE_TIME_WINDOW_DEFAULT = 0
+SIGNATURE_CACHE_ENABLED_DEFAULT = False
+SIGNATURE_CACHE_DIR_DEFAULT = "/tmp/sign-file-cache"
+SIGNATURE_CACHE_TTL_DEFAULT = 86400
+SIGNATURE_CACHE_MEMORY_ENTRIES_DEFAULT = 1024
+SIGNATURE_CACHE_MAX_BYTES_DEFAULT = 256 * 1024 * 1024
+IDEMPOTENCY_DIR_DEFAULT = "/tmp/sign-file-idempotency"
+IDEMPOTENCY_TTL_DEFAULT = 600
+SIGN_DIGEST_ALLOW_RAW_DEFAULT = False
 DB_URL_DEFAULT = "sqlite:///./sign-file.sqlite3"
 JWT_EXPIRE_MINUTES_DEFAULT = 30
 JWT_ALGORITHM_DEFAULT = "HS256"
@@ -22,6 +34,13 @@ SENTRY_DSN = ''
 SENTRY_TRACES_SAMPLE_RATE = 0.2
 SENTRY_ENV = 'dev'
 GPG_LOCKS_DIR = '/tmp/gpg_locks'
+GPG_AGENT_POOL_SIZE_DEFAULT = 4
+GPG_AGENT_POOL_MAX_USES_DEFAULT = 1000
+GPG_AGENT_HEALTH_CHECK_INTERVAL_DEFAULT = 30
+GPG_SIGNING_ENGINE_DEFAULT = "gpg"
+GPG_STREAM_UPLOADS_DEFAULT = False
+GPG_SIGN_CONCURRENCY_DEFAULT = 4
+GPG_LOCK_TIMEOUT_DEFAULT = None
 DB_POOL_SIZE_DEFAULT = 5
 DB_MAX_OVERFLOW_DEFAULT = 10
 DB_POOL_RECYCLE_DEFAULT = 3600
@@ -30,7 +49,12 @@ DB_ECHO_DEFAULT = False
 SIGNING_BACKEND_DEFAULT = "gpg"
 KMS_SIGNING_ALGORITHM_DEFAULT = "RSASSA_PKCS1_V1_5_SHA_256"
 KMS_MAX_WORKERS_DEFAULT = 10
+KMS_TRANSPORT_DEFAULT = "boto3"
+SOFTKEY_WORKERS_DEFAULT = None
 CONFIG_FILE_DEFAULT = "/etc/sign-file/config.yaml"
+YUBIKEY_RESTART_POLICY_DEFAULT = "burst"
+YUBIKEY_RESTART_DELAY_DEFAULT = 10
+YUBIKEY_QUEUE_MAX_DEPTH_DEFAULT = 0
 
 
 def load_yaml_config(config_path: str) -> dict:
@@ -78,6 +102,68 @@ class Settings(BaseSettings):
         default=TMP_FILE_DIR_DEFAULT,
         description="dir to store temp files",
     )
+    batch_parts_in_flight: int = Field(
+        default=BATCH_PARTS_IN_FLIGHT_DEFAULT,
+        description=(
+            "max files of a /sign-batch request received or signed at once"
+        ),
+    )
+    spool_backend: str = Field(
+        default=SPOOL_BACKEND_DEFAULT,
+        description=(
+            "where uploads are spooled for signing: 'disk' (tmp_dir) or "
+            "'memfd' (memory, tmp_dir above spool_memory_threshold)"
+        ),
+    )
+    spool_memory_threshold: int = Field(
+        default=SPOOL_MEMORY_THRESHOLD_DEFAULT,
+        description="max bytes of an upload kept in memory by memfd spool",
+    )
+    signature_time_window: int = Field(
+        default=SIGNATURE_TIME_WINDOW_DEFAULT,
+        description=(
+            "round signature creation time down to multiples of N seconds, "
+            "so identical requests get identical signatures (0: exact time)"
+        ),
+    )
+    signature_cache_enabled: bool = Field(
+        default=SIGNATURE_CACHE_ENABLED_DEFAULT,
+        description=(
+            "serve signatures of already signed content from cache; "
+            "/sign-stream bodies are received before they are signed"
+        ),
+    )
+    signature_cache_dir: str = Field(
+        default=SIGNATURE_CACHE_DIR_DEFAULT,
+        description="dir of the signature cache shared by workers",
+    )
+    signature_cache_ttl: int = Field(
+        default=SIGNATURE_CACHE_TTL_DEFAULT,
+        description="seconds a cached signature is served",
+    )
+    signature_cache_memory_entries: int = Field(
+        default=SIGNATURE_CACHE_MEMORY_ENTRIES_DEFAULT,
+        description="signatures kept in memory of every worker",
+    )
+    signature_cache_max_bytes: int = Field(
+        default=SIGNATURE_CACHE_MAX_BYTES_DEFAULT,
+        description="max size of the signature cache dir, 0 means unlimited",
+    )
+    idempotency_dir: str = Field(
+        default=IDEMPOTENCY_DIR_DEFAULT,
+        description="dir of results of requests with Idempotency-Key",
+    )
+    idempotency_ttl: int = Field(
+        default=IDEMPOTENCY_TTL_DEFAULT,
+        description="seconds a result is returned to retried requests",
+    )
+    sign_digest_allow_raw: bool = Field(
+        default=SIGN_DIGEST_ALLOW_RAW_DEFAULT,
+        description=(
+            "accept final digests in /sign-digest, clients can then get "
+            "any kind of signature made, e.g. key certifications"
+        ),
+    )
     pgp_keys: List[str] = Field(
         default=[],
         description="list of GPG key IDs to use",
@@ -142,9 +228,47 @@ class Settings(BaseSettings):
         default=GPG_LOCKS_DIR,
         description="directory to store locks for gpg",
     )
+    gpg_lock_timeout: Optional[float] = Field(
+        default=GPG_LOCK_TIMEOUT_DEFAULT,
+        description="max seconds to wait for gpg locks, wait forever if unset",
+    )
+    gpg_agent_pool_size: int = Field(
+        default=GPG_AGENT_POOL_SIZE_DEFAULT,
+        description="number of gpg-agent connections kept per key",
+    )
+    gpg_agent_pool_max_uses: int = Field(
+        default=GPG_AGENT_POOL_MAX_USES_DEFAULT,
+        description="recycle gpg-agent connection after N signatures",
+    )
+    gpg_agent_health_check_interval: float = Field(
+        default=GPG_AGENT_HEALTH_CHECK_INTERVAL_DEFAULT,
+        description="check idle gpg-agent connection after N seconds",
+    )
+    gpg_signing_engine: str = Field(
+        default=GPG_SIGNING_ENGINE_DEFAULT,
+        description=(
+            "how GPG backend signs files: 'gpg' runs gpg binary, 'agent' "
+            "hashes files in process and sends digests to gpg-agent"
+        ),
+    )
+    gpg_stream_uploads: bool = Field(
+        default=GPG_STREAM_UPLOADS_DEFAULT,
+        description="pipe uploads into gpg stdin instead of temp files",
+    )
+    gpg_sign_concurrency: int = Field(
+        default=GPG_SIGN_CONCURRENCY_DEFAULT,
+        description=(
+            "number of files signed at once per key in batch requests, "
+            "Yubikey-backed keys default to 1"
+        ),
+    )
+    gpg_key_concurrency: Dict[str, int] = Field(
+        default_factory=dict,
+        description="per-key override of gpg_sign_concurrency",
+    )
     signing_backend: str = Field(
         default=SIGNING_BACKEND_DEFAULT,
-        description="signing backend to use: 'gpg' or 'kms'",
+        description="signing backend to use: 'gpg', 'kms' or 'softkey'",
     )
     kms_access_key_id: Optional[str] = Field(
         default=None,
@@ -158,6 +282,10 @@ class Settings(BaseSettings):
         default=None,
         description="AWS region for KMS",
     )
+    kms_endpoint_url: Optional[str] = Field(
+        default=None,
+        description="KMS endpoint URL of kms_region, e.g. a VPC endpoint",
+    )
     kms_signing_algorithm: str = Field(
         default=KMS_SIGNING_ALGORITHM_DEFAULT,
         description="KMS signing algorithm",
@@ -166,9 +294,33 @@ class Settings(BaseSettings):
         default=KMS_MAX_WORKERS_DEFAULT,
         description="max concurrent KMS signing operations",
     )
+    kms_transport: str = Field(
+        default=KMS_TRANSPORT_DEFAULT,
+        description=(
+            "KMS signing transport: 'boto3' (thread pool) or 'async' "
+            "(asyncio HTTP client)"
+        ),
+    )
     kms_keys: List[dict] = Field(
         default=[],
-        description="list of KMS keys with kms_id and gpg_fingerprint",
+        description=(
+            "list of KMS keys with kms_id and gpg_fingerprint, and "
+            "optionally the regional replicas of multi-region keys"
+        ),
+    )
+    softkey_workers: Optional[int] = Field(
+        default=SOFTKEY_WORKERS_DEFAULT,
+        description=(
+            "number of software key signing processes, defaults to the "
+            "number of CPUs, 0 signs in threads"
+        ),
+    )
+    softkey_keys: List[dict] = Field(
+        default=[],
+        description=(
+            "list of software keys with key_file (PEM RSA private key), "
+            "public_key_file (exported PGP public key) and gpg_fingerprint"
+        ),
     )
     yubikey_keyids: List[str] = Field(
         default_factory=list,
@@ -179,6 +331,37 @@ class Settings(BaseSettings):
         ),
         env="SF_YUBIKEY_KEYIDS",
     )
+    yubikey_restart_policy: str = Field(
+        default=YUBIKEY_RESTART_POLICY_DEFAULT,
+        description=(
+            "when gpg-agent is restarted after Yubikey operations: 'always', "
+            "'burst' (once requests drain) or 'on_error'"
+        ),
+    )
+    yubikey_restart_delay: float = Field(
+        default=YUBIKEY_RESTART_DELAY_DEFAULT,
+        description="idle seconds after a Yubikey burst before the restart",
+    )
+    yubikey_cards: Dict[str, List[Dict[str, str]]] = Field(
+        default_factory=dict,
+        description=(
+            "per-key list of Yubikeys holding the same signing key, each "
+            "with its serial and own GnuPG homedir"
+        ),
+    )
+    yubikey_queue_max_depth: int = Field(
+        default=YUBIKEY_QUEUE_MAX_DEPTH_DEFAULT,
+        description=(
+            "max requests queued for a Yubikey key on the host, "
+            "0 means unlimited"
+        ),
+    )
+
+    def get_spool_memory_threshold(self) -> int:
+        """Get max bytes of an upload spooled in memory, 0 if disabled."""
+        if self.spool_backend == 'memfd':
+            return self.spool_memory_threshold
+        return 0
 
     def get_kms_key_ids(self) -> List[str]:
         """Get list of KMS key IDs from config."""
@@ -192,6 +375,30 @@ class Settings(BaseSettings):
             if 'kms_id' in k and 'gpg_fingerprint' in k
         }
 
+    def get_kms_replicas(self) -> Dict[str, List[dict]]:
+        """Get mapping of KMS key ID to its regional replicas."""
+        return {
+            k['kms_id']: k['replicas']
+            for k in self.kms_keys
+            if 'kms_id' in k and k.get('replicas')
+        }
+
+    def get_softkey_files(self) -> Dict[str, str]:
+        """Get mapping of GPG fingerprint to software key file."""
+        return {
+            k['gpg_fingerprint']: k['key_file']
+            for k in self.softkey_keys
+            if 'gpg_fingerprint' in k and 'key_file' in k
+        }
+
+    def get_softkey_public_keys(self) -> Dict[str, str]:
+        """Get mapping of GPG fingerprint to software key public key."""
+        return {
+            k['gpg_fingerprint']: k['public_key_file']
+            for k in self.softkey_keys
+            if 'gpg_fingerprint' in k and 'public_key_file' in k
+        }
+
     class Config:
         case_sensitive = False
 
@@ -220,6 +427,38 @@ def create_settings() -> Settings:
             flat_config['gpg_locks_dir'] = gpg['locks_dir']
         if 'keys' in gpg:
             flat_config['pgp_keys'] = gpg['keys']
+        if 'yubikey_restart_policy' in gpg:
+            flat_config['yubikey_restart_policy'] = gpg[
+                'yubikey_restart_policy'
+            ]
+        if 'yubikey_restart_delay' in gpg:
+            flat_config['yubikey_restart_delay'] = gpg['yubikey_restart_delay']
+        if 'yubikey_cards' in gpg:
+            flat_config['yubikey_cards'] = gpg['yubikey_cards']
+        if 'yubikey_queue_max_depth' in gpg:
+            flat_config['yubikey_queue_max_depth'] = gpg[
+                'yubikey_queue_max_depth'
+            ]
+        if 'lock_timeout' in gpg:
+            flat_config['gpg_lock_timeout'] = gpg['lock_timeout']
+        if 'agent_pool_size' in gpg:
+            flat_config['gpg_agent_pool_size'] = gpg['agent_pool_size']
+        if 'agent_pool_max_uses' in gpg:
+            flat_config['gpg_agent_pool_max_uses'] = gpg[
+                'agent_pool_max_uses'
+            ]
+        if 'sign_concurrency' in gpg:
+            flat_config['gpg_sign_concurrency'] = gpg['sign_concurrency']
+        if 'key_concurrency' in gpg:
+            flat_config['gpg_key_concurrency'] = gpg['key_concurrency']
+        if 'stream_uploads' in gpg:
+            flat_config['gpg_stream_uploads'] = gpg['stream_uploads']
+        if 'signing_engine' in gpg:
+            flat_config['gpg_signing_engine'] = gpg['signing_engine']
+        if 'agent_health_check_interval' in gpg:
+            flat_config['gpg_agent_health_check_interval'] = gpg[
+                'agent_health_check_interval'
+            ]
 
     if 'database' in yaml_config:
         db = yaml_config['database']
@@ -265,17 +504,66 @@ def create_settings() -> Settings:
             flat_config['kms_secret_access_key'] = kms['secret_access_key']
         if 'region' in kms:
             flat_config['kms_region'] = kms['region']
+        if 'endpoint_url' in kms:
+            flat_config['kms_endpoint_url'] = kms['endpoint_url']
         if 'signing_algorithm' in kms:
             flat_config['kms_signing_algorithm'] = kms['signing_algorithm']
         if 'max_workers' in kms:
             flat_config['kms_max_workers'] = kms['max_workers']
+        if 'transport' in kms:
+            flat_config['kms_transport'] = kms['transport']
         if 'keys' in kms:
             flat_config['kms_keys'] = kms['keys']
 
+    if 'softkey' in yaml_config:
+        softkey = yaml_config['softkey']
+        if 'workers' in softkey:
+            flat_config['softkey_workers'] = softkey['workers']
+        if 'keys' in softkey:
+            flat_config['softkey_keys'] = softkey['keys']
+
     if 'max_upload_bytes' in yaml_config:
         flat_config['max_upload_bytes'] = yaml_config['max_upload_bytes']
     if 'tmp_dir' in yaml_config:
         flat_config['tmp_dir'] = yaml_config['tmp_dir']
+    if 'batch_parts_in_flight' in yaml_config:
+        flat_config['batch_parts_in_flight'] = yaml_config[
+            'batch_parts_in_flight'
+        ]
+    if 'spool_backend' in yaml_config:
+        flat_config['spool_backend'] = yaml_config['spool_backend']
+    if 'spool_memory_threshold' in yaml_config:
+        flat_config['spool_memory_threshold'] = yaml_config[
+            'spool_memory_threshold'
+        ]
+    if 'signature_time_window' in yaml_config:
+        flat_config['signature_time_window'] = yaml_config[
+            'signature_time_window'
+        ]
+    if 'signature_cache' in yaml_config:
+        cache = yaml_config['signature_cache']
+        if 'enabled' in cache:
+            flat_config['signature_cache_enabled'] = cache['enabled']
+        if 'dir' in cache:
+            flat_config['signature_cache_dir'] = cache['dir']
+        if 'ttl' in cache:
+            flat_config['signature_cache_ttl'] = cache['ttl']
+        if 'memory_entries' in cache:
+            flat_config['signature_cache_memory_entries'] = cache[
+                'memory_entries'
+            ]
+        if 'max_bytes' in cache:
+            flat_config['signature_cache_max_bytes'] = cache['max_bytes']
+    if 'sign_digest_allow_raw' in yaml_config:
+        flat_config['sign_digest_allow_raw'] = yaml_config[
+            'sign_digest_allow_raw'
+        ]
+    if 'idempotency' in yaml_config:
+        idempotency = yaml_config['idempotency']
+        if 'dir' in idempotency:
+            flat_config['idempotency_dir'] = idempotency['dir']
+        if 'ttl' in idempotency:
+            flat_config['idempotency_ttl'] = idempotency['ttl']
     if 'root_url' in yaml_config:
         flat_config['root_url'] = yaml_config['root_url']
     if 'service' in yaml_config:
@@ -285,8 +573,29 @@ def create_settings() -> Settings:
         'SF_GPG_BINARY': 'gpg_binary',
         'SF_KEYRING': 'keyring',
         'SF_GPG_LOCKS_DIR': 'gpg_locks_dir',
+        'SF_GPG_LOCK_TIMEOUT': 'gpg_lock_timeout',
+        'SF_GPG_SIGNING_ENGINE': 'gpg_signing_engine',
+        'SF_GPG_STREAM_UPLOADS': 'gpg_stream_uploads',
+        'SF_GPG_SIGN_CONCURRENCY': 'gpg_sign_concurrency',
+        'SF_GPG_AGENT_POOL_SIZE': 'gpg_agent_pool_size',
+        'SF_GPG_AGENT_POOL_MAX_USES': 'gpg_agent_pool_max_uses',
+        'SF_GPG_AGENT_HEALTH_CHECK_INTERVAL': (
+            'gpg_agent_health_check_interval'
+        ),
         'SF_MAX_UPLOAD_BYTES': 'max_upload_bytes',
         'SF_TMP_FILE_DIR': 'tmp_dir',
+        'SF_BATCH_PARTS_IN_FLIGHT': 'batch_parts_in_flight',
+        'SF_SPOOL_BACKEND': 'spool_backend',
+        'SF_SPOOL_MEMORY_THRESHOLD': 'spool_memory_threshold',
+        'SF_SIGNATURE_TIME_WINDOW': 'signature_time_window',
+        'SF_SIGNATURE_CACHE_ENABLED': 'signature_cache_enabled',
+        'SF_SIGNATURE_CACHE_DIR': 'signature_cache_dir',
+        'SF_SIGNATURE_CACHE_TTL': 'signature_cache_ttl',
+        'SF_SIGNATURE_CACHE_MEMORY_ENTRIES': 'signature_cache_memory_entries',
+        'SF_SIGNATURE_CACHE_MAX_BYTES': 'signature_cache_max_bytes',
+        'SF_IDEMPOTENCY_DIR': 'idempotency_dir',
+        'SF_IDEMPOTENCY_TTL': 'idempotency_ttl',
+        'SF_SIGN_DIGEST_ALLOW_RAW': 'sign_digest_allow_raw',
         'SF_DB_URL': 'db_url',
         'SF_DB_POOL_SIZE': 'db_pool_size',
         'SF_DB_MAX_OVERFLOW': 'db_max_overflow',
@@ -305,8 +614,14 @@ def create_settings() -> Settings:
         'SF_KMS_ACCESS_KEY_ID': 'kms_access_key_id',
         'SF_KMS_SECRET_ACCESS_KEY': 'kms_secret_access_key',
         'SF_KMS_REGION': 'kms_region',
+        'SF_KMS_ENDPOINT_URL': 'kms_endpoint_url',
         'SF_KMS_SIGNING_ALGORITHM': 'kms_signing_algorithm',
         'SF_KMS_MAX_WORKERS': 'kms_max_workers',
+        'SF_KMS_TRANSPORT': 'kms_transport',
+        'SF_SOFTKEY_WORKERS': 'softkey_workers',
+        'SF_YUBIKEY_RESTART_POLICY': 'yubikey_restart_policy',
+        'SF_YUBIKEY_RESTART_DELAY': 'yubikey_restart_delay',
+        'SF_YUBIKEY_QUEUE_MAX_DEPTH': 'yubikey_queue_max_depth',
         'SF_PASS_DB_DEV_MODE': 'pass_db_dev_mode',
         'SF_PASS_DB_DEV_PASS': 'pass_db_dev_pass',
     }
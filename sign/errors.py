@@ -2,4 +2,31 @@ class UserNotFoundError(Exception):
     pass
 
 class FileTooBigError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class LockTimeoutError(TimeoutError):
+    pass
+
+
+class QueueRejectedError(LockTimeoutError):
+    def __init__(self, message: str, depth: int, retry_after: float):
+        super().__init__(message)
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+class MultipartError(ValueError):
+    pass
+
+
+class DigestSigningError(ValueError):
+    pass
+
+
+class IdempotencyConflictError(Exception):
+    pass
+
+
+class IdempotencyMismatchError(ValueError):
+    pass
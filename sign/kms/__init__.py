@@ -1,3 +1,9 @@
-from sign.kms.kms import KMS
-
 __all__ = ['KMS']
+
+
+def __getattr__(name):
+    # boto3 is imported with the backend, not with sign.kms.pgp_wrapper
+    if name == 'KMS':
+        from sign.kms.kms import KMS
+        return KMS
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
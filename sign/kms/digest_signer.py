@@ -0,0 +1,371 @@
+"""
+Signing backend base for signers of raw RSA digests.
+
+Documents are hashed in process, the signer only signs the PGP digest
+and the raw signature is wrapped in OpenPGP packets. The KMS and the
+software key backends share everything but signing the digest.
+"""
+
+import asyncio
+import functools
+import logging
+import syslog
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from fastapi import UploadFile
+
+from sign.errors import FileTooBigError
+from sign.kms.pgp_wrapper import (
+    DocumentHasher,
+    finish_pgp_hash,
+    wrap_signature_as_pgp,
+)
+from sign.utils.clock import signature_time
+from sign.utils.sha2 import HashState
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class DigestSigner:
+    """
+    Base of the backends signing PGP digests with raw RSA signatures.
+
+    Subclasses set ``signer_name``, ``_max_upload_bytes`` and
+    ``_signature_time_window``, and implement ``key_exists``,
+    ``get_gpg_fingerprint`` and ``_sign_raw``.
+    """
+
+    # name of the signer in the logs and in the audit records
+    signer_name = 'Digest'
+    _max_upload_bytes: int
+    _signature_time_window: int
+
+    def key_exists(self, keyid: str) -> bool:
+        raise NotImplementedError
+
+    def get_gpg_fingerprint(self, keyid: str) -> str:
+        raise NotImplementedError
+
+    async def _sign_raw(
+        self,
+        keyid: str,
+        digest: bytes,
+        digest_algo: str,
+        timeout: Optional[float],
+    ) -> bytes:
+        """
+        Sign the PGP digest.
+
+        Raises:
+            RuntimeError: If the digest could not be signed
+        """
+        raise NotImplementedError
+
+    def _check_digest_algo(self, keyid: str, digest_algo: str):
+        """
+        Check that the key signs digests hashed by the client.
+
+        Raises:
+            DigestSigningError: If the key signs other digests
+        """
+
+    def _log_signing_event(
+        self, filename: str, keyid: str, hash_before: str, success: bool
+    ):
+        """Log signing event to syslog for audit."""
+        status = "SUCCESS" if success else "FAILED"
+        message = (
+            f"{self.signer_name} Sign {status}: file={filename} "
+            f"key={keyid} hash={hash_before}"
+        )
+        try:
+            syslog.syslog(syslog.LOG_INFO, message)
+        except Exception:
+            logger.info(message)
+
+    def audit_log(self, keyid: str, filename: Optional[str], file_hash: str):
+        """Log a signature served without signing to syslog for audit."""
+        self._log_signing_event(filename or 'unknown', keyid, file_hash, True)
+
+    def _hash_file(self, file, hasher: DocumentHasher):
+        """Feed the hasher with the file read chunk by chunk."""
+        file.seek(0)
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+            if hasher.size > self._max_upload_bytes:
+                raise FileTooBigError(
+                    f"File size exceeds limit {self._max_upload_bytes}"
+                )
+        file.seek(0)
+
+    async def _hash_chunks(
+        self,
+        chunks: AsyncIterator[bytes],
+        hasher: DocumentHasher,
+    ):
+        """
+        Feed the hasher with chunks arriving from a stream.
+
+        Each chunk is hashed in a worker thread while the next one is
+        received, so the event loop never hashes and at most two chunks
+        are held in memory.
+        """
+        loop = asyncio.get_running_loop()
+        pending = None
+        size = 0
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > self._max_upload_bytes:
+                if pending is not None:
+                    await pending
+                raise FileTooBigError(
+                    f"File size exceeds limit {self._max_upload_bytes}"
+                )
+            if pending is not None:
+                await pending
+            pending = loop.run_in_executor(None, hasher.update, chunk)
+        if pending is not None:
+            await pending
+
+    async def sign(
+        self,
+        keyid: str,
+        file: UploadFile,
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Sign a file.
+
+        Args:
+            keyid: Key ID to use for signing
+            file: File to sign (FastAPI UploadFile)
+            detach_sign: True for detached signature, False for cleartext
+            digest_algo: Hash algorithm (SHA256, SHA384, SHA512)
+            timeout: Seconds to wait for the signer, if it queues requests
+
+        Returns:
+            ASCII-armored PGP signature
+        """
+        if not self.key_exists(keyid):
+            raise ValueError(f"Key not found: {keyid}")
+
+        hasher = DocumentHasher(digest_algo, detach_sign)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._hash_file, file.file, hasher)
+        return await self._sign_document(
+            keyid, hasher, file.filename, digest_algo, timeout
+        )
+
+    async def sign_stream(
+        self,
+        keyid: str,
+        chunks: AsyncIterator[bytes],
+        filename: Optional[str] = None,
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Sign data arriving chunk by chunk.
+
+        Args:
+            keyid: Key ID to use for signing
+            chunks: Async iterator of data chunks
+            filename: Name of the data for the audit log
+            detach_sign: True for detached signature, False for cleartext
+            digest_algo: Hash algorithm (SHA256, SHA384, SHA512)
+            timeout: Seconds to wait for the signer, if it queues requests
+
+        Returns:
+            ASCII-armored PGP signature
+        """
+        if not self.key_exists(keyid):
+            raise ValueError(f"Key not found: {keyid}")
+
+        hasher = DocumentHasher(digest_algo, detach_sign)
+        await self._hash_chunks(chunks, hasher)
+        return await self._sign_document(
+            keyid, hasher, filename, digest_algo, timeout
+        )
+
+    async def sign_hash(
+        self,
+        keyid: str,
+        digest_algo: str = 'SHA256',
+        hash_state: Optional[HashState] = None,
+        digest: Optional[bytes] = None,
+        creation_time: Optional[datetime] = None,
+        filename: Optional[str] = None,
+    ) -> str:
+        """
+        Sign a binary document hashed by the client.
+
+        Args:
+            keyid: Key ID to use for signing
+            digest_algo: Hash algorithm (SHA256, SHA384, SHA512)
+            hash_state: Hash state after the document
+            digest: Final digest including the signature trailer
+            creation_time: Signature creation time used for the digest
+            filename: Name of the document for the audit log
+
+        Returns:
+            ASCII-armored detached PGP signature
+
+        Raises:
+            DigestSigningError: If the key signs other digests or the
+                hash state or digest is malformed
+        """
+        if not self.key_exists(keyid):
+            raise ValueError(f"Key not found: {keyid}")
+        self._check_digest_algo(keyid, digest_algo)
+        if digest is None:
+            creation_time = signature_time(self._signature_time_window)
+
+        digest, creation_time = finish_pgp_hash(
+            digest_algo,
+            self.get_gpg_fingerprint(keyid),
+            hash_state,
+            digest,
+            creation_time,
+        )
+        return await self._sign_and_wrap(
+            keyid,
+            filename,
+            digest.hex(),
+            digest,
+            creation_time,
+            digest_algo,
+        )
+
+    async def _sign_document(
+        self,
+        keyid: str,
+        hasher: DocumentHasher,
+        filename: Optional[str],
+        digest_algo: str,
+        timeout: Optional[float] = None,
+    ) -> str:
+        """Sign the document fed to the hasher."""
+        logger.info(
+            "Signing file %s (%d bytes) with %s key %s",
+            filename or 'unknown',
+            hasher.size,
+            self.signer_name,
+            keyid,
+        )
+        digest, creation_time = hasher.pgp.digest(
+            self.get_gpg_fingerprint(keyid),
+            signature_time(self._signature_time_window),
+        )
+        return await self._sign_and_wrap(
+            keyid,
+            filename,
+            hasher.audit_hexdigest(),
+            digest,
+            creation_time,
+            digest_algo,
+            detach_sign=hasher.detach_sign,
+            cleartext=None if hasher.detach_sign else hasher.pgp.cleartext(),
+            timeout=timeout,
+        )
+
+    async def _sign_and_wrap(
+        self,
+        keyid: str,
+        filename: Optional[str],
+        hash_before: str,
+        digest: bytes,
+        creation_time: datetime,
+        digest_algo: str,
+        detach_sign: bool = True,
+        cleartext: Optional[bytes] = None,
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Sign the digest and wrap the signature in PGP format.
+
+        Args:
+            keyid: Key ID
+            filename: Name of the document for the audit log
+            hash_before: Hash of the document for the audit log
+            digest: PGP signature digest
+            creation_time: Signature creation time hashed in the digest
+            digest_algo: Hash algorithm
+            detach_sign: True for detached signature, False for cleartext
+            cleartext: Dash-escaped document of a cleartext message
+            timeout: Seconds to wait for the signer, if it queues requests
+
+        Returns:
+            ASCII-armored PGP signature or cleartext signed message
+        """
+        filename = filename or 'unknown'
+        try:
+            raw_signature = await self._sign_raw(
+                keyid, digest, digest_algo, timeout
+            )
+        except Exception:
+            # the failure is audited whatever the signer raised, e.g. a
+            # timeout waiting for it
+            self._log_signing_event(filename, keyid, hash_before, False)
+            raise
+        self._log_signing_event(filename, keyid, hash_before, True)
+        return await asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(
+                wrap_signature_as_pgp,
+                raw_signature,
+                b'',
+                digest_algo,
+                detach_sign,
+                self.get_gpg_fingerprint(keyid),
+                creation_time,
+                digest=digest,
+                cleartext=cleartext,
+            ),
+        )
+
+    async def sign_batch(
+        self,
+        keyid: str,
+        files: List[UploadFile],
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> List[Tuple[str, str]]:
+        """
+        Sign multiple files.
+
+        Files are hashed concurrently, their digests wait in line for
+        the signer.
+
+        Args:
+            keyid: Key ID to use for signing
+            files: List of files to sign
+            detach_sign: True for detached signatures
+            digest_algo: Hash algorithm
+            timeout: Seconds each file waits for the signer, if it
+                queues requests
+
+        Returns:
+            List of (filename, signature) tuples
+        """
+        signatures = await asyncio.gather(
+            *(
+                self.sign(keyid, file, detach_sign, digest_algo, timeout)
+                for file in files
+            ),
+            return_exceptions=True,
+        )
+        results = []
+        for file, sig_or_error in zip(files, signatures):
+            filename = file.filename or 'unknown'
+            if isinstance(sig_or_error, Exception):
+                logger.error("Failed to sign %s: %s", filename, sig_or_error)
+                raise sig_or_error
+            results.append((filename, sig_or_error))
+        return results
@@ -0,0 +1,201 @@
+"""
+Cache of KMS key metadata and public keys.
+
+Keys are fetched once at startup, all of them concurrently, and
+refreshed in the background. The public keys verify every signature
+KMS returns before it is wrapped, in microseconds and without a KMS
+Verify request.
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from botocore.exceptions import ClientError
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, utils
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+from cryptography.hazmat.primitives.serialization import load_der_public_key
+
+from sign.kms.pgp_wrapper import get_hash_name
+from sign.kms.routing import Replica
+
+logger = logging.getLogger(__name__)
+
+# seconds between refreshes of the cached keys
+KEY_REFRESH_INTERVAL = 3600
+# max concurrent KMS requests while fetching keys
+FETCH_CONCURRENCY = 32
+
+_HASHES = {
+    'SHA256': hashes.SHA256(),
+    'SHA384': hashes.SHA384(),
+    'SHA512': hashes.SHA512(),
+}
+
+
+def _invalid_key(replica: Replica, error: ClientError) -> ValueError:
+    error_code = error.response.get('Error', {}).get('Code', 'Unknown')
+    error_msg = error.response.get('Error', {}).get('Message', str(error))
+    logger.error(
+        "Failed to validate KMS key %s in region %s: [%s] %s",
+        replica.key_id, replica.region.name, error_code, error_msg
+    )
+    return ValueError(
+        f"Invalid KMS key '{replica.key_id}': [{error_code}] {error_msg}"
+    )
+
+
+class KeyInfo:
+    """Metadata and public key of a regional replica of a KMS key."""
+
+    def __init__(self, metadata: dict, public_key: Optional[RSAPublicKey]):
+        self.metadata = metadata
+        self.public_key = public_key
+        self.fetched = time.monotonic()
+
+
+def fetch_key(replica: Replica) -> KeyInfo:
+    """
+    Fetches metadata and public key of a replica with its region client.
+
+    The public key is None if the key may not be read
+    (kms:GetPublicKey is not allowed), signatures of the key are not
+    verified then.
+
+    Raises:
+        ValueError: If the key can't be described or read
+    """
+    client = replica.region.client
+    try:
+        metadata = client.describe_key(KeyId=replica.key_id)['KeyMetadata']
+    except ClientError as e:
+        raise _invalid_key(replica, e) from e
+    try:
+        der = client.get_public_key(KeyId=replica.key_id)['PublicKey']
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'AccessDeniedException':
+            raise _invalid_key(replica, e) from e
+        logger.warning(
+            "Signatures of KMS key %s are not verified, "
+            "kms:GetPublicKey is not allowed",
+            replica.key_id,
+        )
+        return KeyInfo(metadata, None)
+    public_key = load_der_public_key(der)
+    if not isinstance(public_key, RSAPublicKey):
+        raise ValueError(f"KMS key '{replica.key_id}' is not an RSA key")
+    return KeyInfo(metadata, public_key)
+
+
+class KeyCache:
+    """
+    Metadata and public keys of all replicas of the configured keys.
+
+    Usage:
+        cache = KeyCache(replicas)
+        cache.load()
+        cache.start_refresh()  # in the event loop
+        cache.verify(keyid, digest, signature, 'SHA256')
+    """
+
+    def __init__(
+        self,
+        replicas: Dict[str, List[Replica]],
+        refresh_interval: float = KEY_REFRESH_INTERVAL,
+    ):
+        self._replicas = replicas
+        self._refresh_interval = refresh_interval
+        self._keys: Dict[Replica, KeyInfo] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _fetch_all(self) -> Dict[Replica, KeyInfo]:
+        replicas = [
+            replica
+            for key_replicas in self._replicas.values()
+            for replica in key_replicas
+        ]
+        workers = max(1, min(FETCH_CONCURRENCY, len(replicas)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(replicas, executor.map(fetch_key, replicas)))
+
+    def load(self):
+        """
+        Fetches all keys concurrently.
+
+        Raises:
+            ValueError: If a key can't be described or read
+        """
+        self._keys = self._fetch_all()
+
+    def get(self, replica: Replica) -> KeyInfo:
+        return self._keys[replica]
+
+    def public_key(self, keyid: str) -> Optional[RSAPublicKey]:
+        """Public key of the key, shared by all its replicas."""
+        for replica in self._replicas[keyid]:
+            public_key = self._keys[replica].public_key
+            if public_key is not None:
+                return public_key
+        return None
+
+    def verify(
+        self,
+        keyid: str,
+        digest: bytes,
+        signature: bytes,
+        digest_algo: str,
+    ) -> bool:
+        """
+        Checks an RSA PKCS #1 v1.5 signature of a digest.
+
+        Returns:
+            False if the signature is invalid, True if it is valid or the
+            key is not verified
+        """
+        public_key = self.public_key(keyid)
+        if public_key is None:
+            return True
+        try:
+            public_key.verify(
+                signature,
+                digest,
+                padding.PKCS1v15(),
+                utils.Prehashed(_HASHES[get_hash_name(digest_algo)]),
+            )
+        except (InvalidSignature, ValueError):
+            return False
+        return True
+
+    def start_refresh(self):
+        """Starts refreshing the keys in the running event loop."""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.get_running_loop().create_task(
+                self._refresh_forever()
+            )
+
+    async def _refresh_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self._refresh_interval)
+            try:
+                keys = await loop.run_in_executor(None, self._fetch_all)
+            except Exception as error:
+                logger.warning("Failed to refresh KMS keys: %s", error)
+                continue
+            for replica, info in keys.items():
+                state = info.metadata.get('KeyState')
+                if state != self._keys[replica].metadata.get('KeyState'):
+                    logger.warning(
+                        "KMS key %s is %s now", replica.key_id, state
+                    )
+            self._keys = keys
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
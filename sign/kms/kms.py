@@ -5,27 +5,42 @@ This module provides PGP-compatible signing using AWS KMS keys.
 """
 
 import asyncio
+import functools
 import logging
-import syslog
+import random
+import time
 from concurrent.futures import ThreadPoolExecutor
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import boto3
 from botocore.config import Config
 from botocore.exceptions import ClientError
-from fastapi import UploadFile
+from botocore.exceptions import ConnectionError as BotoConnectionError
+from botocore.exceptions import HTTPClientError
 
-from sign.errors import FileTooBigError
-from sign.kms.pgp_wrapper import (
-    compute_pgp_hash,
-    wrap_signature_as_pgp,
-)
-from sign.utils.hashing import hash_content
+from sign.errors import DigestSigningError
+from sign.kms.digest_signer import DigestSigner
+from sign.kms.keys import FETCH_CONCURRENCY, KeyCache
+from sign.kms.pgp_wrapper import get_hash_name
+from sign.kms.routing import Region, Replica, ReplicaRouter
+from sign.kms.transport import AsyncKMSClient
 
 logger = logging.getLogger(__name__)
 
+# attempts of a signing request, throttled ones included
+SIGN_ATTEMPTS = 8
+# bounds of the exponential backoff between attempts, in seconds
+RETRY_BASE_DELAY = 0.05
+RETRY_MAX_DELAY = 5.0
+TRANSPORTS = ('boto3', 'async')
+THROTTLING_ERROR = 'ThrottlingException'
+TRANSIENT_ERRORS = frozenset((
+    'DependencyTimeoutException',
+    'KMSInternalException',
+))
 
-class KMS:
+
+class KMS(DigestSigner):
     """
     AWS KMS signing backend with PGP-compatible output.
 
@@ -33,6 +48,8 @@ class KMS:
     and wraps the raw signatures in OpenPGP format for GPG compatibility.
     """
 
+    signer_name = 'KMS'
+
     def __init__(
         self,
         key_ids: List[str],
@@ -44,6 +61,10 @@ class KMS:
         max_upload_bytes: int = 100000000,
         tmp_dir: str = '/tmp',
         max_workers: int = 10,
+        signature_time_window: int = 0,
+        replicas: Optional[Dict[str, List[dict]]] = None,
+        endpoint_url: Optional[str] = None,
+        transport: str = 'boto3',
     ):
         """
         Initialize the KMS signing backend.
@@ -57,60 +78,168 @@ class KMS:
             signing_algorithm: KMS signing algorithm
             max_upload_bytes: Maximum file size for signing
             tmp_dir: Directory for temporary files
-            max_workers: Maximum concurrent signing operations
+            max_workers: Maximum concurrent signing operations per
+                region, the limit adapts below it to KMS throttling and
+                latency
+            signature_time_window: Round signature creation time down to
+                multiples of this many seconds (0 keeps the exact time)
+            replicas: Mapping of KMS key ID -> regional replicas of a
+                multi-region key, dicts with ``region``, ``kms_id`` and
+                optional ``endpoint_url``; other keys are signed in
+                ``region``
+            endpoint_url: KMS endpoint of ``region`` (uses AWS default)
+            transport: 'boto3' signs with boto3 in a thread pool, 'async'
+                with the asyncio transport of sign.kms.transport
         """
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown KMS transport: {transport}")
         self._key_ids = key_ids
         self._gpg_fingerprints = gpg_fingerprints
         self._region = region
         self._signing_algorithm = signing_algorithm
+        # PGP RSA signatures are PKCS #1 v1.5 ones
+        self._verify_signatures = signing_algorithm.startswith(
+            'RSASSA_PKCS1_V1_5'
+        )
         self._max_upload_bytes = max_upload_bytes
         self._tmp_dir = tmp_dir
         self._max_workers = max_workers
+        self._signature_time_window = signature_time_window
+        self._transport = transport
 
-        # Configure boto3 client with retries
-        config = Config(
-            retries={'max_attempts': 3, 'mode': 'adaptive'},
-            max_pool_connections=max_workers + 5,
-        )
-
-        client_kwargs = {'config': config}
-        if region:
-            client_kwargs['region_name'] = region
+        self._client_kwargs = {}
         if access_key_id and secret_access_key:
-            client_kwargs['aws_access_key_id'] = access_key_id
-            client_kwargs['aws_secret_access_key'] = secret_access_key
-
-        self._client = boto3.client('kms', **client_kwargs)
-
-        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+            self._client_kwargs['aws_access_key_id'] = access_key_id
+            self._client_kwargs['aws_secret_access_key'] = secret_access_key
+
+        self._regions: Dict[Tuple[Optional[str], Optional[str]], Region] = {}
+        replicas = replicas or {}
+        self._router = ReplicaRouter({
+            key_id: [
+                Replica(
+                    self._get_region(
+                        replica.get('region'), replica.get('endpoint_url')
+                    ),
+                    replica.get('kms_id', key_id),
+                )
+                for replica in replicas[key_id]
+            ]
+            if replicas.get(key_id)
+            else [Replica(self._get_region(region, endpoint_url), key_id)]
+            for key_id in key_ids
+        })
+
+        self._executor = (
+            ThreadPoolExecutor(max_workers=max_workers * len(self._regions))
+            if transport == 'boto3'
+            else None
+        )
+        self._keys = KeyCache({
+            key_id: self._router.replicas(key_id) for key_id in key_ids
+        })
 
         # Validate keys on init
         self._validate_keys()
 
+    def _get_region(
+        self,
+        name: Optional[str],
+        endpoint_url: Optional[str] = None,
+    ) -> Region:
+        """Get the clients of a region, create them on first use."""
+        if (name, endpoint_url) in self._regions:
+            return self._regions[name, endpoint_url]
+        client_kwargs = dict(self._client_kwargs)
+        if name:
+            client_kwargs['region_name'] = name
+        if endpoint_url:
+            client_kwargs['endpoint_url'] = endpoint_url
+        client = boto3.client(
+            'kms',
+            config=Config(
+                retries={'max_attempts': 3, 'mode': 'standard'},
+                max_pool_connections=FETCH_CONCURRENCY,
+            ),
+            **client_kwargs,
+        )
+        # signing requests are retried by _kms_sign, so that every
+        # throttling response reaches the concurrency controller
+        if self._transport == 'async':
+            session = boto3.session.Session(**self._client_kwargs)
+            sign_client = AsyncKMSClient(
+                session.get_credentials(),
+                client.meta.region_name,
+                endpoint_url=endpoint_url,
+                max_connections=self._max_workers,
+            )
+        else:
+            sign_client = boto3.client(
+                'kms',
+                config=Config(
+                    retries={'total_max_attempts': 1},
+                    max_pool_connections=self._max_workers + 5,
+                ),
+                **client_kwargs,
+            )
+        region = Region(
+            name, client, sign_client, self._max_workers, endpoint_url
+        )
+        self._regions[name, endpoint_url] = region
+        return region
+
     def _validate_keys(self):
-        """Validate that configured keys exist and are usable."""
+        """
+        Validate that configured keys exist and are usable.
+
+        Metadata and public keys of all replicas are fetched concurrently
+        and cached to verify the signatures.
+        """
+        self._keys.load()
         for key_id in self._key_ids:
-            try:
-                response = self._client.describe_key(KeyId=key_id)
-                key_state = response['KeyMetadata']['KeyState']
-                if key_state != 'Enabled':
-                    logger.warning(
-                        "KMS key %s is not enabled (state: %s)",
-                        key_id,
-                        key_state,
-                    )
-                else:
-                    logger.info("KMS key %s validated successfully", key_id)
-            except ClientError as e:
-                error_code = e.response.get('Error', {}).get('Code', 'Unknown')
-                error_msg = e.response.get('Error', {}).get('Message', str(e))
-                logger.error(
-                    "Failed to validate KMS key %s: [%s] %s",
-                    key_id, error_code, error_msg
-                )
+            replicas = self._router.replicas(key_id)
+            for replica in replicas:
+                self._validate_replica(key_id, replica, len(replicas) > 1)
+            public_keys = {
+                self._keys.get(replica).public_key.public_numbers()
+                for replica in replicas
+                if self._keys.get(replica).public_key is not None
+            }
+            if len(public_keys) > 1:
                 raise ValueError(
-                    f"Invalid KMS key '{key_id}': [{error_code}] {error_msg}"
-                ) from e
+                    f"Replicas of KMS key '{key_id}' have different "
+                    "public keys"
+                )
+
+    def _validate_replica(
+        self, key_id: str, replica: Replica, multi_region: bool
+    ):
+        metadata = self._keys.get(replica).metadata
+        if multi_region and not metadata.get('MultiRegion'):
+            # replicas have to share the key material of the fingerprint
+            raise ValueError(
+                f"Replica '{replica.key_id}' of KMS key '{key_id}' "
+                "is not a multi-region key"
+            )
+        algorithms = metadata.get('SigningAlgorithms')
+        if algorithms and self._signing_algorithm not in algorithms:
+            raise ValueError(
+                f"KMS key '{replica.key_id}' does not support "
+                f"{self._signing_algorithm}"
+            )
+        key_state = metadata['KeyState']
+        if key_state != 'Enabled':
+            logger.warning(
+                "KMS key %s is not enabled in region %s (state: %s)",
+                replica.key_id,
+                replica.region.name,
+                key_state,
+            )
+        else:
+            logger.info(
+                "KMS key %s validated successfully in region %s",
+                replica.key_id,
+                replica.region.name,
+            )
 
     def key_exists(self, keyid: str) -> bool:
         """Check if a key exists in the configured key list."""
@@ -120,6 +249,34 @@ class KMS:
         """Return list of configured key IDs."""
         return self._key_ids.copy()
 
+    def queue_depth(self, keyid: str) -> int:
+        """Number of signing requests waiting for or holding a KMS slot."""
+        return sum(
+            replica.region.concurrency.depth(replica.key_id)
+            for replica in self._router.replicas(keyid)
+        )
+
+    def concurrency_limit(self, keyid: str) -> int:
+        """Current limit of concurrent KMS requests of the key."""
+        return sum(
+            replica.region.concurrency.limit(replica.key_id)
+            for replica in self._router.replicas(keyid)
+        )
+
+    async def close(self):
+        """Log the concurrency stats and close the signing clients."""
+        await self._keys.close()
+        for region in self._regions.values():
+            logger.info(
+                "KMS concurrency stats of region %s: %s",
+                region.name or region.endpoint_url,
+                region.concurrency.stats(),
+            )
+            if self._executor is None:
+                await region.sign_client.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
     def get_gpg_fingerprint(self, keyid: str) -> str:
         """Get the GPG fingerprint for a given KMS key ID."""
         if keyid in self._gpg_fingerprints:
@@ -128,145 +285,144 @@ class KMS:
             f"No GPG fingerprint configured for KMS key: {keyid}"
         )
 
-    def _sign_digest(self, key_id: str, digest: bytes) -> bytes:
+    async def _sign_digest(self, replica: Replica, digest: bytes) -> bytes:
         """
         Sign a digest using KMS.
 
         Args:
-            key_id: KMS key ID
+            replica: Regional replica of the key
             digest: Hash digest to sign
 
         Returns:
             Raw signature bytes
         """
-        response = self._client.sign(
-            KeyId=key_id,
+        request = functools.partial(
+            replica.region.sign_client.sign,
+            KeyId=replica.key_id,
             Message=digest,
             MessageType='DIGEST',
             SigningAlgorithm=self._signing_algorithm,
         )
+        if self._executor is None:
+            response = await request()
+        else:
+            # boto3 is synchronous
+            response = await asyncio.get_running_loop().run_in_executor(
+                self._executor, request
+            )
         return response['Signature']
 
-    def _log_signing_event(
-        self, filename: str, keyid: str, hash_before: str, success: bool
-    ):
-        """Log signing event to syslog for audit."""
-        status = "SUCCESS" if success else "FAILED"
-        message = (
-            f"KMS Sign {status}: file={filename} "
-            f"key={keyid} hash={hash_before}"
-        )
-        try:
-            syslog.syslog(syslog.LOG_INFO, message)
-        except Exception:
-            logger.info(message)
-
-    async def sign(
+    async def _kms_sign(
         self,
-        keyid: str,
-        file: UploadFile,
-        detach_sign: bool = True,
-        digest_algo: str = 'SHA256',
-    ) -> str:
+        key_id: str,
+        digest: bytes,
+        timeout: Optional[float] = None,
+    ) -> bytes:
         """
-        Sign a file using AWS KMS.
+        Sign a digest using KMS within the adaptive concurrency limits.
+
+        Every attempt goes to the replica of the key expected to respond
+        first. Throttled requests are queued again after a jittered
+        exponential backoff, transient failures fail over to another
+        replica at once if there is one.
 
         Args:
-            keyid: KMS key ID to use for signing
-            file: File to sign (FastAPI UploadFile)
-            detach_sign: True for detached signature, False for cleartext
-            digest_algo: Hash algorithm (SHA256, SHA384, SHA512)
+            key_id: KMS key ID
+            digest: Hash digest to sign
+            timeout: Seconds to wait for a free request slot in total,
+                None waits as long as needed
 
         Returns:
-            ASCII-armored PGP signature
-        """
-        if keyid not in self._key_ids:
-            raise ValueError(f"Key not found: {keyid}")
-
-        # Read file content
-        content = await file.read()
-        await file.seek(0)
+            Raw signature bytes
 
-        if len(content) > self._max_upload_bytes:
-            raise FileTooBigError(
-                f"File size {len(content)} exceeds limit {self._max_upload_bytes}"
+        Raises:
+            LockTimeoutError: If no request slot was free in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        replicas = self._router.replicas(key_id)
+        failed: List[Replica] = []
+        for attempt in range(1, SIGN_ATTEMPTS + 1):
+            remaining = (
+                None if deadline is None
+                else max(0.0, deadline - time.monotonic())
             )
-
-        filename = file.filename or 'unknown'
-        hash_before = hash_content(content)
-
-        logger.info(
-            "Signing file %s (%d bytes) with KMS key %s",
-            filename,
-            len(content),
-            keyid,
-        )
-
-        try:
-            gpg_fingerprint = self.get_gpg_fingerprint(keyid)
-
-            # Compute the PGP signature hash
-            digest, sig_type, hash_algo, creation_time, issuer_key_id = (
-                compute_pgp_hash(
-                    content, digest_algo, detach_sign, gpg_fingerprint
+            replica = self._router.choose(key_id, failed)
+            concurrency = replica.region.concurrency
+            async with concurrency.slot(replica.key_id, remaining) as slot:
+                started = time.monotonic()
+                try:
+                    signature = await self._sign_digest(replica, digest)
+                except ClientError as e:
+                    code = e.response.get('Error', {}).get('Code')
+                    if code == THROTTLING_ERROR:
+                        slot.throttled = True
+                    elif code in TRANSIENT_ERRORS:
+                        replica.record_failure()
+                        failed.append(replica)
+                    else:
+                        raise
+                    error = e
+                except (BotoConnectionError, HTTPClientError) as e:
+                    replica.record_failure()
+                    failed.append(replica)
+                    error = e
+                else:
+                    slot.latency = time.monotonic() - started
+                    replica.record_success(slot.latency)
+                    return signature
+            if slot.throttled or len(set(failed)) == len(replicas):
+                delay = random.uniform(
+                    0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
                 )
+            else:
+                delay = 0.0
+            if attempt == SIGN_ATTEMPTS or (
+                deadline is not None and time.monotonic() + delay > deadline
+            ):
+                raise error
+            logger.warning(
+                "KMS signing with key %s in region %s failed (attempt %d), "
+                "retrying: %s",
+                replica.key_id, replica.region.name, attempt, error,
             )
-
-            # Sign with KMS in thread pool (boto3 is synchronous)
-            loop = asyncio.get_event_loop()
-            raw_signature = await loop.run_in_executor(
-                self._executor, self._sign_digest, keyid, digest
-            )
-
-            # Wrap in PGP format
-            pgp_signature = wrap_signature_as_pgp(
-                raw_signature,
-                content,
-                digest_algo,
-                detach_sign,
-                gpg_fingerprint,
-                creation_time,
+            await asyncio.sleep(delay)
+
+    def _check_digest_algo(self, keyid: str, digest_algo: str):
+        hash_name = get_hash_name(digest_algo)
+        if (
+            not self._signing_algorithm.startswith('RSASSA_PKCS1_V1_5')
+            or get_hash_name(self._signing_algorithm) != hash_name
+        ):
+            raise DigestSigningError(
+                f"Key {keyid} does not sign {hash_name} digests"
             )
 
-            self._log_signing_event(filename, keyid, hash_before, True)
-            return pgp_signature
-
-        except ClientError as e:
-            self._log_signing_event(filename, keyid, hash_before, False)
-            logger.error("KMS signing failed: %s", e)
-            raise RuntimeError(f"KMS signing failed: {e}") from e
-
-    async def sign_batch(
+    async def _sign_raw(
         self,
         keyid: str,
-        files: List[UploadFile],
-        detach_sign: bool = True,
-        digest_algo: str = 'SHA256',
-    ) -> List[Tuple[str, str]]:
+        digest: bytes,
+        digest_algo: str,
+        timeout: Optional[float],
+    ) -> bytes:
         """
-        Sign multiple files using AWS KMS.
-
-        Args:
-            keyid: KMS key ID to use for signing
-            files: List of files to sign
-            detach_sign: True for detached signatures
-            digest_algo: Hash algorithm
+        Sign the digest with KMS and verify the signature.
 
-        Returns:
-            List of (filename, signature) tuples
+        Raises:
+            RuntimeError: If KMS failed or returned an invalid signature
         """
-        tasks = [
-            self.sign(keyid, file, detach_sign, digest_algo) for file in files
-        ]
-
-        results = []
-        signatures = await asyncio.gather(*tasks, return_exceptions=True)
-
-        for file, sig_or_error in zip(files, signatures):
-            filename = file.filename or 'unknown'
-            if isinstance(sig_or_error, Exception):
-                logger.error("Failed to sign %s: %s", filename, sig_or_error)
-                raise sig_or_error
-            results.append((filename, sig_or_error))
-
-        return results
+        self._keys.start_refresh()
+        try:
+            raw_signature = await self._kms_sign(keyid, digest, timeout)
+        except (ClientError, BotoConnectionError, HTTPClientError) as e:
+            logger.error("KMS signing failed: %s", e)
+            raise RuntimeError(f"KMS signing failed: {e}") from e
+        # PGP signatures of a corrupted response would only fail on the
+        # clients; the check costs microseconds, a KMS Verify a round trip
+        if self._verify_signatures and not self._keys.verify(
+            keyid, digest, raw_signature, digest_algo
+        ):
+            logger.error("KMS returned an invalid signature for key %s", keyid)
+            raise RuntimeError(
+                f"KMS returned an invalid signature for key {keyid}"
+            )
+        return raw_signature
@@ -0,0 +1,248 @@
+"""
+Adaptive concurrency limits of KMS requests.
+"""
+
+import asyncio
+import collections
+import contextlib
+import time
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from sign.errors import LockTimeoutError
+
+# limit multipliers after throttling and after slow responses
+THROTTLE_BACKOFF = 0.75
+LATENCY_BACKOFF = 0.9
+# responses this many times slower than the fastest ones mean that KMS
+# queues requests, the limit is lowered before it starts throttling
+LATENCY_TOLERANCE = 2.0
+# the fastest latency creeps up by this factor per response, so the
+# baseline follows lasting changes of the network
+BASELINE_DRIFT = 1.001
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit tuned by additive increase, multiplicative decrease.
+
+    Every response raises the limit by 1/limit, i.e. by one per round of
+    ``limit`` requests, as long as the limit is used up. A throttled or
+    slow response multiplies it by a backoff factor, at most once per
+    round trip: responses to requests sent before the last decrease were
+    sent under the old limit and are ignored. The limit thus stays just
+    under the point where KMS starts throttling, instead of oscillating
+    between the maximum and half of it.
+
+    Requests over the limit wait in FIFO order.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        initial_limit: Optional[int] = None,
+        min_limit: int = 1,
+    ):
+        self._max_limit = max_limit
+        self._min_limit = min_limit
+        self._limit = float(initial_limit or max_limit)
+        self._waiters: Deque[asyncio.Future] = collections.deque()
+        self._last_decrease = 0.0
+        self._min_latency: Optional[float] = None
+        self.in_flight = 0
+        self.throttled = 0
+
+    @property
+    def limit(self) -> int:
+        return max(self._min_limit, int(self._limit))
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    async def acquire(self, timeout: Optional[float] = None) -> float:
+        """
+        Waits until the request may be sent.
+
+        Returns
+        -------
+        float
+            Monotonic time the request got its slot.
+
+        Raises
+        ------
+        LockTimeoutError
+            If no slot was free before the timeout.
+        """
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except BaseException as error:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over while the request was leaving
+                self.release(time.monotonic())
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(error, asyncio.TimeoutError):
+                raise LockTimeoutError(
+                    f'no KMS request slot in {timeout} seconds'
+                ) from None
+            raise
+        return time.monotonic()
+
+    def release(
+        self,
+        started: float,
+        throttled: bool = False,
+        latency: Optional[float] = None,
+    ):
+        """
+        Frees the slot and adjusts the limit by the response.
+
+        Parameters
+        ----------
+        started : float
+            Time returned by acquire.
+        throttled : bool
+            KMS rejected the request with ThrottlingException.
+        latency : float, optional
+            Seconds KMS took to respond, None if there was no response.
+        """
+        saturated = self.in_flight >= self.limit
+        self.in_flight -= 1
+        if throttled:
+            self.throttled += 1
+            self._decrease(started, THROTTLE_BACKOFF)
+        elif latency is not None:
+            if self._min_latency is None or latency < self._min_latency:
+                self._min_latency = latency
+            else:
+                self._min_latency *= BASELINE_DRIFT
+            if latency > self._min_latency * LATENCY_TOLERANCE:
+                self._decrease(started, LATENCY_BACKOFF)
+            elif saturated:
+                self._limit = min(
+                    self._max_limit, self._limit + 1 / self._limit
+                )
+        self._wake()
+
+    def _decrease(self, started: float, backoff: float):
+        if started < self._last_decrease:
+            return
+        self._limit = max(self._min_limit, self._limit * backoff)
+        self._last_decrease = time.monotonic()
+
+
+class KMSSlot:
+    """Permission to send one request, reports how it went."""
+
+    def __init__(self):
+        self.throttled = False
+        self.latency: Optional[float] = None
+
+
+class ConcurrencyController:
+    """
+    Limits of KMS requests per key and per account.
+
+    KMS quotas are shared by all keys of the account in the region, so
+    every request holds a slot of its key and of the account. Throttling
+    lowers both limits, a key can't take all the account's slots.
+
+    Usage:
+        controller = ConcurrencyController(max_concurrency=10)
+        async with controller.slot(keyid, timeout=60) as slot:
+            started = time.monotonic()
+            try:
+                sign()
+            except ThrottlingError:
+                slot.throttled = True
+            slot.latency = time.monotonic() - started
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_key_concurrency: Optional[int] = None,
+    ):
+        self._account = AIMDLimiter(max_concurrency)
+        self._max_key_concurrency = max_key_concurrency or max_concurrency
+        self._keys: Dict[str, AIMDLimiter] = {}
+
+    def _key(self, keyid: str) -> AIMDLimiter:
+        if keyid not in self._keys:
+            self._keys[keyid] = AIMDLimiter(self._max_key_concurrency)
+        return self._keys[keyid]
+
+    def limit(self, keyid: Optional[str] = None) -> int:
+        """Current limit of requests of the key or of the account."""
+        if keyid is None:
+            return self._account.limit
+        return min(self._key(keyid).limit, self._account.limit)
+
+    def depth(self, keyid: str) -> int:
+        """Number of requests of the key waiting for or holding a slot."""
+        key = self._key(keyid)
+        return key.in_flight + key.queued
+
+    def stats(self) -> dict:
+        return {
+            'limit': self._account.limit,
+            'in_flight': self._account.in_flight,
+            'queued': sum(key.queued for key in self._keys.values()),
+            'throttled': self._account.throttled,
+            'keys': {
+                keyid: {
+                    'limit': key.limit,
+                    'in_flight': key.in_flight,
+                    'queued': key.queued,
+                }
+                for keyid, key in self._keys.items()
+            },
+        }
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self,
+        keyid: str,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[KMSSlot]:
+        """
+        Waits for a slot of the key and of the account.
+
+        Raises
+        ------
+        LockTimeoutError
+            If no slot was free before the timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        key = self._key(keyid)
+        key_started = await key.acquire(timeout)
+        try:
+            remaining = (
+                None if deadline is None
+                else max(0.0, deadline - time.monotonic())
+            )
+            account_started = await self._account.acquire(remaining)
+        except BaseException:
+            key.release(key_started)
+            raise
+        slot = KMSSlot()
+        try:
+            yield slot
+        finally:
+            key.release(key_started, slot.throttled, slot.latency)
+            self._account.release(
+                account_started, slot.throttled, slot.latency
+            )
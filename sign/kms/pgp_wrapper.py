@@ -1,29 +1,49 @@
 """
-OpenPGP signature packet construction for AWS KMS signatures using pgpy.
+OpenPGP signature packet construction for raw RSA signatures.
 
-This module creates PGP-compatible signatures from raw KMS cryptographic
-signatures, enabling verification with standard GPG tools.
-
-Requires: pgpy (or PGPy13 for Python 3.13+)
+This module creates PGP-compatible signatures from raw KMS or software
+key signatures, enabling verification with standard GPG tools. Packets and
+their armor are built in process, no OpenPGP library is needed. Public key
+packets are read to check the keys a signature is made with.
 """
 
+import functools
 import hashlib
 import struct
 from datetime import datetime, timezone
-from typing import Callable, Tuple
+from enum import IntEnum
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from sign.errors import DigestSigningError
+from sign.utils.armor import armor
+from sign.utils.cleartext import CleartextCanonicalizer, canonicalize_cleartext
+from sign.utils.hashing import get_hasher
+from sign.utils.sha2 import HashState, Sha2
+
+RSA_ALGORITHM = 1
+# RSA, RSA encrypt-only and RSA sign-only public key algorithms
+RSA_KEY_ALGORITHMS = (1, 2, 3)
+# public key and public subkey packet tags
+PUBLIC_KEY_TAGS = (6, 14)
+
+
+class SignatureType(IntEnum):
+    """Signature types (RFC 4880 Section 5.2.1)."""
 
-try:
-    import pgpy
-    from pgpy.constants import HashAlgorithm, SignatureType
-except ImportError as e:
-    raise ImportError(
-        "pgpy is required for KMS signing. "
-        "Install with: pip install PGPy13 (Python 3.13+) or pip install pgpy"
-    ) from e
+    BinaryDocument = 0x00
+    CanonicalDocument = 0x01
 
 
-def get_pgpy_hash_algorithm(algorithm: str) -> HashAlgorithm:
-    """Map algorithm name to pgpy HashAlgorithm."""
+class HashAlgorithm(IntEnum):
+    """Hash algorithms (RFC 4880 Section 9.4)."""
+
+    SHA256 = 8
+    SHA384 = 9
+    SHA512 = 10
+
+
+def get_hash_algorithm(algorithm: str) -> HashAlgorithm:
+    """Map algorithm name to OpenPGP HashAlgorithm."""
     algo_upper = algorithm.upper().replace('_', '')
     if 'SHA256' in algo_upper:
         return HashAlgorithm.SHA256
@@ -58,6 +78,208 @@ def get_hash_name(algorithm: str) -> str:
     return 'SHA256'
 
 
+@functools.lru_cache(maxsize=256)
+def _issuer_subpackets(issuer_key_id: str) -> Tuple[bytes, bytes]:
+    """
+    Precomputed subpackets naming the signing key.
+
+    Args:
+        issuer_key_id: 16 hex chars key ID of the signing key
+
+    Returns:
+        Tuple of (hashed issuer subpacket, unhashed subpacket area)
+    """
+    issuer_subpacket = bytes([9, 16]) + bytes.fromhex(issuer_key_id)
+    return (
+        issuer_subpacket,
+        struct.pack('>H', len(issuer_subpacket)) + issuer_subpacket,
+    )
+
+
+# hashed subpacket area of the creation time and the issuer subpackets
+_HASHED_SUBPACKETS_HEADER = struct.pack('>H', 16) + bytes([5, 2])
+
+
+def get_signature_trailer(
+    sig_type: int,
+    hash_algo: int,
+    creation_time: datetime,
+    issuer_key_id: str,
+) -> bytes:
+    """
+    Build the data hashed after the document (RFC 4880 Section 5.2.4).
+
+    The data without its last 6 bytes (the final trailer) is also the
+    start of the signature packet body.
+
+    Args:
+        sig_type: Signature type value
+        hash_algo: Hash algorithm value
+        creation_time: Signature creation timestamp
+        issuer_key_id: 16 hex chars key ID of the signing key
+
+    Returns:
+        Hashed signature fields followed by the final trailer
+    """
+    issuer_subpacket, _ = _issuer_subpackets(issuer_key_id)
+    trailer = (
+        bytes([4, sig_type, RSA_ALGORITHM, hash_algo])
+        + _HASHED_SUBPACKETS_HEADER
+        + struct.pack('>I', int(creation_time.timestamp()))
+        + issuer_subpacket
+    )
+    # Final trailer
+    return trailer + bytes([4, 0xFF]) + struct.pack('>I', len(trailer))
+
+
+class PGPHasher:
+    """
+    Incremental hash of a document for a PGP signature.
+
+    Produces the same digest as compute_pgp_hash without holding the
+    whole document in memory. A text document is canonicalized while it
+    is fed and only its dash-escaped cleartext is kept for the message.
+    """
+
+    def __init__(self, algorithm: str, text: bool = False):
+        self._algorithm = algorithm
+        self._hash = get_hashlib_func(algorithm)()
+        self._canonicalizer = (
+            CleartextCanonicalizer(self._hash) if text else None
+        )
+        self._cleartext = bytearray()
+
+    def update(self, data: bytes):
+        if self._canonicalizer is None:
+            self._hash.update(data)
+        else:
+            self._cleartext += self._canonicalizer.update(data)
+
+    def document_hexdigest(self) -> str:
+        """Hex digest of the document alone, without the trailer."""
+        return self._hash.hexdigest()
+
+    def cleartext(self) -> bytearray:
+        """Dash-escaped text of the cleartext message."""
+        self._cleartext += self._canonicalizer.finish()
+        return self._cleartext
+
+    def digest(
+        self,
+        gpg_key_id: str,
+        creation_time: datetime = None,
+    ) -> Tuple[bytes, datetime]:
+        """
+        Finish the hash with the signature trailer.
+
+        Args:
+            gpg_key_id: GPG key fingerprint
+            creation_time: Optional timestamp (defaults to now)
+
+        Returns:
+            Tuple of (digest, creation_time)
+        """
+        if creation_time is None:
+            creation_time = datetime.now(timezone.utc)
+        if self._canonicalizer is None:
+            sig_type = SignatureType.BinaryDocument
+        else:
+            sig_type = SignatureType.CanonicalDocument
+            self._cleartext += self._canonicalizer.finish()
+        issuer_key_id = gpg_key_id[-16:].upper() if gpg_key_id else '0' * 16
+        h = self._hash.copy()
+        h.update(
+            get_signature_trailer(
+                sig_type.value,
+                get_hash_algorithm(self._algorithm).value,
+                creation_time,
+                issuer_key_id,
+            )
+        )
+        return h.digest(), creation_time
+
+
+class DocumentHasher:
+    """PGP hash of a document and its SHA-256 for the audit log."""
+
+    def __init__(self, digest_algo: str, detach_sign: bool = True):
+        self.pgp = PGPHasher(digest_algo, text=not detach_sign)
+        # the PGP hash of a binary document already is its SHA-256
+        self._audit = (
+            None
+            if detach_sign and get_hash_name(digest_algo) == 'SHA256'
+            else get_hasher()
+        )
+        self.detach_sign = detach_sign
+        self.size = 0
+
+    def update(self, data: bytes):
+        self.pgp.update(data)
+        if self._audit is not None:
+            self._audit.update(data)
+        self.size += len(data)
+
+    def audit_hexdigest(self) -> str:
+        if self._audit is None:
+            return self.pgp.document_hexdigest()
+        return self._audit.hexdigest()
+
+
+def finish_pgp_hash(
+    algorithm: str,
+    gpg_key_id: str,
+    hash_state: Optional[HashState] = None,
+    digest: Optional[bytes] = None,
+    creation_time: datetime = None,
+) -> Tuple[bytes, datetime]:
+    """
+    Get the digest of a binary document hashed by the client.
+
+    The client either sends the intermediate hash state of the document,
+    which is finished here with the signature trailer, or the final
+    digest including the trailer made for creation_time.
+
+    Args:
+        algorithm: Hash algorithm name
+        gpg_key_id: GPG key fingerprint
+        hash_state: Hash state after the document
+        digest: Final digest computed by the client
+        creation_time: Timestamp (required with digest, defaults to now)
+
+    Returns:
+        Tuple of (digest, creation_time)
+
+    Raises:
+        DigestSigningError: If the hash state or digest is malformed
+    """
+    hash_name = get_hash_name(algorithm)
+    if (hash_state is None) == (digest is None):
+        raise DigestSigningError('either hash state or digest is required')
+    if digest is not None:
+        if creation_time is None:
+            raise DigestSigningError('digest requires its creation time')
+        if len(digest) != get_hashlib_func(hash_name)().digest_size:
+            raise DigestSigningError(f'digest is not a {hash_name} digest')
+        return digest, creation_time
+
+    if creation_time is None:
+        creation_time = datetime.now(timezone.utc)
+    issuer_key_id = gpg_key_id[-16:].upper() if gpg_key_id else '0' * 16
+    try:
+        hasher = Sha2(hash_name, hash_state)
+    except ValueError as error:
+        raise DigestSigningError(str(error)) from error
+    hasher.update(
+        get_signature_trailer(
+            SignatureType.BinaryDocument.value,
+            get_hash_algorithm(hash_name).value,
+            creation_time,
+            issuer_key_id,
+        )
+    )
+    return hasher.digest(), creation_time
+
+
 def compute_pgp_hash(
     content: bytes,
     algorithm: str,
@@ -80,53 +302,16 @@ def compute_pgp_hash(
     """
     if creation_time is None:
         creation_time = datetime.now(timezone.utc)
-
-    hash_func = get_hashlib_func(algorithm)
-    hash_algo = get_pgpy_hash_algorithm(algorithm)
+    hash_algo = get_hash_algorithm(algorithm)
     issuer_key_id = gpg_key_id[-16:].upper() if gpg_key_id else '0' * 16
-
     if detach_sign:
         sig_type = SignatureType.BinaryDocument
-        hash_content = content
     else:
         sig_type = SignatureType.CanonicalDocument
-        try:
-            text = content.decode('utf-8')
-        except UnicodeDecodeError:
-            text = content.decode('latin-1')
-        normalized = text.replace('\r\n', '\n').replace('\r', '\n')
-        lines = [line.rstrip() for line in normalized.split('\n')]
-        normalized = '\r\n'.join(lines)
-        hash_content = normalized.encode('utf-8')
-
-    # Build signature trailer for hash computation (RFC 4880 Section 5.2.4)
-    creation_ts = int(creation_time.timestamp())
-
-    # Hashed subpackets
-    time_subpacket = bytes([5, 2]) + struct.pack('>I', creation_ts)
-    key_id_bytes = bytes.fromhex(issuer_key_id)
-    issuer_subpacket = bytes([9, 16]) + key_id_bytes
-    hashed_subpackets = time_subpacket + issuer_subpacket
-
-    # Signature trailer
-    trailer = bytes([
-        4,  # Version 4
-        sig_type.value,
-        1,  # RSA
-        hash_algo.value,
-    ])
-    trailer += struct.pack('>H', len(hashed_subpackets))
-    trailer += hashed_subpackets
-
-    # Final trailer
-    final_trailer = bytes([4, 0xFF]) + struct.pack('>I', len(trailer))
 
-    # Compute hash
-    h = hash_func()
-    h.update(hash_content)
-    h.update(trailer)
-    h.update(final_trailer)
-    digest = h.digest()
+    hasher = PGPHasher(algorithm, text=not detach_sign)
+    hasher.update(content)
+    digest, creation_time = hasher.digest(gpg_key_id, creation_time)
 
     return digest, sig_type, hash_algo, creation_time, issuer_key_id
 
@@ -138,9 +323,11 @@ def wrap_signature_as_pgp(
     detach_sign: bool,
     gpg_key_id: str,
     creation_time: datetime = None,
+    digest: bytes = None,
+    cleartext: bytes = None,
 ) -> str:
     """
-    Wrap a raw KMS signature in PGP format using pgpy.
+    Wrap a raw KMS signature in PGP format.
 
     Args:
         raw_signature: Raw signature bytes from KMS
@@ -149,6 +336,9 @@ def wrap_signature_as_pgp(
         detach_sign: True for detached signature, False for cleartext
         gpg_key_id: GPG key fingerprint
         creation_time: Optional timestamp
+        digest: Signed digest, its left 16 bits are stored in the packet
+        cleartext: Dash-escaped content of PGPHasher.cleartext, saves
+            escaping the content again
 
     Returns:
         ASCII-armored PGP signature or cleartext signed message
@@ -156,35 +346,29 @@ def wrap_signature_as_pgp(
     if creation_time is None:
         creation_time = datetime.now(timezone.utc)
 
-    hash_algo = get_pgpy_hash_algorithm(algorithm)
+    hash_algo = get_hash_algorithm(algorithm)
     issuer_key_id = gpg_key_id[-16:].upper() if gpg_key_id else '0' * 16
-    creation_ts = int(creation_time.timestamp())
-    sig_type_val = 0x00 if detach_sign else 0x01
-
-    # Build hashed subpackets
-    time_subpacket = bytes([5, 2]) + struct.pack('>I', creation_ts)
-    key_id_bytes = bytes.fromhex(issuer_key_id)
-    issuer_subpacket = bytes([9, 16]) + key_id_bytes
-    hashed_subpackets = time_subpacket + issuer_subpacket
-
-    # Unhashed subpackets
-    unhashed_subpackets = issuer_subpacket
+    sig_type = (
+        SignatureType.BinaryDocument
+        if detach_sign
+        else SignatureType.CanonicalDocument
+    )
+    _, unhashed_subpackets = _issuer_subpackets(issuer_key_id)
 
     # MPI encoding of signature
     sig_stripped = raw_signature.lstrip(b'\x00') or b'\x00'
-    bit_len = (len(sig_stripped) - 1) * 8
-    if sig_stripped[0]:
-        bit_len += sig_stripped[0].bit_length()
-    sig_mpi = struct.pack('>H', bit_len) + sig_stripped
+    bit_len = (len(sig_stripped) - 1) * 8 + sig_stripped[0].bit_length()
 
     # Signature packet body
-    sig_body = bytes([4, sig_type_val, 1, hash_algo.value])
-    sig_body += struct.pack('>H', len(hashed_subpackets))
-    sig_body += hashed_subpackets
-    sig_body += struct.pack('>H', len(unhashed_subpackets))
-    sig_body += unhashed_subpackets
-    sig_body += bytes([0x00, 0x00])
-    sig_body += sig_mpi
+    sig_body = b''.join((
+        get_signature_trailer(
+            sig_type, hash_algo, creation_time, issuer_key_id
+        )[:-6],
+        unhashed_subpackets,
+        digest[:2] if digest else bytes([0x00, 0x00]),
+        struct.pack('>H', bit_len),
+        sig_stripped,
+    ))
 
     # Packet header (new format)
     header = bytes([0xC2])  # Tag 2 (signature)
@@ -196,36 +380,101 @@ def wrap_signature_as_pgp(
     else:
         header += bytes([0xFF]) + struct.pack('>I', body_len)
 
-    packet = header + sig_body
-
-    # Parse with pgpy for proper ASCII armoring
-    sig = pgpy.PGPSignature()
-    sig.parse(packet)
-
+    signature = armor(header + sig_body)
     if detach_sign:
-        return str(sig)
+        return signature
 
     # Create cleartext signed message
-    try:
-        text = content.decode('utf-8')
-    except UnicodeDecodeError:
-        text = content.decode('latin-1')
-
-    # Dash-escape lines starting with '-'
-    escaped_lines = []
-    for line in text.split('\n'):
-        if line.startswith('-'):
-            escaped_lines.append('- ' + line)
+    if cleartext is None:
+        cleartext = canonicalize_cleartext(content)
+    hash_name = get_hash_name(algorithm)
+    return (
+        '-----BEGIN PGP SIGNED MESSAGE-----\n'
+        f'Hash: {hash_name}\n'
+        '\n'
+        f'{cleartext.decode("utf-8")}{signature}'
+    )
+
+
+def iter_packets(data: bytes) -> Iterator[Tuple[int, bytes]]:
+    """
+    Iterate over the tags and bodies of OpenPGP packets.
+
+    Raises:
+        ValueError: If the data is not a sequence of OpenPGP packets
+    """
+    pos = 0
+    while pos < len(data):
+        header = data[pos]
+        pos += 1
+        if not header & 0x80:
+            raise ValueError('invalid OpenPGP packet header')
+        if header & 0x40:
+            # new format
+            tag = header & 0x3F
+            first = data[pos]
+            if first < 192:
+                length, pos = first, pos + 1
+            elif first < 224:
+                length = ((first - 192) << 8) + data[pos + 1] + 192
+                pos += 2
+            elif first == 0xFF:
+                length = struct.unpack('>I', data[pos + 1:pos + 5])[0]
+                pos += 5
+            else:
+                raise ValueError('partial OpenPGP packets are not supported')
         else:
-            escaped_lines.append(line)
-    escaped_text = '\n'.join(escaped_lines)
+            # old format
+            tag = (header >> 2) & 0x0F
+            length_type = header & 0x03
+            if length_type == 3:
+                length = len(data) - pos
+            else:
+                size = 1 << length_type
+                length = int.from_bytes(data[pos:pos + size], 'big')
+                pos += size
+        if pos + length > len(data):
+            raise ValueError('truncated OpenPGP packet')
+        yield tag, data[pos:pos + length]
+        pos += length
+
+
+def _read_mpi(data: bytes, pos: int) -> Tuple[int, int]:
+    """Read an MPI, returns its value and the position after it."""
+    bit_len = struct.unpack('>H', data[pos:pos + 2])[0]
+    end = pos + 2 + (bit_len + 7) // 8
+    return int.from_bytes(data[pos + 2:end], 'big'), end
+
+
+def get_rsa_public_keys(data: bytes) -> Dict[str, Tuple[int, int]]:
+    """
+    Get the RSA keys and subkeys of OpenPGP public key packets.
 
-    hash_name = get_hash_name(algorithm)
+    Only version 4 keys are read, their fingerprint is the SHA-1 of the
+    key packet body (RFC 4880 Section 12.2).
 
-    return '\n'.join([
-        '-----BEGIN PGP SIGNED MESSAGE-----',
-        f'Hash: {hash_name}',
-        '',
-        escaped_text,
-        str(sig),
-    ])
+    Args:
+        data: Binary OpenPGP packets, e.g. an exported public key
+
+    Returns:
+        Mapping of fingerprint -> RSA modulus and public exponent
+
+    Raises:
+        ValueError: If the data is not a sequence of OpenPGP packets
+    """
+    keys = {}
+    for tag, body in iter_packets(data):
+        if (
+            tag not in PUBLIC_KEY_TAGS
+            or len(body) < 6
+            or body[0] != 4
+            or body[5] not in RSA_KEY_ALGORITHMS
+        ):
+            continue
+        fingerprint = hashlib.sha1(
+            b'\x99' + struct.pack('>H', len(body)) + body
+        ).hexdigest().upper()
+        modulus, pos = _read_mpi(body, 6)
+        exponent, _ = _read_mpi(body, pos)
+        keys[fingerprint] = (modulus, exponent)
+    return keys
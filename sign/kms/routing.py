@@ -0,0 +1,132 @@
+"""
+Routing of KMS requests between regional replicas of multi-region keys.
+"""
+
+import math
+import time
+from typing import Dict, Iterable, List, Optional
+
+from sign.kms.limiter import ConcurrencyController
+
+# weight of the newest response in the latency average
+LATENCY_SMOOTHING = 0.2
+# consecutive failures after which a replica is skipped for DOWN_TIME
+FAILURE_THRESHOLD = 3
+DOWN_TIME = 30.0
+# a replica unused this long gets a request to refresh its latency
+PROBE_INTERVAL = 30.0
+
+
+class Region:
+    """KMS clients of a region with the request limits of its quotas."""
+
+    def __init__(
+        self,
+        name: Optional[str],
+        client,
+        sign_client,
+        max_concurrency: int,
+        endpoint_url: Optional[str] = None,
+    ):
+        self.name = name
+        self.endpoint_url = endpoint_url
+        self.client = client
+        self.sign_client = sign_client
+        self.concurrency = ConcurrencyController(max_concurrency)
+
+
+class Replica:
+    """
+    A regional replica of a key, with its health as seen by this host.
+
+    The latency is a moving average of successful responses, failures
+    of the region (not throttling, which only lowers the limits) are
+    counted until the next success.
+    """
+
+    def __init__(self, region: Region, key_id: str):
+        self.region = region
+        self.key_id = key_id
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.down_until = 0.0
+        self.last_used = 0.0
+
+    @property
+    def load(self) -> float:
+        """Requests of the replica per slot of its current limit."""
+        concurrency = self.region.concurrency
+        return concurrency.depth(self.key_id) / concurrency.limit(self.key_id)
+
+    def cost(self, now: float) -> float:
+        """
+        Expected time of a request sent now, lower is better.
+
+        A replica without a recent response gets one probing request
+        first, further ones wait for its latency.
+        """
+        idle = self.region.concurrency.depth(self.key_id) == 0
+        if idle and (
+            self.latency is None or now - self.last_used > PROBE_INTERVAL
+        ):
+            return 0.0
+        if self.latency is None:
+            return math.inf
+        return self.latency * (1 + self.load)
+
+    def available(self, now: float) -> bool:
+        return now >= self.down_until
+
+    def record_success(self, latency: float):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= FAILURE_THRESHOLD:
+            self.down_until = time.monotonic() + DOWN_TIME
+
+
+class ReplicaRouter:
+    """
+    Chooses the replica of a key to send a request to.
+
+    Usage:
+        replica = router.choose(keyid)
+        async with replica.region.concurrency.slot(replica.key_id):
+            ...
+            replica.record_success(latency)
+    """
+
+    def __init__(self, replicas: Dict[str, List[Replica]]):
+        self._replicas = replicas
+
+    def replicas(self, keyid: str) -> List[Replica]:
+        return self._replicas[keyid]
+
+    def choose(
+        self,
+        keyid: str,
+        exclude: Iterable[Replica] = (),
+    ) -> Replica:
+        """
+        Returns the available replica with the lowest expected latency.
+
+        Replicas which already failed the request are excluded unless no
+        other is left. When all replicas are down, the one coming back
+        first is tried rather than failing without a request.
+        """
+        now = time.monotonic()
+        replicas = self._replicas[keyid]
+        candidates = [
+            replica for replica in replicas
+            if replica.available(now) and replica not in exclude
+        ] or [replica for replica in replicas if replica.available(now)]
+        if not candidates:
+            return min(replicas, key=lambda replica: replica.down_until)
+        replica = min(candidates, key=lambda replica: replica.cost(now))
+        replica.last_used = now
+        return replica
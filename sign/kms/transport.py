@@ -0,0 +1,333 @@
+"""
+Asynchronous transport of the KMS operations used for signing.
+
+The KMS JSON protocol is small enough to be spoken directly: a request
+is a JSON document POSTed to the regional endpoint with the operation in
+the X-Amz-Target header and a SigV4 signature. botocore only signs the
+requests, they are sent over a pool of keep-alive HTTP/1.1 connections
+on asyncio streams, so concurrent requests are not bound to threads and
+cost little more than a write and a read of a socket.
+"""
+
+import asyncio
+import base64
+import json
+import ssl
+import time
+import urllib.parse
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.exceptions import (
+    ClientError,
+    EndpointConnectionError,
+    HTTPClientError,
+)
+
+SERVICE = 'kms'
+TARGET_PREFIX = 'TrentService'
+CONTENT_TYPE = 'application/x-amz-json-1.1'
+# seconds to wait for a connection or a response
+TIMEOUT = 10.0
+# idle connections are dropped before the server would close them
+IDLE_TIMEOUT = 50.0
+
+# errors of a connection closed by the server or of a garbled response
+CONNECTION_ERRORS = (
+    OSError,
+    asyncio.IncompleteReadError,
+    asyncio.LimitOverrunError,
+    ValueError,
+)
+
+
+class HTTPConnection:
+    """Keep-alive HTTP/1.1 connection sending one request at a time."""
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        self._reader = reader
+        self._writer = writer
+        self.uses = 0
+        self.last_used = time.monotonic()
+        self.broken = False
+
+    @classmethod
+    async def open(
+        cls,
+        host: str,
+        port: int,
+        ssl_context: Optional[ssl.SSLContext] = None,
+    ) -> 'HTTPConnection':
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=ssl_context
+        )
+        return cls(reader, writer)
+
+    def reusable(self) -> bool:
+        return (
+            not self.broken
+            and not self._reader.at_eof()
+            and time.monotonic() - self.last_used < IDLE_TIMEOUT
+        )
+
+    async def _read_body(self, headers: Dict[str, str]) -> bytes:
+        if 'content-length' in headers:
+            return await self._reader.readexactly(
+                int(headers['content-length'])
+            )
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size_line = await self._reader.readuntil(b'\r\n')
+                size = int(size_line.split(b';')[0], 16)
+                if not size:
+                    # KMS sends no trailers
+                    await self._reader.readuntil(b'\r\n')
+                    return b''.join(chunks)
+                chunk = await self._reader.readexactly(size + 2)
+                chunks.append(chunk[:-2])
+        # the body ends with the connection
+        self.broken = True
+        return await self._reader.read()
+
+    async def request(
+        self, head: bytes, body: bytes
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """
+        Sends a request and reads the response.
+
+        Returns
+        -------
+        tuple
+            Status code, headers with lowercase names and body.
+        """
+        self.uses += 1
+        self._writer.write(head + body)
+        await self._writer.drain()
+        status_line, *header_lines = (
+            (await self._reader.readuntil(b'\r\n\r\n'))
+            .decode('latin-1')
+            .split('\r\n')[:-2]
+        )
+        status = int(status_line.split(' ', 2)[1])
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        content = await self._read_body(headers)
+        if headers.get('connection', '').lower() == 'close':
+            self.broken = True
+        self.last_used = time.monotonic()
+        return status, headers, content
+
+    def close(self):
+        self.broken = True
+        self._writer.close()
+
+
+class HTTPConnectionPool:
+    """
+    Bounded pool of keep-alive connections to one HTTP endpoint.
+
+    Requests wait for a free connection, the most recently used idle
+    connection is reused first. A request failing on a reused connection
+    is sent again on another one, the server may have closed it.
+    """
+
+    def __init__(self, url: str, size: int, timeout: float = TIMEOUT):
+        parts = urllib.parse.urlsplit(url)
+        https = parts.scheme == 'https'
+        self._url = url
+        self._host = parts.hostname
+        self._port = parts.port or (443 if https else 80)
+        self._ssl = ssl.create_default_context() if https else None
+        self._request_line = (
+            f'POST {parts.path or "/"} HTTP/1.1\r\nHost: {parts.netloc}\r\n'
+        )
+        self._size = size
+        self._timeout = timeout
+        self._idle: Deque[HTTPConnection] = deque()
+        # Semaphore created lazily to avoid event loop issues in threads
+        self._semaphore = None
+
+    async def _checkout(self) -> HTTPConnection:
+        while self._idle:
+            conn = self._idle.pop()
+            if conn.reusable():
+                return conn
+            conn.close()
+        try:
+            return await asyncio.wait_for(
+                HTTPConnection.open(self._host, self._port, self._ssl),
+                self._timeout,
+            )
+        except (OSError, asyncio.TimeoutError) as error:
+            raise EndpointConnectionError(
+                endpoint_url=self._url, error=error
+            ) from error
+
+    async def post(
+        self, headers: Dict[str, str], body: bytes
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """
+        Sends a POST request.
+
+        Raises
+        ------
+        EndpointConnectionError
+            If no connection could be opened.
+        HTTPClientError
+            If the connection failed or the response timed out.
+        """
+        head = (
+            self._request_line
+            + ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+            + f'Content-Length: {len(body)}\r\n\r\n'
+        ).encode('latin-1')
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._size)
+        async with self._semaphore:
+            while True:
+                conn = await self._checkout()
+                try:
+                    response = await asyncio.wait_for(
+                        conn.request(head, body), self._timeout
+                    )
+                except asyncio.TimeoutError as error:
+                    conn.close()
+                    raise HTTPClientError(error=error) from error
+                except CONNECTION_ERRORS as error:
+                    conn.close()
+                    if conn.uses > 1:
+                        continue
+                    raise HTTPClientError(error=error) from error
+                except BaseException:
+                    conn.close()
+                    raise
+                if conn.broken:
+                    conn.close()
+                else:
+                    self._idle.append(conn)
+                return response
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+
+class AsyncKMSClient:
+    """
+    Asynchronous KMS client with the interface of the boto3 one.
+
+    Binary fields are base64 decoded in responses and encoded in
+    requests, errors are raised as the ClientError boto3 raises, so
+    callers can switch between the clients.
+
+    Usage:
+        client = AsyncKMSClient(session.get_credentials(), 'us-east-1')
+        response = await client.sign(
+            KeyId=key_id,
+            Message=digest,
+            MessageType='DIGEST',
+            SigningAlgorithm='RSASSA_PKCS1_V1_5_SHA_256',
+        )
+        await client.close()
+    """
+
+    def __init__(
+        self,
+        credentials,
+        region: str,
+        endpoint_url: Optional[str] = None,
+        max_connections: int = 100,
+        timeout: float = TIMEOUT,
+    ):
+        """
+        Args:
+            credentials: botocore credentials, refreshed when they expire
+            region: AWS region of the endpoint and of the signature
+            endpoint_url: KMS endpoint (uses the regional AWS endpoint)
+            max_connections: Max concurrent requests and connections
+            timeout: Seconds to wait for a connection or a response
+        """
+        self._credentials = credentials
+        self._region = region
+        self._url = (
+            endpoint_url or f'https://kms.{region}.amazonaws.com'
+        ).rstrip('/') + '/'
+        self._pool = HTTPConnectionPool(self._url, max_connections, timeout)
+
+    async def close(self):
+        self._pool.close()
+
+    def _signed_headers(self, operation: str, body: bytes) -> dict:
+        request = AWSRequest(
+            method='POST',
+            url=self._url,
+            data=body,
+            headers={
+                'Content-Type': CONTENT_TYPE,
+                'X-Amz-Target': f'{TARGET_PREFIX}.{operation}',
+            },
+        )
+        SigV4Auth(
+            self._credentials.get_frozen_credentials(), SERVICE, self._region
+        ).add_auth(request)
+        return dict(request.headers.items())
+
+    async def _call(self, operation: str, params: dict) -> dict:
+        body = json.dumps(params).encode()
+        status, headers, content = await self._pool.post(
+            self._signed_headers(operation, body), body
+        )
+        try:
+            parsed = json.loads(content) if content else {}
+        except ValueError:
+            parsed = {}
+        if status >= 400:
+            # error types may be qualified: "com.amazonaws.kms#NotFound..."
+            code = parsed.get('__type', '').split('#')[-1]
+            message = parsed.get('message') or parsed.get('Message')
+            raise ClientError(
+                {
+                    'Error': {
+                        'Code': code or str(status),
+                        'Message': message
+                        or content.decode('utf-8', 'replace'),
+                    },
+                    'ResponseMetadata': {
+                        'HTTPStatusCode': status,
+                        'RequestId': headers.get('x-amzn-requestid'),
+                    },
+                },
+                operation,
+            )
+        return parsed
+
+    async def sign(
+        self,
+        KeyId: str,
+        Message: bytes,
+        MessageType: str,
+        SigningAlgorithm: str,
+    ) -> dict:
+        response = await self._call('Sign', {
+            'KeyId': KeyId,
+            'Message': base64.b64encode(Message).decode(),
+            'MessageType': MessageType,
+            'SigningAlgorithm': SigningAlgorithm,
+        })
+        response['Signature'] = base64.b64decode(response['Signature'])
+        return response
+
+    async def describe_key(self, KeyId: str) -> dict:
+        return await self._call('DescribeKey', {'KeyId': KeyId})
+
+    async def get_public_key(self, KeyId: str) -> dict:
+        response = await self._call('GetPublicKey', {'KeyId': KeyId})
+        response['PublicKey'] = base64.b64decode(response['PublicKey'])
+        return response
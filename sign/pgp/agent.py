@@ -0,0 +1,326 @@
+"""
+Pooled gpg-agent connections.
+
+gpg can't sign more than one document per process, so instead of keeping
+gpg processes alive the pool keeps long-lived Assuan sessions to
+gpg-agent. Each session signs precomputed digests (SIGKEY/SETHASH/PKSIGN)
+without any fork/exec, keyring lookup or agent handshake per signature.
+"""
+
+import asyncio
+import contextlib
+import logging
+import re
+import subprocess
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from sign.pgp.errors import AgentError
+
+logger = logging.getLogger(__name__)
+
+# Assuan limits a line to 1000 bytes including the "D " prefix and LF
+ASSUAN_LINE_LENGTH = 1000
+AGENT_TIMEOUT = 1200
+
+# OpenPGP hash algorithm ids, libgcrypt uses the same numbers
+HASH_ALGORITHMS = {
+    'SHA256': 8,
+    'SHA384': 9,
+    'SHA512': 10,
+}
+
+
+def get_agent_socket(gpgconf: str = 'gpgconf') -> str:
+    """
+    Returns path to the gpg-agent socket, starts the agent if needed.
+    """
+    subprocess.run(
+        [gpgconf, '--launch', 'gpg-agent'],
+        check=False,
+        capture_output=True,
+    )
+    result = subprocess.run(
+        [gpgconf, '--list-dirs', 'agent-socket'],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip()
+
+
+def assuan_escape(data: bytes) -> bytes:
+    return (
+        data.replace(b'%', b'%25')
+        .replace(b'\r', b'%0D')
+        .replace(b'\n', b'%0A')
+    )
+
+
+def assuan_unescape(data: bytes) -> bytes:
+    return re.sub(
+        rb'%([0-9A-Fa-f]{2})',
+        lambda match: bytes([int(match.group(1), 16)]),
+        data,
+    )
+
+
+def parse_sexp(data: bytes):
+    """
+    Parses canonical S-expression into nested lists of bytes.
+    """
+
+    def parse(pos: int):
+        items = []
+        while pos < len(data):
+            char = data[pos:pos + 1]
+            if char == b'(':
+                item, pos = parse(pos + 1)
+                items.append(item)
+            elif char == b')':
+                return items, pos + 1
+            else:
+                colon = data.index(b':', pos)
+                length = int(data[pos:colon])
+                items.append(data[colon + 1:colon + 1 + length])
+                pos = colon + 1 + length
+        return items, pos
+
+    result, _ = parse(0)
+    if len(result) != 1:
+        raise AgentError(f'malformed S-expression: {data!r}')
+    return result[0]
+
+
+def extract_rsa_signature(sig_val: bytes) -> bytes:
+    """
+    Extracts RSA signature value from (sig-val (rsa (s ...))) expression.
+    """
+    sexp = parse_sexp(sig_val)
+    if len(sexp) < 2 or sexp[0] != b'sig-val' or sexp[1][0] != b'rsa':
+        raise AgentError(f'unsupported signature value: {sig_val!r}')
+    for param in sexp[1][1:]:
+        if param[0] == b's':
+            return param[1]
+    raise AgentError(f'signature value not found: {sig_val!r}')
+
+
+class AgentConnection:
+    """Single Assuan session to gpg-agent."""
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ):
+        self._reader = reader
+        self._writer = writer
+        self.uses = 0
+        self.last_used = time.monotonic()
+        self.broken = False
+
+    @classmethod
+    async def open(cls, socket_path: str) -> 'AgentConnection':
+        reader, writer = await asyncio.open_unix_connection(
+            socket_path, limit=2**20
+        )
+        conn = cls(reader, writer)
+        await conn._read_response()
+        await conn.transact('OPTION pinentry-mode=loopback')
+        return conn
+
+    async def _read_response(
+        self,
+        inquiries: Optional[Dict[str, bytes]] = None,
+    ) -> bytes:
+        data = bytearray()
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                self.broken = True
+                raise AgentError('gpg-agent has closed the connection')
+            line = line.rstrip(b'\n')
+            if line == b'OK' or line.startswith(b'OK '):
+                return bytes(data)
+            if line.startswith(b'ERR '):
+                _, code, message = (line.decode(errors='replace') + ' ').split(
+                    ' ', 2
+                )
+                raise AgentError(
+                    f'gpg-agent error: {message.strip()}', code=int(code)
+                )
+            if line.startswith(b'D '):
+                data += assuan_unescape(line[2:])
+            elif line.startswith(b'INQUIRE '):
+                keyword = line[8:].split(b' ', 1)[0].decode()
+                await self._answer_inquiry((inquiries or {}).get(keyword))
+            # status (S) and comment (#) lines are not needed
+
+    async def _answer_inquiry(self, value: Optional[bytes]):
+        if value is None:
+            self._writer.write(b'CAN\n')
+        else:
+            escaped = assuan_escape(value)
+            step = ASSUAN_LINE_LENGTH - 3
+            for pos in range(0, len(escaped), step):
+                self._writer.write(b'D ' + escaped[pos:pos + step] + b'\n')
+            self._writer.write(b'END\n')
+        await self._writer.drain()
+
+    async def transact(
+        self,
+        command: str,
+        inquiries: Optional[Dict[str, bytes]] = None,
+    ) -> bytes:
+        """
+        Sends a command and returns the data lines of the response.
+
+        Raises
+        ------
+        AgentError
+            If the agent has responded with ERR or the session is broken.
+        """
+        try:
+            self._writer.write(command.encode() + b'\n')
+            await self._writer.drain()
+            return await self._read_response(inquiries)
+        except (OSError, asyncio.IncompleteReadError) as error:
+            self.broken = True
+            raise AgentError(f'gpg-agent connection failed: {error}')
+        except asyncio.CancelledError:
+            # the response of the cancelled command is still in flight
+            self.broken = True
+            raise
+
+    async def ping(self) -> bool:
+        try:
+            await self.transact('NOP')
+        except AgentError:
+            return False
+        return True
+
+    async def sign_digest(
+        self,
+        keygrip: str,
+        digest_algo: str,
+        digest: bytes,
+        passphrase: Optional[str] = None,
+    ) -> bytes:
+        """
+        Signs a precomputed digest with the key identified by keygrip.
+
+        Returns
+        -------
+        bytes
+            Raw RSA signature.
+        """
+        algo = HASH_ALGORITHMS[digest_algo.upper()]
+        inquiries = {}
+        if passphrase is not None:
+            inquiries['PASSPHRASE'] = passphrase.encode('utf-8')
+        self.uses += 1
+        self.last_used = time.monotonic()
+        await self.transact('RESET')
+        await self.transact(f'SIGKEY {keygrip}')
+        await self.transact(f'SETHASH {algo} {digest.hex().upper()}')
+        sig_val = await asyncio.wait_for(
+            self.transact('PKSIGN', inquiries), AGENT_TIMEOUT
+        )
+        return extract_rsa_signature(sig_val)
+
+    async def close(self):
+        self.broken = True
+        with contextlib.suppress(Exception):
+            self._writer.write(b'BYE\n')
+            self._writer.close()
+            await self._writer.wait_closed()
+
+
+class AgentPool:
+    """
+    Bounded pool of gpg-agent sessions used for a single key.
+
+    Idle sessions are health checked before reuse and sessions are
+    recycled after ``max_uses`` signatures.
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        size: int,
+        max_uses: int = 1000,
+        health_check_interval: float = 30,
+    ):
+        self._socket_path = socket_path
+        self._size = size
+        self._max_uses = max_uses
+        self._health_check_interval = health_check_interval
+        self._idle: Deque[AgentConnection] = deque()
+        # Semaphore created lazily to avoid event loop issues in threads
+        self._semaphore = None
+
+    async def _checkout(self) -> AgentConnection:
+        while self._idle:
+            conn = self._idle.pop()
+            idle_for = time.monotonic() - conn.last_used
+            if idle_for < self._health_check_interval or await conn.ping():
+                return conn
+            logger.info('Dropping stale gpg-agent connection')
+            await conn.close()
+        return await AgentConnection.open(self._socket_path)
+
+    async def _checkin(self, conn: AgentConnection):
+        if conn.broken or conn.uses >= self._max_uses:
+            await conn.close()
+        else:
+            self._idle.append(conn)
+
+    @contextlib.asynccontextmanager
+    async def connection(self) -> AsyncIterator[AgentConnection]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._size)
+        async with self._semaphore:
+            try:
+                conn = await self._checkout()
+            except OSError as error:
+                raise AgentError(f'cannot connect to gpg-agent: {error}')
+            try:
+                yield conn
+            finally:
+                await self._checkin(conn)
+
+    async def close(self):
+        while self._idle:
+            await self._idle.pop().close()
+
+
+class AgentPools:
+    """Per-key gpg-agent session pools sharing one agent socket."""
+
+    def __init__(
+        self,
+        socket_path: str,
+        size: int,
+        max_uses: int = 1000,
+        health_check_interval: float = 30,
+    ):
+        self._socket_path = socket_path
+        self._size = size
+        self._max_uses = max_uses
+        self._health_check_interval = health_check_interval
+        self._pools: Dict[str, AgentPool] = {}
+
+    def get(self, keyid: str) -> AgentPool:
+        if keyid not in self._pools:
+            self._pools[keyid] = AgentPool(
+                self._socket_path,
+                self._size,
+                max_uses=self._max_uses,
+                health_check_interval=self._health_check_interval,
+            )
+        return self._pools[keyid]
+
+    async def close(self):
+        for pool in self._pools.values():
+            await pool.close()
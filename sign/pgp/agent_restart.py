@@ -0,0 +1,116 @@
+"""
+Coalesced gpg-agent restarts for card-backed keys.
+"""
+
+import asyncio
+import contextlib
+import logging
+from typing import Awaitable, Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+RESTART_POLICIES = ('always', 'burst', 'on_error')
+
+
+class CardOperation:
+    failed = False
+
+
+class AgentRestartCoordinator:
+    """
+    Decides when gpg-agent is restarted after Yubikey operations.
+
+    Policies:
+        always: restart after every card operation (legacy behavior)
+        burst: restart once no card operation has run for ``delay``
+            seconds, so a burst of queued requests pays for one restart
+        on_error: restart only after a failed card operation
+
+    A failed card operation triggers an immediate restart with every
+    policy. Restarts run in a background task, so they wait for the
+    exclusive gpg-agent lock without holding up the finished request.
+    """
+
+    def __init__(
+        self,
+        restart: Callable[[], Awaitable[None]],
+        policy: str = 'burst',
+        delay: float = 10,
+    ):
+        if policy not in RESTART_POLICIES:
+            raise ValueError(f'unknown gpg-agent restart policy: {policy}')
+        self._restart = restart
+        self._policy = policy
+        self._delay = delay
+        self._active = 0
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+        # only a restart which is still waiting for its delay can be
+        # cancelled, a running one must finish under the agent lock
+        self._waiting = False
+
+    def _pending(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def begin(self):
+        """Registers a started card operation and postpones the restart."""
+        self._active += 1
+        if self._policy == 'burst' and self._pending() and self._waiting:
+            self._task.cancel()
+            self._task = None
+
+    def end(self, failed: bool = False):
+        """Registers a finished card operation."""
+        self._active -= 1
+        self._dirty = True
+        if failed or self._policy == 'always':
+            self._schedule(0)
+        elif self._policy == 'burst' and not self._active:
+            self._schedule(self._delay)
+
+    @contextlib.contextmanager
+    def operation(self) -> Iterator[CardOperation]:
+        """
+        Wraps a card operation.
+
+        Exceptions are treated as failures, other failures are reported
+        by setting ``failed`` of the yielded object.
+        """
+        operation = CardOperation()
+        self.begin()
+        try:
+            yield operation
+        except BaseException:
+            self.end(failed=True)
+            raise
+        self.end(failed=operation.failed)
+
+    def _schedule(self, delay: float):
+        if self._pending():
+            if delay or not self._waiting:
+                # the pending restart happens after this operation anyway,
+                # as it waits for the exclusive gpg-agent lock
+                return
+            self._task.cancel()
+        self._waiting = True
+        self._task = asyncio.ensure_future(self._restart_later(delay))
+
+    async def _restart_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self._waiting = False
+        self._dirty = False
+        try:
+            await self._restart()
+        except Exception:
+            logger.exception('Failed to restart gpg-agent')
+            self._dirty = True
+
+    async def close(self):
+        """Cancels pending timer and performs the outstanding restart."""
+        if self._pending():
+            if self._waiting:
+                self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+        if self._dirty and self._policy != 'on_error':
+            await self._restart_later(0)
@@ -0,0 +1,76 @@
+"""
+Yubikeys holding the same signing key.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from sign.pgp.errors import ConfigurationError
+from sign.utils.locking import GPG_AGENT_LOCK_FILENAME
+
+# seconds a failed card is skipped while other cards serve the key
+CARD_DOWN_SECONDS = 60
+
+# gpg status keywords which point at the card rather than the request
+CARD_FAILURE_STATUSES = ('SC_OP_FAILURE', 'NO_SECKEY')
+
+
+@dataclass(frozen=True)
+class Card:
+    """
+    Yubikey used through its own GnuPG home directory.
+
+    Every home directory runs its own gpg-agent and scdaemon, so the
+    cards are locked and restarted independently. The default card
+    (no home directory) is the one of the service's GnuPG home.
+    """
+
+    serial: Optional[str] = None
+    homedir: Optional[str] = None
+
+    @property
+    def env(self) -> Optional[dict]:
+        if self.homedir is None:
+            return None
+        return {'GNUPGHOME': self.homedir}
+
+    @property
+    def agent_lock(self) -> str:
+        if self.homedir is None:
+            return GPG_AGENT_LOCK_FILENAME
+        return f'{GPG_AGENT_LOCK_FILENAME}.{self.serial}'
+
+
+DEFAULT_CARD = Card()
+
+
+def parse_cards(config: Dict[str, List[dict]]) -> Dict[str, List[Card]]:
+    """
+    Builds cards of every key from the ``yubikey_cards`` setting.
+
+    Raises
+    ------
+    ConfigurationError
+        If a key has no cards, a card misses its serial or home
+        directory, or a home directory is shared by several cards.
+    """
+    cards = {}
+    homedirs = set()
+    for keyid, key_cards in config.items():
+        if not key_cards:
+            raise ConfigurationError(f'no cards are listed for key {keyid}')
+        cards[keyid] = []
+        for card_config in key_cards:
+            serial = card_config.get('serial')
+            homedir = card_config.get('homedir')
+            if not serial or not homedir:
+                raise ConfigurationError(
+                    f'card of key {keyid} requires serial and homedir'
+                )
+            if homedir in homedirs:
+                raise ConfigurationError(
+                    f'gpg home directory {homedir} is used by several cards'
+                )
+            homedirs.add(homedir)
+            cards[keyid].append(Card(serial=str(serial), homedir=homedir))
+    return cards
@@ -3,3 +3,22 @@ class ConfigurationError(Exception):
     """Invalid configuration error."""
 
     pass
+
+
+class GPGError(Exception):
+
+    """gpg has failed to complete an operation."""
+
+    def __init__(self, message, returncode=None, status=None):
+        super().__init__(message)
+        self.returncode = returncode
+        self.status = status or []
+
+
+class AgentError(GPGError):
+
+    """gpg-agent has rejected a request or the session is broken."""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
@@ -0,0 +1,273 @@
+"""
+Non-blocking gpg invocation.
+
+gpg is spawned with ``asyncio.create_subprocess_exec`` so a running
+signature never blocks the event loop. The key passphrase is fed through
+a dedicated pipe (``--passphrase-fd``) instead of a pty, and the
+machine-readable ``--status-fd`` output is parsed to report failures.
+"""
+
+import asyncio
+import contextlib
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
+
+from sign.pgp.errors import GPGError
+
+GPG_TIMEOUT = 1200
+STATUS_PREFIX = '[GNUPG:] '
+
+# gpg status keywords which explain why an operation has failed
+FAILURE_STATUSES = (
+    'BAD_PASSPHRASE',
+    'MISSING_PASSPHRASE',
+    'NO_SECKEY',
+    'INV_SGNR',
+    'KEYEXPIRED',
+    'KEYREVOKED',
+    'SC_OP_FAILURE',
+    'ERROR',
+    'FAILURE',
+)
+
+
+@dataclass
+class GPGResult:
+    returncode: int
+    output: bytes
+    status: List[Tuple[str, str]] = field(default_factory=list)
+    diagnostics: List[str] = field(default_factory=list)
+
+    def has_status(self, keyword: str) -> bool:
+        return any(key == keyword for key, _ in self.status)
+
+    @property
+    def signed(self) -> bool:
+        return self.returncode == 0 and self.has_status('SIG_CREATED')
+
+    def sign_error(self) -> GPGError:
+        return GPGError(
+            f'gpg failed to sign file, error: {self.failure_reason()}',
+            returncode=self.returncode,
+            status=self.status,
+        )
+
+    def failure_reason(self) -> str:
+        """Human readable summary of the failure related status lines."""
+        reasons = [
+            f'{key} {args}'.strip()
+            for key, args in self.status
+            if key in FAILURE_STATUSES
+        ]
+        if not reasons:
+            reasons = self.diagnostics[-3:]
+        return '; '.join(reasons) or f'exit code {self.returncode}'
+
+
+def parse_status(stderr: bytes) -> Tuple[List[Tuple[str, str]], List[str]]:
+    """
+    Splits gpg stderr into status lines and free-form diagnostics.
+
+    Status lines are emitted to stderr (``--status-fd 2``) and are
+    prefixed with ``[GNUPG:]``, everything else is a diagnostic message.
+    """
+    status = []
+    diagnostics = []
+    for line in stderr.decode('utf-8', errors='replace').splitlines():
+        if line.startswith(STATUS_PREFIX):
+            keyword, _, args = line[len(STATUS_PREFIX):].partition(' ')
+            status.append((keyword, args))
+        elif line:
+            diagnostics.append(line)
+    return status, diagnostics
+
+
+def build_sign_args(
+    keyid: str,
+    detach_sign: bool,
+    digest_algo: str,
+    creation_time: Optional[datetime] = None,
+) -> List[str]:
+    args = []
+    if creation_time is not None:
+        # "!" freezes the clock, so the signature gets exactly this time
+        args = ['--faked-system-time', f'{int(creation_time.timestamp())}!']
+    return args + [
+        '--batch',
+        '--yes',
+        '--status-fd',
+        '2',
+        '--pinentry-mode',
+        'loopback',
+        '--digest-algo',
+        digest_algo,
+        '--detach-sign' if detach_sign else '--clear-sign',
+        '--armor',
+        '--local-user',
+        keyid,
+        '--output',
+        '-',
+    ]
+
+
+async def _kill(proc: asyncio.subprocess.Process):
+    with contextlib.suppress(ProcessLookupError):
+        proc.kill()
+    await proc.wait()
+
+
+async def _feed_stdin(
+    proc: asyncio.subprocess.Process,
+    input_chunks: AsyncIterator[bytes],
+):
+    try:
+        async for chunk in input_chunks:
+            proc.stdin.write(chunk)
+            await proc.stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # gpg has exited early, its status explains why
+        return
+    finally:
+        proc.stdin.close()
+
+
+async def _communicate(
+    proc: asyncio.subprocess.Process,
+    input_chunks: Optional[AsyncIterator[bytes]],
+) -> Tuple[bytes, bytes]:
+    if input_chunks is None:
+        return await proc.communicate()
+    _, stdout, stderr = await asyncio.gather(
+        _feed_stdin(proc, input_chunks),
+        proc.stdout.read(),
+        proc.stderr.read(),
+    )
+    await proc.wait()
+    return stdout, stderr
+
+
+async def run_gpg(
+    gpg_binary: str,
+    args: Sequence[str],
+    passphrase: Optional[str] = None,
+    env: Optional[dict] = None,
+    timeout: float = GPG_TIMEOUT,
+    input_chunks: Optional[AsyncIterator[bytes]] = None,
+) -> GPGResult:
+    """
+    Runs gpg without blocking the event loop.
+
+    Parameters
+    ----------
+    gpg_binary : str
+        Path to gpg binary.
+    args : list of str
+        gpg arguments.
+    passphrase : str
+        Key passphrase, could be omitted for keys without it.
+    env : dict
+        Extra environment variables.
+    timeout : float
+        Number of seconds after which gpg is killed.
+    input_chunks : async iterator of bytes
+        Data piped into gpg stdin. gpg is killed if the iterator raises.
+
+    Returns
+    -------
+    GPGResult
+        Exit code, stdout and parsed status lines of gpg.
+    """
+    pass_fds = ()
+    read_fd = None
+    if passphrase is not None:
+        read_fd, write_fd = os.pipe()
+        # the passphrase is far below the pipe buffer size, so the write
+        # never blocks even though nobody reads the pipe yet
+        with os.fdopen(write_fd, 'wb') as pipe:
+            pipe.write(passphrase.encode('utf-8') + b'\n')
+        pass_fds = (read_fd,)
+        args = ['--passphrase-fd', str(read_fd), *args]
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            gpg_binary,
+            *args,
+            stdin=(
+                asyncio.subprocess.DEVNULL
+                if input_chunks is None
+                else asyncio.subprocess.PIPE
+            ),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            pass_fds=pass_fds,
+            env={**os.environ, 'LC_ALL': 'en_US.UTF-8', **(env or {})},
+        )
+    finally:
+        if read_fd is not None:
+            os.close(read_fd)
+    try:
+        stdout, stderr = await asyncio.wait_for(
+            _communicate(proc, input_chunks), timeout
+        )
+    except asyncio.TimeoutError:
+        await _kill(proc)
+        raise GPGError(f'gpg was killed after {timeout} seconds timeout')
+    except BaseException:
+        await _kill(proc)
+        raise
+    status, diagnostics = parse_status(stderr)
+    return GPGResult(
+        returncode=proc.returncode,
+        output=stdout,
+        status=status,
+        diagnostics=diagnostics,
+    )
+
+
+async def gpg_sign_file(
+    gpg_binary: str,
+    keyid: str,
+    path: str,
+    password: str,
+    detach_sign: bool = True,
+    digest_algo: str = 'SHA256',
+    env: Optional[dict] = None,
+    creation_time: Optional[datetime] = None,
+) -> GPGResult:
+    """
+    Creates an ASCII armored signature of the file.
+
+    The signature is returned in ``GPGResult.output``, check
+    ``GPGResult.signed`` to find out whether gpg has succeeded.
+    """
+    args = build_sign_args(keyid, detach_sign, digest_algo, creation_time)
+    return await run_gpg(
+        gpg_binary, args + [path], passphrase=password, env=env
+    )
+
+
+async def gpg_sign_stream(
+    gpg_binary: str,
+    keyid: str,
+    input_chunks: AsyncIterator[bytes],
+    password: str,
+    detach_sign: bool = True,
+    digest_algo: str = 'SHA256',
+    env: Optional[dict] = None,
+    creation_time: Optional[datetime] = None,
+) -> GPGResult:
+    """
+    Creates an ASCII armored signature of the data piped into gpg stdin.
+
+    The signature is returned in ``GPGResult.output``, check
+    ``GPGResult.signed`` to find out whether gpg has succeeded.
+    """
+    args = build_sign_args(keyid, detach_sign, digest_algo, creation_time)
+    return await run_gpg(
+        gpg_binary,
+        args,
+        passphrase=password,
+        env=env,
+        input_chunks=input_chunks,
+    )
@@ -6,6 +6,8 @@
 """CloudLinux Build System PGP related utility functions."""
 
 import datetime
+import time
+
 import plumbum
 
 
@@ -14,6 +16,7 @@ __all__ = [
     "scan_pgp_info_from_file",
     "verify_pgp_key_password",
     "restart_gpg_agent",
+    "get_signing_key",
     "PGPPasswordDB",
 ]
 
@@ -50,11 +53,56 @@ def scan_pgp_info_from_file(gpg, key_file):
     }
 
 
-def restart_gpg_agent():
+def get_signing_key(key):
+    """
+    Finds the (sub)key gpg uses to make signatures with the specified key.
+
+    Like gpg, prefers the most recent valid signing subkey and falls back
+    to the primary key.
+
+    Parameters
+    ----------
+    key : dict
+        Key information as returned by gnupg.GPG.list_keys.
+
+    Returns
+    -------
+    dict
+        keyid, fingerprint, keygrip and algo of the signing key.
+    """
+    now = time.time()
+    candidates = [
+        info
+        for info in key.get("subkey_info", {}).values()
+        if "s" in info.get("cap", "")
+        and info.get("trust") not in ("e", "r", "d", "i")
+        and not (info.get("expires") and float(info["expires"]) < now)
+    ]
+    if candidates:
+        info = max(candidates, key=lambda item: float(item["date"]))
+    else:
+        info = key
+    return {
+        "keyid": info["keyid"],
+        "fingerprint": info["fingerprint"],
+        "keygrip": info.get("keygrip"),
+        "algo": int(info["algo"]),
+    }
+
+
+def restart_gpg_agent(homedir=None):
     """
     Restarts gpg-agent.
+
+    Parameters
+    ----------
+    homedir : str, optional
+        GnuPG home directory of the agent, the default one if omitted.
     """
-    plumbum.local["gpgconf"]["--reload", "gpg-agent"].run(retcode=None)
+    args = ["--homedir", homedir] if homedir else []
+    plumbum.local["gpgconf"][args + ["--reload", "gpg-agent"]].run(
+        retcode=None
+    )
 
 
 def verify_pgp_key_password(gpg, keyid, password):
@@ -1,26 +1,43 @@
 import asyncio
+import functools
 import logging
-import os
-from typing import List, Tuple
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
-import aiofiles
 import gnupg
-import pexpect
-import plumbum
-from aiofiles.os import remove
 from fastapi import UploadFile
 
 from sign.config import settings
-from sign.errors import FileTooBigError
+from sign.errors import DigestSigningError, FileTooBigError
+from sign.kms.pgp_wrapper import (
+    PGPHasher,
+    finish_pgp_hash,
+    wrap_signature_as_pgp,
+)
 from sign.log import SysLog
+from sign.pgp.agent import AgentPools
+from sign.pgp.agent_restart import AgentRestartCoordinator
+from sign.pgp.cards import (
+    CARD_DOWN_SECONDS,
+    CARD_FAILURE_STATUSES,
+    DEFAULT_CARD,
+    Card,
+    parse_cards,
+)
+from sign.pgp.errors import ConfigurationError, GPGError
+from sign.pgp.gpg_process import GPGResult, gpg_sign_file, gpg_sign_stream
 from sign.pgp.helpers import restart_gpg_agent
 from sign.pgp.pgp_password_db import PGPPasswordDB
-from sign.utils.hashing import get_hasher, hash_file
-from sign.utils.locking import (
-    GPG_AGENT_LOCK_FILENAME,
-    exclusive_lock,
-    shared_lock,
-)
+from sign.utils.clock import signature_time
+from sign.utils.fifo_queue import FifoQueue
+from sign.utils.hashing import get_hasher
+from sign.utils.locking import get_lock_manager
+from sign.utils.sha2 import HashState
+from sign.utils.spool import UploadSpool, iter_upload
+
+
+# OpenPGP public key algorithm id of RSA
+RSA_ALGO = 1
 
 
 class PGP:
@@ -33,6 +50,18 @@ class PGP:
         pass_db_dev_mode: bool = False,
         pass_db_dev_pass: str = None,
         tmp_dir: str = '/tmp',
+        spool_memory_threshold: int = 0,
+        agent_pools: Optional[AgentPools] = None,
+        signing_engine: str = 'gpg',
+        stream_uploads: bool = False,
+        sign_concurrency: int = 1,
+        key_concurrency: Optional[Dict[str, int]] = None,
+        lock_timeout: Optional[float] = None,
+        yubikey_restart_policy: str = 'burst',
+        yubikey_restart_delay: float = 10,
+        yubikey_queue_max_depth: int = 0,
+        yubikey_cards: Optional[Dict[str, List[dict]]] = None,
+        signature_time_window: int = 0,
     ):
         self.__gpg = gnupg.GPG(gpgbinary=gpg_binary, keyring=keyring)
         self.__pass_db = PGPPasswordDB(
@@ -40,10 +69,35 @@ class PGP:
         )
         self.max_upload_bytes = max_upload_bytes
         self.tmp_dir = tmp_dir
+        self.spool_memory_threshold = spool_memory_threshold
         self.__pass_db.ask_for_passwords()
         self.__syslog = SysLog(tag_name=settings.service)
-        # Semaphore created lazily to avoid event loop issues in threads
-        self.__gpg_semaphore = None
+        self.__sign_concurrency = sign_concurrency
+        self.__key_concurrency = key_concurrency or {}
+        # Semaphores created lazily to avoid event loop issues in threads
+        self.__key_semaphores = {}
+        self.__locks = get_lock_manager(settings.gpg_locks_dir)
+        self.__lock_timeout = lock_timeout
+        self.__card_queue = FifoQueue(
+            settings.gpg_locks_dir, max_depth=yubikey_queue_max_depth
+        )
+        self.__cards = parse_cards(yubikey_cards or {})
+        self.__restart_policy = yubikey_restart_policy
+        self.__restart_delay = yubikey_restart_delay
+        # one coordinator per gpg-agent, created on the first card use
+        self.__restarts: Dict[Card, AgentRestartCoordinator] = {}
+        self.__agent_pools = agent_pools
+        if signing_engine not in ('gpg', 'agent'):
+            raise ConfigurationError(
+                f'unknown gpg signing engine: {signing_engine}'
+            )
+        if signing_engine == 'agent' and agent_pools is None:
+            raise ConfigurationError(
+                'agent signing engine requires gpg-agent connection pool'
+            )
+        self.__signing_engine = signing_engine
+        self.__stream_uploads = stream_uploads
+        self.__signature_time_window = signature_time_window
 
     def list_keys(self):
         return self.__gpg.list_keys()
@@ -51,9 +105,317 @@ class PGP:
     def key_exists(self, keyid: str) -> bool:
         return keyid in self.__pass_db._PGPPasswordDB__keys.keys()
 
-    @staticmethod
-    def _is_yubikey(keyid: str) -> bool:
-        return keyid in (settings.yubikey_keyids or [])
+    def _is_yubikey(self, keyid: str) -> bool:
+        return keyid in (settings.yubikey_keyids or []) or (
+            keyid in self.__cards
+        )
+
+    def _get_cards(self, keyid: str) -> List[Card]:
+        return self.__cards.get(keyid) or [DEFAULT_CARD]
+
+    def _get_concurrency(self, keyid: str) -> int:
+        """
+        Returns how many batch files are signed with the key at once.
+
+        A card can't sign in parallel, so card-backed keys default to
+        the number of their cards.
+        """
+        if keyid in self.__key_concurrency:
+            return max(1, int(self.__key_concurrency[keyid]))
+        if self._is_yubikey(keyid):
+            return len(self._get_cards(keyid))
+        return max(1, self.__sign_concurrency)
+
+    def _get_key_semaphore(self, keyid: str) -> asyncio.Semaphore:
+        if keyid not in self.__key_semaphores:
+            self.__key_semaphores[keyid] = asyncio.Semaphore(
+                self._get_concurrency(keyid)
+            )
+        return self.__key_semaphores[keyid]
+
+    def _agent_lock(self, card: Card = DEFAULT_CARD):
+        """
+        Shared lock which prevents gpg-agent restarts while signing.
+
+        It is not reentrant: a coroutine taking it again while holding it
+        waits behind a queued restart, which waits for the coroutine.
+        """
+        return self.__locks.shared(
+            card.agent_lock, timeout=self.__lock_timeout
+        )
+
+    def audit_log(self, keyid: str, filename: Optional[str], file_hash: str):
+        """Writes the audit record of a signature made without gpg."""
+        self.__syslog.sign_log(filename, file_hash, file_hash, keyid)
+
+    async def queue_depth(self, keyid: str) -> int:
+        if not self._is_yubikey(keyid):
+            return 0
+        return await self.__card_queue.depth(keyid)
+
+    async def _restart_gpg_agent(self, card: Card = DEFAULT_CARD):
+        async with self.__locks.exclusive(card.agent_lock):
+            # gpgconf blocks, so it is moved off the event loop
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, restart_gpg_agent, card.homedir)
+
+    def _get_restarts(self, card: Card) -> AgentRestartCoordinator:
+        if card not in self.__restarts:
+            self.__restarts[card] = AgentRestartCoordinator(
+                functools.partial(self._restart_gpg_agent, card),
+                policy=self.__restart_policy,
+                delay=self.__restart_delay,
+            )
+        return self.__restarts[card]
+
+    async def _gpg_sign(
+        self,
+        keyid: str,
+        path: str,
+        detach_sign: bool,
+        digest_algo: str,
+        env: Optional[dict] = None,
+    ) -> GPGResult:
+        return await gpg_sign_file(
+            self.__gpg.gpgbinary,
+            keyid,
+            path,
+            self.__pass_db.get_password(keyid),
+            detach_sign=detach_sign,
+            digest_algo=digest_algo,
+            env=env,
+            creation_time=signature_time(self.__signature_time_window),
+        )
+
+    async def _skip_card(self, keyid: str, cards: List[Card], index: int):
+        if len(cards) > 1:
+            logging.warning(
+                'Card %s of key %s has failed, skipping it for %d seconds',
+                cards[index].serial, keyid, CARD_DOWN_SECONDS,
+            )
+            await self.__card_queue.mark_down(
+                keyid, index, CARD_DOWN_SECONDS
+            )
+
+    async def _card_sign(
+        self,
+        keyid: str,
+        path: str,
+        detach_sign: bool,
+        digest_algo: str,
+        timeout: Optional[float],
+    ) -> GPGResult:
+        """
+        Signs the file with a card-backed key on the first idle card.
+
+        Requests of all workers wait in the host-wide FIFO queue of the
+        key, ``timeout`` is the deadline of the request. A card which
+        fails is skipped for a while if the key has other cards.
+        """
+        cards = self._get_cards(keyid)
+        # queued before the agent lock, so waiting requests don't hold
+        # up gpg-agent restarts
+        async with self.__card_queue.slot(
+            keyid,
+            timeout=self.__lock_timeout if timeout is None else timeout,
+            servers=len(cards),
+        ) as slot:
+            card = cards[slot.server]
+            try:
+                async with self._agent_lock(card):
+                    with self._get_restarts(card).operation() as operation:
+                        result = await self._gpg_sign(
+                            keyid, path, detach_sign, digest_algo, env=card.env
+                        )
+                        operation.failed = not result.signed
+            except GPGError:
+                # gpg has hung on the card and was killed
+                await self._skip_card(keyid, cards, slot.server)
+                raise
+            if any(
+                result.has_status(keyword) for keyword in CARD_FAILURE_STATUSES
+            ):
+                await self._skip_card(keyid, cards, slot.server)
+        return result
+
+    async def sign_digest(
+        self,
+        keyid: str,
+        digest_algo: str,
+        digest: bytes,
+    ) -> bytes:
+        """
+        Signs a precomputed digest through a pooled gpg-agent connection.
+
+        Returns raw RSA signature of the key's signing (sub)key.
+        """
+        if self.__agent_pools is None:
+            raise ConfigurationError('gpg-agent connection pool is disabled')
+        signing_key = self.__pass_db.get_signing_key(keyid)
+        async with self._agent_lock():
+            async with self.__agent_pools.get(keyid).connection() as conn:
+                return await conn.sign_digest(
+                    signing_key['keygrip'],
+                    digest_algo,
+                    digest,
+                    passphrase=self.__pass_db.get_password(keyid),
+                )
+
+    def _use_agent(self, keyid: str) -> bool:
+        """
+        Checks if the file could be signed by gpg-agent directly.
+
+        Card-backed keys keep using gpg for serialization and agent
+        restarts, and the packet builder supports RSA keys only.
+        """
+        return (
+            self.__signing_engine == 'agent'
+            and not self._is_yubikey(keyid)
+            and self.__pass_db.get_signing_key(keyid)['algo'] == RSA_ALGO
+        )
+
+    async def _agent_sign(
+        self,
+        keyid: str,
+        chunks: AsyncIterator[bytes],
+        filename: Optional[str],
+        detach_sign: bool,
+        digest_algo: str,
+    ) -> str:
+        """
+        Signs the upload without gpg and temporary files.
+
+        The upload is hashed in process, gpg-agent signs only the digest
+        and the OpenPGP packet is assembled locally.
+        """
+        fingerprint = self.__pass_db.get_signing_key(keyid)['fingerprint']
+        audit_hasher = get_hasher()
+        # cleartext signature embeds the whole (escaped) document anyway
+        pgp_hasher = PGPHasher(digest_algo, text=not detach_sign)
+        upload_size = 0
+        async for chunk in chunks:
+            upload_size += len(chunk)
+            if upload_size > self.max_upload_bytes:
+                raise FileTooBigError
+            audit_hasher.update(chunk)
+            pgp_hasher.update(chunk)
+
+        digest, creation_time = pgp_hasher.digest(
+            fingerprint, signature_time(self.__signature_time_window)
+        )
+        raw_signature = await self.sign_digest(keyid, digest_algo, digest)
+
+        file_hash = audit_hasher.hexdigest()
+        self.__syslog.sign_log(filename, file_hash, file_hash, keyid)
+        return wrap_signature_as_pgp(
+            raw_signature,
+            b'',
+            digest_algo,
+            detach_sign,
+            fingerprint,
+            creation_time,
+            digest=digest,
+            cleartext=None if detach_sign else pgp_hasher.cleartext(),
+        )
+
+    async def sign_hash(
+        self,
+        keyid: str,
+        digest_algo: str = 'SHA256',
+        hash_state: Optional[HashState] = None,
+        digest: Optional[bytes] = None,
+        creation_time: Optional[datetime] = None,
+        filename: Optional[str] = None,
+    ) -> str:
+        """
+        Signs a binary document hashed by the client.
+
+        gpg-agent signs the digest and the OpenPGP packet is assembled
+        locally, so the key must be an RSA key of the agent connection
+        pool. Card-backed keys can't sign digests.
+
+        Raises
+        ------
+        DigestSigningError
+            If the key can't sign digests or the hash state or digest
+            is malformed.
+        """
+        if (
+            self.__agent_pools is None
+            or self._is_yubikey(keyid)
+            or self.__pass_db.get_signing_key(keyid)['algo'] != RSA_ALGO
+        ):
+            raise DigestSigningError(f'key {keyid} can not sign digests')
+        if digest is None:
+            creation_time = signature_time(self.__signature_time_window)
+        fingerprint = self.__pass_db.get_signing_key(keyid)['fingerprint']
+        digest, creation_time = finish_pgp_hash(
+            digest_algo, fingerprint, hash_state, digest, creation_time
+        )
+        raw_signature = await self.sign_digest(keyid, digest_algo, digest)
+        self.__syslog.sign_log(filename, digest.hex(), digest.hex(), keyid)
+        return wrap_signature_as_pgp(
+            raw_signature,
+            b'',
+            digest_algo,
+            True,
+            fingerprint,
+            creation_time,
+            digest=digest,
+        )
+
+    def _use_stream(self, keyid: str) -> bool:
+        # card-backed keys are locked for the whole gpg run, so the upload
+        # is spooled first to keep the lock time short
+        return self.__stream_uploads and not self._is_yubikey(keyid)
+
+    async def _stream_sign(
+        self,
+        keyid: str,
+        chunks: AsyncIterator[bytes],
+        filename: Optional[str],
+        detach_sign: bool,
+        digest_algo: str,
+    ) -> str:
+        """
+        Pipes the upload into gpg stdin and reads the signature from stdout.
+
+        The upload is hashed on the fly for the audit record and never
+        touches the disk.
+        """
+        hasher = get_hasher()
+
+        async def read_upload():
+            upload_size = 0
+            async for chunk in chunks:
+                upload_size += len(chunk)
+                if upload_size > self.max_upload_bytes:
+                    raise FileTooBigError
+                hasher.update(chunk)
+                yield chunk
+
+        result = await gpg_sign_stream(
+            self.__gpg.gpgbinary,
+            keyid,
+            read_upload(),
+            self.__pass_db.get_password(keyid),
+            detach_sign=detach_sign,
+            digest_algo=digest_algo,
+            creation_time=signature_time(self.__signature_time_window),
+        )
+        file_hash = hasher.hexdigest()
+        self.__syslog.sign_log(filename, file_hash, file_hash, keyid)
+        if not result.signed:
+            error = result.sign_error()
+            logging.error(str(error))
+            raise error
+        return result.output.decode('utf-8')
+
+    async def close(self):
+        for restarts in self.__restarts.values():
+            await restarts.close()
+        if self.__agent_pools is not None:
+            await self.__agent_pools.close()
 
     async def sign(
         self,
@@ -61,87 +423,100 @@ class PGP:
         file: UploadFile,
         detach_sign: bool = True,
         digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
     ):
-        upload_size = 0
-        async with aiofiles.tempfile.NamedTemporaryFile(
-            'wb',
-            delete=True,
-            dir=self.tmp_dir,
-        ) as fd:
+        if self._use_agent(keyid):
+            return await self._agent_sign(
+                keyid,
+                iter_upload(file),
+                file.filename,
+                detach_sign,
+                digest_algo,
+            )
+        if self._use_stream(keyid):
+            # the upload is already received, so gpg reads it at the
+            # local pace while holding the agent lock
+            async with self._agent_lock():
+                return await self._stream_sign(
+                    keyid,
+                    iter_upload(file),
+                    file.filename,
+                    detach_sign,
+                    digest_algo,
+                )
+        async with self._spool() as spool:
             # writing content to temp file
-            while content := await file.read(1024 * 1024):
-                upload_size += len(content)
-                if upload_size > self.max_upload_bytes:
-                    raise FileTooBigError
-                await fd.write(content)
-                await fd.flush()
-            file.file.close()
-
-            hash_before = hash_file(
-                fd.name,
-                hasher=get_hasher(),
+            await spool.write_upload(file)
+            return await self._spool_sign(
+                keyid, spool, detach_sign, digest_algo, timeout
             )
 
-            # signing tmp file with gpg binary
-            # using pgp.sign_file() will result in wrong signature
-            password = self.__pass_db.get_password(keyid)
-            sign_cmd = plumbum.local[self.__gpg.gpgbinary][
-                '--yes',
-                '--pinentry-mode',
-                'loopback',
-                '--digest-algo',
-                digest_algo,
-                '--detach-sign' if detach_sign else '--clear-sign',
-                '--armor',
-                '--default-key',
-                keyid,
-                fd.name,
-            ]
-            is_yubikey = self._is_yubikey(keyid)
-            with shared_lock(settings.gpg_locks_dir, GPG_AGENT_LOCK_FILENAME):
-                if is_yubikey:
-                    with exclusive_lock(settings.gpg_locks_dir, keyid):
-                        out, status = pexpect.run(
-                            command=' '.join(sign_cmd.formulate()),
-                            events={"Enter passphrase:.*": "{0}\r".format(password)},
-                            env={"LC_ALL": "en_US.UTF-8"},
-                            timeout=1200,
-                            withexitstatus=1,
-                        )
-                else:
-                    out, status = pexpect.run(
-                        command=' '.join(sign_cmd.formulate()),
-                        events={"Enter passphrase:.*": "{0}\r".format(password)},
-                        env={"LC_ALL": "en_US.UTF-8"},
-                        timeout=1200,
-                        withexitstatus=1,
-                    )
-            if is_yubikey:
-                with exclusive_lock(settings.gpg_locks_dir, GPG_AGENT_LOCK_FILENAME):
-                    restart_gpg_agent()
-            hash_after = hash_file(
-                fd.name,
-                hasher=get_hasher(),
+    async def sign_stream(
+        self,
+        keyid: str,
+        chunks: AsyncIterator[bytes],
+        filename: Optional[str] = None,
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Signs data arriving chunk by chunk, e.g. a raw request body.
+
+        The agent engine hashes the chunks as they arrive and takes the
+        agent lock only to sign the digest. Otherwise the chunks are
+        spooled first: gpg talks to gpg-agent for its whole run, and a
+        slow client must not hold the agent lock, which would hold up
+        agent restarts and every signer queued behind them. The size
+        limit is enforced while reading.
+        """
+        if self._use_agent(keyid):
+            return await self._agent_sign(
+                keyid, chunks, filename, detach_sign, digest_algo
+            )
+        async with self._spool() as spool:
+            await spool.write_stream(chunks)
+            return await self._spool_sign(
+                keyid, spool, detach_sign, digest_algo, timeout
             )
 
-            # it would be nice if we could know the platform too
-            self.__syslog.sign_log(
-                os.path.basename(fd.name),
-                hash_before,
-                hash_after,
-                keyid,
+    async def _spool_sign(
+        self,
+        keyid: str,
+        spool: UploadSpool,
+        detach_sign: bool,
+        digest_algo: str,
+        timeout: Optional[float],
+    ) -> str:
+        hash_before = spool.sha256
+
+        # signing tmp file with gpg binary
+        # using pgp.sign_file() will result in wrong signature
+        if self._is_yubikey(keyid):
+            result = await self._card_sign(
+                keyid, spool.name, detach_sign, digest_algo, timeout
             )
-            if status != 0:
-                message = f'gpg failed to sign file, error: {out}'
-                logging.error(message)
-                raise Exception(message)
+        else:
+            async with self._agent_lock():
+                result = await self._gpg_sign(
+                    keyid, spool.name, detach_sign, digest_algo
+                )
+        hash_after = await spool.verify_hash()
 
-        # reading PGP signature
-        async with aiofiles.open(f'{fd.name}.asc', 'r') as fl:
-            answer = await fl.read()
-        await remove(f'{fd.name}.asc')
+        # it would be nice if we could know the platform too
+        self.__syslog.sign_log(spool.label, hash_before, hash_after, keyid)
+        if not result.signed:
+            error = result.sign_error()
+            logging.error(str(error))
+            raise error
+        return result.output.decode('utf-8')
 
-        return answer
+    def _spool(self) -> UploadSpool:
+        return UploadSpool(
+            self.tmp_dir,
+            self.max_upload_bytes,
+            memory_threshold=self.spool_memory_threshold,
+        )
 
     async def _sign_batch_file(
         self,
@@ -149,66 +524,40 @@ class PGP:
         file: UploadFile,
         detach_sign: bool,
         digest_algo: str,
+        timeout: Optional[float] = None,
     ) -> Tuple[str, str]:
         """Helper method for batch signing with semaphore protection."""
-        upload_size = 0
-        async with aiofiles.tempfile.NamedTemporaryFile(
-            'wb', delete=True, dir=self.tmp_dir
-        ) as fd:
-            while content := await file.read(1024 * 1024):
-                upload_size += len(content)
-                if upload_size > self.max_upload_bytes:
-                    raise FileTooBigError
-                await fd.write(content)
-                await fd.flush()
-            file.file.close()
-
-            hash_before = hash_file(fd.name, hasher=get_hasher())
-
-            password = self.__pass_db.get_password(keyid)
-            sign_cmd = plumbum.local[self.__gpg.gpgbinary][
-                '--yes',
-                '--pinentry-mode',
-                'loopback',
-                '--digest-algo',
-                digest_algo,
-                '--detach-sign' if detach_sign else '--clear-sign',
-                '--armor',
-                '--default-key',
-                keyid,
-                fd.name,
-            ]
-
-            # Serialize pexpect calls within the process; cross-process
-            # coordination is handled by the shared/exclusive lock taken
-            # by the caller (sign_batch).
-            if self.__gpg_semaphore is None:
-                self.__gpg_semaphore = asyncio.Semaphore(1)
-            async with self.__gpg_semaphore:
-                out, status = pexpect.run(
-                    command=' '.join(sign_cmd.formulate()),
-                    events={"Enter passphrase:.*": "{0}\r".format(password)},
-                    env={"LC_ALL": "en_US.UTF-8"},
-                    timeout=1200,
-                    withexitstatus=1,
-                )
+        async with self._spool() as spool:
+            await spool.write_upload(file)
+            hash_before = spool.sha256
+
+            # Limit gpg calls per key within the process; cross-process
+            # coordination is handled by the agent lock or by the card
+            # queue.
+            async with self._get_key_semaphore(keyid):
+                if self._is_yubikey(keyid):
+                    result = await self._card_sign(
+                        keyid, spool.name, detach_sign, digest_algo, timeout
+                    )
+                else:
+                    async with self._agent_lock():
+                        result = await self._gpg_sign(
+                            keyid, spool.name, detach_sign, digest_algo
+                        )
 
-            hash_after = hash_file(fd.name, hasher=get_hasher())
+            hash_after = await spool.verify_hash()
             self.__syslog.sign_log(
-                os.path.basename(fd.name),
+                spool.label,
                 hash_before,
                 hash_after,
                 keyid,
             )
 
-            if status != 0:
-                raise Exception(f'gpg failed to sign file, error: {out}')
+            if not result.signed:
+                raise result.sign_error()
 
-            async with aiofiles.open(f'{fd.name}.asc', 'r') as fl:
-                signature = await fl.read()
-
-        await remove(f'{fd.name}.asc')
-        return fd.name, signature
+        signature = result.output.decode('utf-8')
+        return spool.name, signature
 
     async def _sign_single_file_for_batch(
         self,
@@ -216,29 +565,124 @@ class PGP:
         file: UploadFile,
         detach_sign: bool = True,
         digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
     ) -> Tuple[str, str]:
         """Helper method for batch signing - raises on error for fail-fast behavior."""
         filename = file.filename
+        if self._use_agent(keyid):
+            async with self._get_key_semaphore(keyid):
+                signature = await self._agent_sign(
+                    keyid,
+                    iter_upload(file),
+                    filename,
+                    detach_sign,
+                    digest_algo,
+                )
+            return filename, signature
+        if self._use_stream(keyid):
+            # same per-key limit as _sign_batch_file
+            async with self._get_key_semaphore(keyid), self._agent_lock():
+                signature = await self._stream_sign(
+                    keyid,
+                    iter_upload(file),
+                    filename,
+                    detach_sign,
+                    digest_algo,
+                )
+            return filename, signature
         _, signature = await self._sign_batch_file(
             keyid=keyid,
             file=file,
             detach_sign=detach_sign,
             digest_algo=digest_algo,
+            timeout=timeout,
         )
         return filename, signature
 
+    async def sign_batch_part(
+        self,
+        keyid: str,
+        file: UploadFile,
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Signs one file of a batch received part by part.
+
+        The file waits for the per-key semaphore like the files of
+        ``sign_batch``, so concurrent parts of all batches share the
+        configured per-key concurrency.
+        """
+        _, signature = await self._sign_single_file_for_batch(
+            keyid=keyid,
+            file=file,
+            detach_sign=detach_sign,
+            digest_algo=digest_algo,
+            timeout=timeout,
+        )
+        return signature
+
+    async def _schedule_batch(
+        self,
+        keyid: str,
+        files: List[UploadFile],
+        detach_sign: bool,
+        digest_algo: str,
+        timeout: Optional[float] = None,
+    ) -> List[Tuple[str, str]]:
+        """
+        Signs files with a fixed number of workers per key.
+
+        Workers pick the next file as soon as they are done, so exactly
+        the configured number of files is spooled and signed at a time.
+        The remaining workers are cancelled on the first failure.
+        """
+        results = [None] * len(files)
+        pending = iter(enumerate(files))
+
+        async def worker():
+            for index, file in pending:
+                results[index] = await self._sign_single_file_for_batch(
+                    keyid=keyid,
+                    file=file,
+                    detach_sign=detach_sign,
+                    digest_algo=digest_algo,
+                    timeout=timeout,
+                )
+
+        workers = [
+            asyncio.ensure_future(worker())
+            for _ in range(min(self._get_concurrency(keyid), len(files)))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for task in workers:
+                task.cancel()
+            raise
+        return results
+
     async def sign_batch(
         self,
         keyid: str,
         files: List[UploadFile],
         detach_sign: bool = True,
         digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
     ) -> List[Tuple[str, str]]:
         """
         Sign multiple files asynchronously.
 
-        Uses exclusive_lock for cross-process protection and semaphore
-        for safe agent restarts within the process.
+        A per-key semaphore keeps the configured number of gpg operations
+        in flight. Files of card-backed keys wait for their turn in the
+        host-wide key queue one by one, so a batch is spread over all
+        cards of the key. gpg runs as an asyncio subprocess, so other
+        requests are served while the batch is signed.
+
+        Every file takes the agent lock only for its own signing step:
+        the lock is not reentrant, a batch holding it around nested
+        acquisitions would deadlock with a queued agent restart.
 
         Raises exception immediately if any file fails (fail-fast).
         """
@@ -246,27 +690,9 @@ class PGP:
             "Starting batch signing of %d files with key %s", len(files), keyid
         )
 
-        is_yubikey = self._is_yubikey(keyid)
-        tasks = [
-            self._sign_single_file_for_batch(
-                keyid=keyid,
-                file=file,
-                detach_sign=detach_sign,
-                digest_algo=digest_algo,
-            )
-            for file in files
-        ]
-
-        with shared_lock(settings.gpg_locks_dir, GPG_AGENT_LOCK_FILENAME):
-            if is_yubikey:
-                with exclusive_lock(settings.gpg_locks_dir, keyid):
-                    results = await asyncio.gather(*tasks)
-            else:
-                results = await asyncio.gather(*tasks)
-
-        if is_yubikey:
-            with exclusive_lock(settings.gpg_locks_dir, GPG_AGENT_LOCK_FILENAME):
-                restart_gpg_agent()
+        results = await self._schedule_batch(
+            keyid, files, detach_sign, digest_algo, timeout
+        )
 
         logging.info(
             "Batch signing completed successfully: %d files", len(results)
@@ -1,7 +1,7 @@
 import getpass
 import gnupg
 from sign.pgp.errors import ConfigurationError
-from sign.pgp.helpers import verify_pgp_key_password
+from sign.pgp.helpers import get_signing_key, verify_pgp_key_password
 
 
 class PGPPasswordDB(object):
@@ -61,6 +61,7 @@ class PGPPasswordDB(object):
             self.__keys[keyid]["subkeys"] = [
                 subkey[0] for subkey in key.get("subkeys", [])
             ]
+            self.__keys[keyid]["signing_key"] = get_signing_key(key)
 
     def get_password(self, keyid):
         """
@@ -109,3 +110,19 @@ class PGPPasswordDB(object):
             Subkey fingerprints.
         """
         return self.__keys[keyid]["subkeys"]
+
+    def get_signing_key(self, keyid):
+        """
+        Returns the (sub)key used to make signatures with the specified key.
+
+        Parameters
+        ----------
+        keyid : str
+            Private PGP key keyid.
+
+        Returns
+        -------
+        dict
+            keyid, fingerprint, keygrip and algo of the signing key.
+        """
+        return self.__keys[keyid]["signing_key"]
@@ -1 +1,5 @@
-from .backend import SigningBackend, get_signing_backend
+from .backend import (
+    SigningBackend,
+    close_signing_backend,
+    get_signing_backend,
+)
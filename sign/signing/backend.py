@@ -1,10 +1,12 @@
 import logging
 from abc import ABC, abstractmethod
-from typing import List, Optional, Tuple
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
 
 from fastapi import UploadFile
 
 from sign.config import settings
+from sign.utils.sha2 import HashState
 
 
 class SigningBackend(ABC):
@@ -23,6 +25,19 @@ class SigningBackend(ABC):
         file: UploadFile,
         detach_sign: bool = True,
         digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> str:
+        pass
+
+    @abstractmethod
+    async def sign_stream(
+        self,
+        keyid: str,
+        chunks: AsyncIterator[bytes],
+        filename: Optional[str] = None,
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
     ) -> str:
         pass
 
@@ -33,9 +48,63 @@ class SigningBackend(ABC):
         files: List[UploadFile],
         detach_sign: bool = True,
         digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
     ) -> List[Tuple[str, str]]:
         pass
 
+    async def sign_batch_part(
+        self,
+        keyid: str,
+        file: UploadFile,
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Sign one file of a batch request received part by part.
+
+        Backends limiting the number of batch files signed per key at
+        once override it, others sign the file like ``sign``.
+        """
+        return await self.sign(keyid, file, detach_sign, digest_algo, timeout)
+
+    @abstractmethod
+    async def sign_hash(
+        self,
+        keyid: str,
+        digest_algo: str = 'SHA256',
+        hash_state: Optional[HashState] = None,
+        digest: Optional[bytes] = None,
+        creation_time: Optional[datetime] = None,
+        filename: Optional[str] = None,
+    ) -> str:
+        """
+        Sign a binary document hashed by the client.
+
+        Either the hash state after the document or the final digest
+        made for ``creation_time`` is given.
+        """
+
+    @abstractmethod
+    def audit_log(self, keyid: str, filename: Optional[str], file_hash: str):
+        """
+        Write the audit record of a signature served without signing.
+
+        The record goes where the backend writes the records of the
+        signatures it makes, e.g. for signatures served from cache.
+        """
+
+    async def queue_depth(self, keyid: str) -> int:
+        """Number of requests waiting for or using the key on this host."""
+        return 0
+
+    def concurrency_limit(self, keyid: str) -> Optional[int]:
+        """Current limit of concurrent requests of the key, if adaptive."""
+        return None
+
+    async def close(self):
+        """Release resources held by the backend."""
+
 
 _backend_instance: Optional[SigningBackend] = None
 
@@ -50,7 +119,16 @@ def get_signing_backend() -> SigningBackend:
 
     if backend_type == 'gpg':
         from sign.pgp import PGP
-
+        from sign.pgp.agent import AgentPools, get_agent_socket
+
+        agent_pools = None
+        if settings.gpg_agent_pool_size > 0:
+            agent_pools = AgentPools(
+                get_agent_socket(),
+                size=settings.gpg_agent_pool_size,
+                max_uses=settings.gpg_agent_pool_max_uses,
+                health_check_interval=settings.gpg_agent_health_check_interval,
+            )
         _backend_instance = GPGAdapter(
             PGP(
                 keyring=settings.keyring,
@@ -60,6 +138,18 @@ def get_signing_backend() -> SigningBackend:
                 pass_db_dev_pass=settings.pass_db_dev_pass,
                 max_upload_bytes=settings.max_upload_bytes,
                 tmp_dir=settings.tmp_dir,
+                spool_memory_threshold=settings.get_spool_memory_threshold(),
+                agent_pools=agent_pools,
+                signing_engine=settings.gpg_signing_engine,
+                stream_uploads=settings.gpg_stream_uploads,
+                sign_concurrency=settings.gpg_sign_concurrency,
+                key_concurrency=settings.gpg_key_concurrency,
+                lock_timeout=settings.gpg_lock_timeout,
+                yubikey_restart_policy=settings.yubikey_restart_policy,
+                yubikey_restart_delay=settings.yubikey_restart_delay,
+                yubikey_queue_max_depth=settings.yubikey_queue_max_depth,
+                yubikey_cards=settings.yubikey_cards,
+                signature_time_window=settings.signature_time_window,
             )
         )
         logging.info("Using GPG signing backend")
@@ -90,16 +180,68 @@ def get_signing_backend() -> SigningBackend:
                 max_upload_bytes=settings.max_upload_bytes,
                 tmp_dir=settings.tmp_dir,
                 max_workers=settings.kms_max_workers,
+                signature_time_window=settings.signature_time_window,
+                replicas=settings.get_kms_replicas(),
+                endpoint_url=settings.kms_endpoint_url,
+                transport=settings.kms_transport,
             )
         )
         logging.info("Using AWS KMS signing backend")
 
+    elif backend_type == 'softkey':
+        softkey_files = settings.get_softkey_files()
+        if not softkey_files:
+            raise ValueError(
+                "Software key backend requires softkey keys with "
+                "key_file, public_key_file and gpg_fingerprint"
+            )
+
+        from sign.softkey import SoftKey
+
+        _backend_instance = SoftKeyAdapter(
+            SoftKey(
+                keys=softkey_files,
+                public_keys=settings.get_softkey_public_keys(),
+                pass_db_dev_mode=settings.pass_db_dev_mode,
+                pass_db_dev_pass=settings.pass_db_dev_pass,
+                max_upload_bytes=settings.max_upload_bytes,
+                workers=settings.softkey_workers,
+                signature_time_window=settings.signature_time_window,
+            )
+        )
+        logging.info("Using software key signing backend")
+
     else:
         raise ValueError(f"Unknown signing backend: {backend_type}")
 
+    if settings.signature_cache_enabled:
+        from sign.signing.cache import CachingBackend, SignatureCache
+
+        _backend_instance = CachingBackend(
+            _backend_instance,
+            SignatureCache(
+                settings.signature_cache_dir,
+                ttl=settings.signature_cache_ttl,
+                memory_entries=settings.signature_cache_memory_entries,
+                max_bytes=settings.signature_cache_max_bytes,
+            ),
+            max_upload_bytes=settings.max_upload_bytes,
+            tmp_dir=settings.tmp_dir,
+            spool_memory_threshold=settings.get_spool_memory_threshold(),
+        )
+        logging.info("Serving repeated signatures from cache")
+
     return _backend_instance
 
 
+async def close_signing_backend():
+    global _backend_instance
+
+    if _backend_instance is not None:
+        await _backend_instance.close()
+        _backend_instance = None
+
+
 class GPGAdapter(SigningBackend):
     def __init__(self, pgp):
         self._pgp = pgp
@@ -110,18 +252,47 @@ class GPGAdapter(SigningBackend):
     def list_keys(self) -> List[str]:
         return [key['keyid'] for key in self._pgp.list_keys()]
 
+    async def queue_depth(self, keyid: str) -> int:
+        return await self._pgp.queue_depth(keyid)
+
+    def audit_log(self, keyid: str, filename: Optional[str], file_hash: str):
+        self._pgp.audit_log(keyid, filename, file_hash)
+
+    async def close(self):
+        await self._pgp.close()
+
     async def sign(
         self,
         keyid: str,
         file: UploadFile,
         detach_sign: bool = True,
         digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
     ) -> str:
         return await self._pgp.sign(
             keyid=keyid,
             file=file,
             detach_sign=detach_sign,
             digest_algo=digest_algo,
+            timeout=timeout,
+        )
+
+    async def sign_stream(
+        self,
+        keyid: str,
+        chunks: AsyncIterator[bytes],
+        filename: Optional[str] = None,
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> str:
+        return await self._pgp.sign_stream(
+            keyid=keyid,
+            chunks=chunks,
+            filename=filename,
+            detach_sign=detach_sign,
+            digest_algo=digest_algo,
+            timeout=timeout,
         )
 
     async def sign_batch(
@@ -130,12 +301,48 @@ class GPGAdapter(SigningBackend):
         files: List[UploadFile],
         detach_sign: bool = True,
         digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
     ) -> List[Tuple[str, str]]:
         return await self._pgp.sign_batch(
             keyid=keyid,
             files=files,
             detach_sign=detach_sign,
             digest_algo=digest_algo,
+            timeout=timeout,
+        )
+
+    async def sign_batch_part(
+        self,
+        keyid: str,
+        file: UploadFile,
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> str:
+        return await self._pgp.sign_batch_part(
+            keyid=keyid,
+            file=file,
+            detach_sign=detach_sign,
+            digest_algo=digest_algo,
+            timeout=timeout,
+        )
+
+    async def sign_hash(
+        self,
+        keyid: str,
+        digest_algo: str = 'SHA256',
+        hash_state: Optional[HashState] = None,
+        digest: Optional[bytes] = None,
+        creation_time: Optional[datetime] = None,
+        filename: Optional[str] = None,
+    ) -> str:
+        return await self._pgp.sign_hash(
+            keyid=keyid,
+            digest_algo=digest_algo,
+            hash_state=hash_state,
+            digest=digest,
+            creation_time=creation_time,
+            filename=filename,
         )
 
 
@@ -144,7 +351,8 @@ class KMSAdapter(SigningBackend):
     Adapter for AWS KMS signing backend.
 
     Produces PGP-compatible signatures using AWS KMS for the
-    cryptographic operations.
+    cryptographic operations. KMS requests over the adaptive concurrency
+    limit are queued, ``timeout`` bounds the wait for a request slot.
     """
 
     def __init__(self, kms):
@@ -156,18 +364,50 @@ class KMSAdapter(SigningBackend):
     def list_keys(self) -> List[str]:
         return self._kms.list_keys()
 
+    async def queue_depth(self, keyid: str) -> int:
+        return self._kms.queue_depth(keyid)
+
+    def audit_log(self, keyid: str, filename: Optional[str], file_hash: str):
+        self._kms.audit_log(keyid, filename, file_hash)
+
+    def concurrency_limit(self, keyid: str) -> Optional[int]:
+        return self._kms.concurrency_limit(keyid)
+
+    async def close(self):
+        await self._kms.close()
+
     async def sign(
         self,
         keyid: str,
         file: UploadFile,
         detach_sign: bool = True,
         digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
     ) -> str:
         return await self._kms.sign(
             keyid=keyid,
             file=file,
             detach_sign=detach_sign,
             digest_algo=digest_algo,
+            timeout=timeout,
+        )
+
+    async def sign_stream(
+        self,
+        keyid: str,
+        chunks: AsyncIterator[bytes],
+        filename: Optional[str] = None,
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> str:
+        return await self._kms.sign_stream(
+            keyid=keyid,
+            chunks=chunks,
+            filename=filename,
+            detach_sign=detach_sign,
+            digest_algo=digest_algo,
+            timeout=timeout,
         )
 
     async def sign_batch(
@@ -176,10 +416,125 @@ class KMSAdapter(SigningBackend):
         files: List[UploadFile],
         detach_sign: bool = True,
         digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
     ) -> List[Tuple[str, str]]:
         return await self._kms.sign_batch(
             keyid=keyid,
             files=files,
             detach_sign=detach_sign,
             digest_algo=digest_algo,
+            timeout=timeout,
+        )
+
+    async def sign_hash(
+        self,
+        keyid: str,
+        digest_algo: str = 'SHA256',
+        hash_state: Optional[HashState] = None,
+        digest: Optional[bytes] = None,
+        creation_time: Optional[datetime] = None,
+        filename: Optional[str] = None,
+    ) -> str:
+        return await self._kms.sign_hash(
+            keyid=keyid,
+            digest_algo=digest_algo,
+            hash_state=hash_state,
+            digest=digest,
+            creation_time=creation_time,
+            filename=filename,
+        )
+
+
+class SoftKeyAdapter(SigningBackend):
+    """
+    Adapter for the software key signing backend.
+
+    Produces PGP-compatible signatures with RSA private keys held in
+    memory of a pool of signing processes.
+    """
+
+    def __init__(self, softkey):
+        self._softkey = softkey
+
+    def key_exists(self, keyid: str) -> bool:
+        return self._softkey.key_exists(keyid)
+
+    def list_keys(self) -> List[str]:
+        return self._softkey.list_keys()
+
+    async def queue_depth(self, keyid: str) -> int:
+        return self._softkey.queue_depth(keyid)
+
+    def audit_log(self, keyid: str, filename: Optional[str], file_hash: str):
+        self._softkey.audit_log(keyid, filename, file_hash)
+
+    async def close(self):
+        await self._softkey.close()
+
+    async def sign(
+        self,
+        keyid: str,
+        file: UploadFile,
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> str:
+        return await self._softkey.sign(
+            keyid=keyid,
+            file=file,
+            detach_sign=detach_sign,
+            digest_algo=digest_algo,
+            timeout=timeout,
+        )
+
+    async def sign_stream(
+        self,
+        keyid: str,
+        chunks: AsyncIterator[bytes],
+        filename: Optional[str] = None,
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> str:
+        return await self._softkey.sign_stream(
+            keyid=keyid,
+            chunks=chunks,
+            filename=filename,
+            detach_sign=detach_sign,
+            digest_algo=digest_algo,
+            timeout=timeout,
+        )
+
+    async def sign_batch(
+        self,
+        keyid: str,
+        files: List[UploadFile],
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> List[Tuple[str, str]]:
+        return await self._softkey.sign_batch(
+            keyid=keyid,
+            files=files,
+            detach_sign=detach_sign,
+            digest_algo=digest_algo,
+            timeout=timeout,
+        )
+
+    async def sign_hash(
+        self,
+        keyid: str,
+        digest_algo: str = 'SHA256',
+        hash_state: Optional[HashState] = None,
+        digest: Optional[bytes] = None,
+        creation_time: Optional[datetime] = None,
+        filename: Optional[str] = None,
+    ) -> str:
+        return await self._softkey.sign_hash(
+            keyid=keyid,
+            digest_algo=digest_algo,
+            hash_state=hash_state,
+            digest=digest,
+            creation_time=creation_time,
+            filename=filename,
         )
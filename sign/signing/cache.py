@@ -0,0 +1,446 @@
+"""
+Content-addressed cache of signatures shared by worker processes.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from fastapi import UploadFile
+
+from sign.signing.backend import SigningBackend
+from sign.utils.sha2 import HashState
+from sign.utils.spool import UploadSpool, hash_upload, iter_upload
+
+logger = logging.getLogger(__name__)
+
+# seconds between scans of the disk tier for expired and excess entries
+EVICTION_INTERVAL = 60
+
+
+class SignatureCache:
+    """
+    Two-tier cache of signatures keyed by the signed content.
+
+    The first tier is an LRU dictionary of the worker process, the second
+    one is a directory shared by all workers of the host. Every entry is
+    a file named after the key holding the armored signature. Its mtime
+    is the creation time checked against the TTL, its atime is the last
+    use, so the least recently used entries are evicted once the
+    directory grows past ``max_bytes``. Entries are written to a
+    temporary file and renamed, so readers never see a partial entry.
+
+    Usage:
+        cache = SignatureCache('/var/cache/sign-file', ttl=3600)
+        key = cache.make_key(sha256, keyid, detach_sign, digest_algo)
+        signature = await cache.get(key)
+        if signature is None:
+            signature = sign(...)
+            await cache.put(key, signature)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float,
+        memory_entries: int = 1024,
+        max_bytes: int = 0,
+    ):
+        self._path = Path(path)
+        self._ttl = ttl
+        self._memory_entries = memory_entries
+        self._max_bytes = max_bytes
+        self._memory: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+        self._last_eviction = 0.0
+        self._eviction: Optional[asyncio.Future] = None
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+        }
+
+    @staticmethod
+    def make_key(
+        sha256: str,
+        keyid: str,
+        detach_sign: bool,
+        digest_algo: str,
+    ) -> str:
+        """Returns cache key of the content signed with the parameters."""
+        mode = 'detach' if detach_sign else 'clear'
+        return hashlib.sha256(
+            f'{sha256}:{keyid}:{mode}:{digest_algo.upper()}'.encode()
+        ).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return Path(self._path, key[:2], f'{key}.asc')
+
+    def _remember(self, key: str, created: float, signature: str):
+        self._memory[key] = (created, signature)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_entries:
+            self._memory.popitem(last=False)
+
+    def _read(self, key: str) -> Optional[Tuple[float, str]]:
+        path = self._entry_path(key)
+        try:
+            created = os.stat(path).st_mtime
+            if created + self._ttl < time.time():
+                return None
+            signature = path.read_text()
+            # atime records the last use for the LRU eviction
+            os.utime(path, (time.time(), created))
+        except FileNotFoundError:
+            return None
+        return created, signature
+
+    def _write(self, key: str, signature: str):
+        path = self._entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as tmp_file:
+                tmp_file.write(signature)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+            raise
+
+    def _evict(self) -> int:
+        """Removes expired entries and the least recently used excess."""
+        now = time.time()
+        entries = []
+        evicted = 0
+        for path in self._path.glob('*/*.asc'):
+            try:
+                st = path.stat()
+                if st.st_mtime + self._ttl < now:
+                    path.unlink()
+                    evicted += 1
+                else:
+                    entries.append((st.st_atime, st.st_size, path))
+            except FileNotFoundError:
+                # removed by another worker
+                continue
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if not self._max_bytes or total <= self._max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+                evicted += 1
+            total -= size
+        return evicted
+
+    async def _evict_later(self):
+        loop = asyncio.get_running_loop()
+        try:
+            self._stats['evictions'] += await loop.run_in_executor(
+                None, self._evict
+            )
+        except OSError:
+            logger.exception('Failed to evict signature cache entries')
+
+    def _schedule_eviction(self):
+        if self._eviction is not None and not self._eviction.done():
+            return
+        if time.monotonic() - self._last_eviction < EVICTION_INTERVAL:
+            return
+        self._last_eviction = time.monotonic()
+        self._eviction = asyncio.ensure_future(self._evict_later())
+
+    async def get(self, key: str) -> Optional[str]:
+        """Returns the cached signature, None if it is missing or expired."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            created, signature = entry
+            if created + self._ttl >= time.time():
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return signature
+            del self._memory[key]
+        loop = asyncio.get_running_loop()
+        try:
+            entry = await loop.run_in_executor(None, self._read, key)
+        except OSError:
+            logger.exception('Failed to read signature cache entry')
+            entry = None
+        if entry is None:
+            self._stats['misses'] += 1
+            return None
+        self._remember(key, *entry)
+        self._stats['disk_hits'] += 1
+        return entry[1]
+
+    async def put(self, key: str, signature: str):
+        """Stores the signature in both tiers."""
+        self._remember(key, time.time(), signature)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write, key, signature)
+        except OSError:
+            # the signature is still served, it is just not shared
+            logger.exception('Failed to write signature cache entry')
+        else:
+            self._stats['stores'] += 1
+        self._schedule_eviction()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns hit, miss, store and eviction counters of the process."""
+        return dict(self._stats)
+
+    async def close(self):
+        if self._eviction is not None:
+            await self._eviction
+
+
+class CachingBackend(SigningBackend):
+    """
+    Signing backend serving repeated requests from a signature cache.
+
+    Uploads are hashed before signing and the content hash together
+    with the key, the signature type and the digest algorithm is looked
+    up in the cache. Only missing signatures reach the wrapped backend.
+    """
+
+    def __init__(
+        self,
+        backend: SigningBackend,
+        cache: SignatureCache,
+        max_upload_bytes: int,
+        tmp_dir: Optional[str] = None,
+        spool_memory_threshold: int = 0,
+    ):
+        self._backend = backend
+        self._cache = cache
+        self._max_upload_bytes = max_upload_bytes
+        self._tmp_dir = tmp_dir
+        self._spool_memory_threshold = spool_memory_threshold
+
+    def key_exists(self, keyid: str) -> bool:
+        return self._backend.key_exists(keyid)
+
+    def list_keys(self) -> List[str]:
+        return self._backend.list_keys()
+
+    async def queue_depth(self, keyid: str) -> int:
+        return await self._backend.queue_depth(keyid)
+
+    def concurrency_limit(self, keyid: str) -> Optional[int]:
+        return self._backend.concurrency_limit(keyid)
+
+    async def close(self):
+        await self._cache.close()
+        logger.info('Signature cache stats: %s', self._cache.stats())
+        await self._backend.close()
+
+    async def sign_hash(
+        self,
+        keyid: str,
+        digest_algo: str = 'SHA256',
+        hash_state: Optional[HashState] = None,
+        digest: Optional[bytes] = None,
+        creation_time: Optional[datetime] = None,
+        filename: Optional[str] = None,
+    ) -> str:
+        # the content isn't known, so these signatures aren't cached
+        return await self._backend.sign_hash(
+            keyid=keyid,
+            digest_algo=digest_algo,
+            hash_state=hash_state,
+            digest=digest,
+            creation_time=creation_time,
+            filename=filename,
+        )
+
+    def audit_log(self, keyid: str, filename: Optional[str], file_hash: str):
+        self._backend.audit_log(keyid, filename, file_hash)
+
+    async def _lookup(
+        self,
+        keyid: str,
+        filename: Optional[str],
+        sha256: str,
+        detach_sign: bool,
+        digest_algo: str,
+    ) -> Tuple[str, Optional[str]]:
+        """
+        Returns the cache key and the cached signature of the content.
+
+        A signature served from cache gets the audit record of the
+        wrapped backend, like the signatures it makes.
+        """
+        key = self._cache.make_key(sha256, keyid, detach_sign, digest_algo)
+        signature = await self._cache.get(key)
+        if signature is not None:
+            logger.info(
+                'Signature of %s with key %s is served from cache',
+                filename,
+                keyid,
+            )
+            self._backend.audit_log(keyid, filename, sha256)
+        return key, signature
+
+    async def sign(
+        self,
+        keyid: str,
+        file: UploadFile,
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> str:
+        return await self._sign_upload(
+            self._backend.sign, keyid, file, detach_sign, digest_algo, timeout
+        )
+
+    async def sign_batch_part(
+        self,
+        keyid: str,
+        file: UploadFile,
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> str:
+        return await self._sign_upload(
+            self._backend.sign_batch_part,
+            keyid,
+            file,
+            detach_sign,
+            digest_algo,
+            timeout,
+        )
+
+    async def _sign_upload(
+        self,
+        sign: Callable[..., Awaitable[str]],
+        keyid: str,
+        file: UploadFile,
+        detach_sign: bool,
+        digest_algo: str,
+        timeout: Optional[float],
+    ) -> str:
+        key, signature = await self._lookup(
+            keyid,
+            file.filename,
+            await hash_upload(file),
+            detach_sign,
+            digest_algo,
+        )
+        if signature is not None:
+            file.file.close()
+            return signature
+        signature = await sign(
+            keyid=keyid,
+            file=file,
+            detach_sign=detach_sign,
+            digest_algo=digest_algo,
+            timeout=timeout,
+        )
+        await self._cache.put(key, signature)
+        return signature
+
+    async def sign_stream(
+        self,
+        keyid: str,
+        chunks: AsyncIterator[bytes],
+        filename: Optional[str] = None,
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Signs the streamed upload.
+
+        The content hash is known only at the end of the stream, so the
+        upload is spooled to ``tmp_dir`` (in memory below
+        ``spool_memory_threshold``) while it is hashed and streamed to
+        the wrapped backend from the spool on a miss. Signing thus starts
+        only once the whole body is received: with the cache enabled,
+        backends signing streams while they arrive (KMS, software keys,
+        the gpg agent engine) don't overlap the upload and the signature.
+        """
+        async with UploadSpool(
+            self._tmp_dir,
+            self._max_upload_bytes,
+            memory_threshold=self._spool_memory_threshold,
+        ) as spool:
+            await spool.write_stream(chunks)
+            key, signature = await self._lookup(
+                keyid, filename, spool.sha256, detach_sign, digest_algo
+            )
+            if signature is not None:
+                return signature
+            signature = await self._backend.sign_stream(
+                keyid=keyid,
+                chunks=iter_upload(
+                    UploadFile(file=open(spool.name, 'rb'), filename=filename)
+                ),
+                filename=filename,
+                detach_sign=detach_sign,
+                digest_algo=digest_algo,
+                timeout=timeout,
+            )
+        await self._cache.put(key, signature)
+        return signature
+
+    async def sign_batch(
+        self,
+        keyid: str,
+        files: List[UploadFile],
+        detach_sign: bool = True,
+        digest_algo: str = 'SHA256',
+        timeout: Optional[float] = None,
+    ) -> List[Tuple[str, str]]:
+        results: List[Optional[Tuple[str, str]]] = [None] * len(files)
+        missing = []
+        for index, file in enumerate(files):
+            key, signature = await self._lookup(
+                keyid,
+                file.filename,
+                await hash_upload(file),
+                detach_sign,
+                digest_algo,
+            )
+            if signature is None:
+                missing.append((index, key))
+            else:
+                file.file.close()
+                results[index] = (file.filename, signature)
+        if missing:
+            signed = await self._backend.sign_batch(
+                keyid=keyid,
+                files=[files[index] for index, _ in missing],
+                detach_sign=detach_sign,
+                digest_algo=digest_algo,
+                timeout=timeout,
+            )
+            for (index, key), result in zip(missing, signed):
+                results[index] = result
+                await self._cache.put(key, result[1])
+        logger.info(
+            'Batch of %d files with key %s: %d signatures served from cache',
+            len(files),
+            keyid,
+            len(files) - len(missing),
+        )
+        return results
@@ -0,0 +1 @@
+from .softkey import SoftKey
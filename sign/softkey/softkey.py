@@ -0,0 +1,269 @@
+"""
+Software key signing backend.
+
+RSA private keys are loaded into memory once at startup and sign PGP
+digests with cryptography in a pool of worker processes, which is the
+fastest signer possible but keeps the keys in process memory. Meant for
+staging and high-volume test repositories, not for release keys.
+"""
+
+import asyncio
+import functools
+import getpass
+import logging
+import multiprocessing
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, utils
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
+
+from sign.kms.digest_signer import DigestSigner
+from sign.kms.pgp_wrapper import get_hash_name, get_rsa_public_keys
+from sign.utils.armor import dearmor
+
+logger = logging.getLogger(__name__)
+
+# private keys of a pool worker process, by key ID
+_worker_keys: Dict[str, RSAPrivateKey] = {}
+
+
+def _rsa_sign(
+    private_key: RSAPrivateKey, digest: bytes, hash_name: str
+) -> bytes:
+    """Raw RSA PKCS #1 v1.5 signature of a digest."""
+    return private_key.sign(
+        digest,
+        padding.PKCS1v15(),
+        utils.Prehashed(getattr(hashes, hash_name)()),
+    )
+
+
+def _load_worker_keys(keys: Dict[str, bytes]):
+    """Initializer of the pool workers, loads the DER private keys."""
+    for keyid, der in keys.items():
+        _worker_keys[keyid] = serialization.load_der_private_key(der, None)
+
+
+def _worker_sign(keyid: str, digest: bytes, hash_name: str) -> bytes:
+    return _rsa_sign(_worker_keys[keyid], digest, hash_name)
+
+
+class SoftKey(DigestSigner):
+    """
+    Signing backend with RSA private keys held in memory.
+
+    Keys are PEM files of the RSA private keys of PGP signing keys,
+    passphrase protected or not. They are identified by the key ID of
+    the PGP key, the last 16 hex digits of its fingerprint, like keys of
+    the GPG backend.
+    """
+
+    signer_name = 'Software'
+
+    def __init__(
+        self,
+        keys: Dict[str, str],
+        public_keys: Dict[str, str],
+        pass_db_dev_mode: bool = False,
+        pass_db_dev_pass: Optional[str] = None,
+        max_upload_bytes: int = 100000000,
+        workers: Optional[int] = None,
+        signature_time_window: int = 0,
+    ):
+        """
+        Load the private keys and start the signing processes.
+
+        Args:
+            keys: Mapping of GPG fingerprint -> PEM private key file
+            public_keys: Mapping of GPG fingerprint -> exported PGP
+                public key, armored or binary, the private key has to
+                match
+            pass_db_dev_mode: Use pass_db_dev_pass as passphrase of the
+                keys instead of asking for it
+            pass_db_dev_pass: Passphrase of the keys in development mode
+            max_upload_bytes: Maximum file size for signing
+            workers: Number of signing processes (defaults to the number
+                of CPUs), 0 signs in threads of the service process
+            signature_time_window: Round signature creation time down to
+                multiples of this many seconds (0 keeps the exact time)
+        """
+        if pass_db_dev_mode and not pass_db_dev_pass:
+            raise ValueError(
+                "You need to provide development PGP password when "
+                "running in development mode"
+            )
+        self._pass_db_dev_mode = pass_db_dev_mode
+        self._pass_db_dev_pass = pass_db_dev_pass
+        self._max_upload_bytes = max_upload_bytes
+        self._signature_time_window = signature_time_window
+        self._gpg_fingerprints: Dict[str, str] = {}
+        self._private_keys: Dict[str, RSAPrivateKey] = {}
+        for fingerprint, key_file in keys.items():
+            keyid = fingerprint[-16:].upper()
+            self._gpg_fingerprints[keyid] = fingerprint
+            self._private_keys[keyid] = self._load_key(keyid, key_file)
+            self._check_public_key(
+                keyid, fingerprint, public_keys.get(fingerprint)
+            )
+            logger.info("Software key %s loaded from %s", keyid, key_file)
+        self._workers = os.cpu_count() if workers is None else workers
+        self._pool = self._create_pool()
+        self._depth: Dict[str, int] = defaultdict(int)
+
+    def _load_key(self, keyid: str, key_file: str) -> RSAPrivateKey:
+        """Load a PEM private key, asking for its passphrase if needed."""
+        with open(key_file, 'rb') as f:
+            pem = f.read()
+        try:
+            private_key = serialization.load_pem_private_key(pem, None)
+        except TypeError:
+            # the key is encrypted
+            if self._pass_db_dev_mode:
+                password = self._pass_db_dev_pass
+            else:
+                password = getpass.getpass(
+                    f'\nPlease enter the {keyid} PGP key password: '
+                )
+            try:
+                private_key = serialization.load_pem_private_key(
+                    pem, password.encode()
+                )
+            except ValueError as e:
+                raise ValueError(
+                    f"PGP key {keyid} password is not valid"
+                ) from e
+        if not isinstance(private_key, RSAPrivateKey):
+            raise ValueError(f"PGP key {keyid} is not an RSA key")
+        return private_key
+
+    def _check_public_key(
+        self, keyid: str, fingerprint: str, public_key_file: Optional[str]
+    ):
+        """
+        Check that the private key is the one of the fingerprint.
+
+        The fingerprint hashes the key creation time too, so it is
+        checked against the exported PGP public key.
+        """
+        if public_key_file is None:
+            raise ValueError(f"PGP key {keyid} has no public key file")
+        with open(public_key_file, 'rb') as f:
+            data = f.read()
+        try:
+            if data.lstrip().startswith(b'-----BEGIN PGP'):
+                data = dearmor(data.decode())
+            public_key = get_rsa_public_keys(data).get(fingerprint.upper())
+        except ValueError as e:
+            raise ValueError(
+                f"{public_key_file} is not a PGP public key: {e}"
+            ) from e
+        if public_key is None:
+            raise ValueError(
+                f"{public_key_file} has no RSA key {fingerprint}"
+            )
+        numbers = self._private_keys[keyid].public_key().public_numbers()
+        if public_key != (numbers.n, numbers.e):
+            raise ValueError(
+                f"PGP key {keyid} does not match fingerprint {fingerprint}"
+            )
+
+    def _create_pool(self) -> Optional[ProcessPoolExecutor]:
+        if not self._workers:
+            return None
+        keys = {
+            keyid: private_key.private_bytes(
+                serialization.Encoding.DER,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+            for keyid, private_key in self._private_keys.items()
+        }
+        # forking a process running an event loop and threads may
+        # deadlock the children
+        return ProcessPoolExecutor(
+            max_workers=self._workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_load_worker_keys,
+            initargs=(keys,),
+        )
+
+    def key_exists(self, keyid: str) -> bool:
+        """Check if a key exists in the configured key list."""
+        return keyid in self._private_keys
+
+    def list_keys(self) -> List[str]:
+        """Return list of configured key IDs."""
+        return list(self._private_keys)
+
+    def queue_depth(self, keyid: str) -> int:
+        """Number of digests of the key waiting for or being signed."""
+        return self._depth[keyid]
+
+    async def close(self):
+        """Stop the signing processes."""
+        if self._pool is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                functools.partial(self._pool.shutdown, cancel_futures=True),
+            )
+
+    def get_gpg_fingerprint(self, keyid: str) -> str:
+        """Get the GPG fingerprint for a given key ID."""
+        return self._gpg_fingerprints[keyid]
+
+    async def _sign_digest(
+        self, keyid: str, digest: bytes, digest_algo: str
+    ) -> bytes:
+        """
+        Sign a digest in a signing process.
+
+        Raises:
+            BrokenProcessPool: If a signing process died, the pool is
+                replaced for the next requests
+        """
+        loop = asyncio.get_running_loop()
+        hash_name = get_hash_name(digest_algo)
+        if self._pool is None:
+            return await loop.run_in_executor(
+                None,
+                _rsa_sign,
+                self._private_keys[keyid],
+                digest,
+                hash_name,
+            )
+        pool = self._pool
+        try:
+            return await loop.run_in_executor(
+                pool, _worker_sign, keyid, digest, hash_name
+            )
+        except BrokenProcessPool:
+            if self._pool is pool:
+                logger.error("Software key signing process died")
+                self._pool = self._create_pool()
+            raise
+
+    async def _sign_raw(
+        self,
+        keyid: str,
+        digest: bytes,
+        digest_algo: str,
+        timeout: Optional[float],
+    ) -> bytes:
+        """
+        Sign the digest, the timeout is unused as signing waits for no lock.
+
+        Raises:
+            RuntimeError: If a signing process died
+        """
+        self._depth[keyid] += 1
+        try:
+            return await self._sign_digest(keyid, digest, digest_algo)
+        except BrokenProcessPool as e:
+            raise RuntimeError(f"Software key signing failed: {e}") from e
+        finally:
+            self._depth[keyid] -= 1
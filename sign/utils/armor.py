@@ -0,0 +1,126 @@
+"""
+OpenPGP ASCII armor (RFC 4880 Section 6).
+"""
+
+import base64
+
+CRC24_INIT = 0xB704CE
+CRC24_POLY = 0x1864CFB
+# base64 characters per armored line
+LINE_LENGTH = 64
+
+
+def _crc24_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 16
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= CRC24_POLY
+        table.append(crc & 0xFFFFFF)
+    return table
+
+
+_CRC24_TABLE = _crc24_table()
+
+
+def crc24(data: bytes) -> int:
+    """
+    Returns CRC-24 checksum of the data.
+
+    Parameters
+    ----------
+    data : bytes
+        Data to checksum.
+
+    Returns
+    -------
+    int
+        24 bit checksum.
+    """
+    crc = CRC24_INIT
+    table = _CRC24_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFF) ^ table[(crc >> 16) ^ byte]
+    return crc
+
+
+def armor(data: bytes, block_type: str = 'SIGNATURE') -> str:
+    """
+    Returns ASCII armor of OpenPGP packets, as gpg writes it.
+
+    Parameters
+    ----------
+    data : bytes
+        Binary packets.
+    block_type : str
+        Type in the armor header line, e.g. SIGNATURE or PUBLIC KEY BLOCK.
+
+    Returns
+    -------
+    str
+        Armored packets ending with a line end.
+    """
+    encoded = base64.b64encode(data).decode()
+    body = '\n'.join(
+        encoded[start:start + LINE_LENGTH]
+        for start in range(0, len(encoded), LINE_LENGTH)
+    )
+    checksum = base64.b64encode(crc24(data).to_bytes(3, 'big')).decode()
+    return (
+        f'-----BEGIN PGP {block_type}-----\n'
+        '\n'
+        f'{body}\n'
+        f'={checksum}\n'
+        f'-----END PGP {block_type}-----\n'
+    )
+
+
+def dearmor(text: str) -> bytes:
+    """
+    Returns the binary packets of ASCII armored data.
+
+    Parameters
+    ----------
+    text : str
+        Armored packets, e.g. an exported public key.
+
+    Returns
+    -------
+    bytes
+        Binary packets.
+
+    Raises
+    ------
+    ValueError
+        If the armor is malformed or its checksum doesn't match.
+    """
+    lines = iter(text.splitlines())
+    for line in lines:
+        if line.startswith('-----BEGIN PGP '):
+            break
+    else:
+        raise ValueError('armor header line is missing')
+    # armor headers end with an empty line
+    for line in lines:
+        if not line.strip():
+            break
+    body = []
+    checksum = None
+    for line in lines:
+        line = line.strip()
+        if line.startswith('-----END PGP '):
+            break
+        if line.startswith('='):
+            checksum = line[1:]
+        else:
+            body.append(line)
+    else:
+        raise ValueError('armor tail line is missing')
+    data = base64.b64decode(''.join(body))
+    if checksum is not None and (
+        base64.b64decode(checksum) != crc24(data).to_bytes(3, 'big')
+    ):
+        raise ValueError('armor checksum does not match')
+    return data
@@ -0,0 +1,154 @@
+"""
+Canonical text of OpenPGP cleartext signatures (RFC 4880 Section 7.1).
+"""
+
+import re
+
+# gpg cuts lines longer than this many bytes and drops the rest of them
+MAX_LINE_LENGTH = 19993
+
+_WHITESPACE = b' \t\r'
+# gpg also escapes "From " lines, which mail programs would mangle;
+# the pattern starts with a literal, so re searches for it quickly
+_ESCAPED_LINE = re.compile(rb'\n(?=-|From )')
+_LONG_LINE = re.compile(rb'^([^\n]{%d})[^\n]+' % MAX_LINE_LENGTH, re.MULTILINE)
+
+
+def _has_long_line(lines: bytes) -> bool:
+    """
+    Tells whether some line may be longer than MAX_LINE_LENGTH.
+
+    Such a line covers a whole window of half of that length, so only
+    a few windows are searched for a line end instead of every line.
+    """
+    window = MAX_LINE_LENGTH // 2
+    return any(
+        lines.find(b'\n', start, start + window) < 0
+        for start in range(0, len(lines) - window + 1, window)
+    )
+
+
+class CleartextCanonicalizer:
+    """
+    Canonicalizes a document for a cleartext signature as gpg does.
+
+    The document is fed in chunks of any size and processed a block of
+    complete lines at a time, so no line is ever split:
+
+    * only LF ends a line, a lone CR is a regular character;
+    * lines are cut to MAX_LINE_LENGTH bytes;
+    * the hash gets every line without trailing spaces, tabs and CRs,
+      lines are joined with CRLF and the line ending before the
+      signature isn't hashed;
+    * the output is the document with lines starting with '-' or
+      'From ' escaped by '- ', lines otherwise kept as they are
+      (trailing whitespace and CRs included) and ending with LF.
+
+    Usage:
+        canonicalizer = CleartextCanonicalizer(hashlib.sha256())
+        for chunk in chunks:
+            output += canonicalizer.update(chunk)
+        output += canonicalizer.finish()
+    """
+
+    def __init__(self, hasher=None):
+        """
+        Parameters
+        ----------
+        hasher : hashlib.Hasher, optional
+            Hash fed with the canonical text, without it the text is
+            only escaped.
+        """
+        self._hasher = hasher
+        self._tail = bytearray()
+        # the line ending of the previous line is hashed only if the
+        # document continues after it
+        self._pending_line_end = False
+        self._finished = False
+
+    def _hash(self, data: bytes):
+        if self._hasher is not None:
+            self._hasher.update(data)
+
+    @staticmethod
+    def _escape(lines: bytes) -> bytes:
+        if lines.startswith((b'-', b'From ')):
+            lines = b'- ' + lines
+        if b'\n-' in lines or b'\nFrom ' in lines:
+            return _ESCAPED_LINE.sub(b'\n- ', lines)
+        return lines
+
+    @staticmethod
+    def _strip(lines: bytes) -> bytes:
+        """Returns lines without trailing whitespace joined with CRLF."""
+        if b' \n' in lines or b'\t\n' in lines or b'\r\n' in lines:
+            split = lines.split(b'\n')
+            split.pop()
+            return b'\r\n'.join(
+                map(bytes.rstrip, split, [_WHITESPACE] * len(split))
+            )
+        return lines[:-1].replace(b'\n', b'\r\n')
+
+    def update(self, data: bytes) -> bytes:
+        """
+        Feeds the next chunk of the document.
+
+        Returns
+        -------
+        bytes
+            Escaped output of the lines completed by the chunk.
+        """
+        end = data.rfind(b'\n') + 1
+        if not end:
+            self._tail += data
+            # a part of a line is kept only to know that it is too long
+            del self._tail[MAX_LINE_LENGTH + 1:]
+            return b''
+        if self._tail:
+            lines = bytes(self._tail) + data[:end]
+        else:
+            lines = bytes(data[:end])
+        self._tail = bytearray(data[end:end + MAX_LINE_LENGTH + 1])
+
+        if _has_long_line(lines):
+            lines = _LONG_LINE.sub(rb'\1', lines)
+        if self._pending_line_end:
+            self._hash(b'\r\n')
+        self._hash(self._strip(lines))
+        self._pending_line_end = True
+        return self._escape(lines)
+
+    def finish(self) -> bytes:
+        """
+        Finishes the document.
+
+        Returns
+        -------
+        bytes
+            Escaped output of the last line, always ending with LF.
+        """
+        if self._finished:
+            return b''
+        self._finished = True
+        if not self._tail:
+            # an empty document is a single empty line
+            return b'' if self._pending_line_end else b'\n'
+        line = bytes(self._tail[:MAX_LINE_LENGTH])
+        self._tail = bytearray()
+        if self._pending_line_end:
+            self._hash(b'\r\n')
+        self._hash(line.rstrip(_WHITESPACE))
+        return self._escape(line) + b'\n'
+
+
+def canonicalize_cleartext(content: bytes, hasher=None) -> bytes:
+    """
+    Canonicalizes a whole document, see CleartextCanonicalizer.
+
+    Returns
+    -------
+    bytes
+        Escaped output of the document.
+    """
+    canonicalizer = CleartextCanonicalizer(hasher)
+    return canonicalizer.update(content) + canonicalizer.finish()
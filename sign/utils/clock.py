@@ -0,0 +1,23 @@
+"""
+Creation time of signatures.
+"""
+
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+
+def signature_time(window: int = 0) -> Optional[datetime]:
+    """
+    Returns creation time for a new signature.
+
+    With a window the current time is rounded down to the start of the
+    window, so the same content signed with the same key within one
+    window gets a byte-identical signature from deterministic schemes
+    like RSA PKCS#1 v1.5. Without it None is returned, which lets the
+    signer use the current time.
+    """
+    if not window:
+        return None
+    now = int(time.time())
+    return datetime.fromtimestamp(now - now % window, tz=timezone.utc)
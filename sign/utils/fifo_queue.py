@@ -0,0 +1,334 @@
+"""
+Host-local FIFO queues shared by worker processes.
+"""
+
+import asyncio
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple, TypeVar
+
+from sign.errors import LockTimeoutError, QueueRejectedError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# weight of the latest operation in the service time estimate
+SERVICE_TIME_WEIGHT = 0.2
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@dataclass
+class QueueSlot:
+    # number of requests which were ahead on arrival
+    position: int
+    # index of the server assigned to the request
+    server: Optional[int]
+
+
+class FifoQueue:
+    """
+    FIFO queues of requests for exclusive resources, e.g. Yubikeys.
+
+    Every queue is a small JSON file in the queue directory listing the
+    queued requests in arrival order, so all worker processes of the
+    host see one queue. The file is flocked only while it is rewritten.
+    A queue may be served by several identical servers (e.g. cards with
+    the same key): the oldest waiting request gets the first idle server
+    which is not marked down, the others poll for their turn.
+
+    Each request may carry a deadline. A request is rejected right away
+    if the queue is full or if, judging by the average time the resource
+    is held, it can't be served before its deadline. A request still
+    waiting at its deadline leaves the queue. Requests of dead processes
+    are dropped, so a crashed worker doesn't block the queue.
+
+    Usage:
+        queue = FifoQueue('/tmp/gpg_locks', max_depth=20)
+        async with queue.slot(keyid, timeout=60, servers=2) as slot:
+            sign(cards[slot.server])
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_depth: int = 0,
+        poll_interval: float = 0.01,
+        max_poll_interval: float = 0.1,
+    ):
+        self._path = Path(path)
+        self._max_depth = max_depth
+        self._poll_interval = poll_interval
+        self._max_poll_interval = max_poll_interval
+        self._fds: Dict[str, int] = {}
+        # one thread per queue applies the updates of the process in the
+        # order they were made, threads sharing the descriptor would
+        # share its flock too
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._pid = os.getpid()
+
+    def _fileno(self, name: str) -> Tuple[int, ThreadPoolExecutor]:
+        if self._pid != os.getpid():
+            # descriptors inherited through fork share flocks with the
+            # parent, its threads are not inherited
+            self._fds = {}
+            self._executors = {}
+            self._pid = os.getpid()
+        if name not in self._fds:
+            self._path.mkdir(exist_ok=True, parents=True)
+            self._fds[name] = os.open(
+                Path(self._path, f'{name}.queue'),
+                os.O_RDWR | os.O_CREAT,
+                0o644,
+            )
+            self._executors[name] = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f'queue-{name}'
+            )
+        return self._fds[name], self._executors[name]
+
+    @staticmethod
+    def _read(fd: int) -> dict:
+        size = os.fstat(fd).st_size
+        data = os.pread(fd, size, 0) if size else b''
+        try:
+            state = json.loads(data) if data else {}
+        except ValueError:
+            logger.warning('Discarding corrupted queue state')
+            state = {}
+        state.setdefault('entries', [])
+        state.setdefault('service_time', 0.0)
+        state.setdefault('down', {})
+        return state
+
+    @staticmethod
+    def _write(fd: int, state: dict):
+        data = json.dumps(state).encode()
+        os.pwrite(fd, data, 0)
+        os.ftruncate(fd, len(data))
+
+    def _update_locked(self, fd: int, update: Callable[[dict], T]) -> T:
+        """Applies the update to the queue state under the queue file lock."""
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            state = self._read(fd)
+            before = json.dumps(state)
+            result = update(state)
+            if json.dumps(state) != before:
+                self._write(fd, state)
+            return result
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    async def _update(self, name: str, update: Callable[[dict], T]) -> T:
+        """
+        Applies the update in the worker thread of the queue.
+
+        Waiting for the lock held by another worker and the file IO
+        block, so they run off the event loop like the IO of
+        IdempotencyStore.
+        """
+        fd, executor = self._fileno(name)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            executor, self._update_locked, fd, update
+        )
+        # updates of cancelled requests, e.g. leaving the queue, are
+        # applied all the same
+        return await asyncio.shield(future)
+
+    @staticmethod
+    def _prune(state: dict, now: float):
+        state['down'] = {
+            server: until
+            for server, until in state['down'].items()
+            if until > now
+        }
+        state['entries'] = [
+            entry
+            for entry in state['entries']
+            if pid_alive(entry['pid'])
+            and (
+                entry['started'] is not None
+                or entry['deadline'] is None
+                or entry['deadline'] > now
+            )
+        ]
+
+    async def _enqueue(
+        self,
+        name: str,
+        ticket: str,
+        deadline: Optional[float],
+        servers: int,
+    ) -> int:
+        def enqueue(state: dict) -> int:
+            now = time.time()
+            self._prune(state, now)
+            depth = len(state['entries'])
+            service_time = state['service_time']
+            if self._max_depth and depth >= self._max_depth:
+                raise QueueRejectedError(
+                    f'queue of {name} is full',
+                    depth=depth,
+                    retry_after=service_time,
+                )
+            if (
+                deadline is not None
+                and now + (depth // servers + 1) * service_time > deadline
+            ):
+                raise QueueRejectedError(
+                    f'queue of {name} can not serve the request '
+                    f'before its deadline',
+                    depth=depth,
+                    retry_after=service_time,
+                )
+            state['entries'].append({
+                'id': ticket,
+                'pid': os.getpid(),
+                'deadline': deadline,
+                'started': None,
+                'server': None,
+            })
+            return depth
+
+        return await self._update(name, enqueue)
+
+    @staticmethod
+    def _idle_server(state: dict, servers: int) -> Optional[int]:
+        busy = {
+            entry['server']
+            for entry in state['entries']
+            if entry['started'] is not None
+        }
+        idle = [server for server in range(servers) if server not in busy]
+        down = {int(server) for server in state['down']}
+        if not set(range(servers)) <= down:
+            # when every server is down they are all tried anyway
+            idle = [server for server in idle if server not in down]
+        return idle[0] if idle else None
+
+    async def _poll(
+        self,
+        name: str,
+        ticket: str,
+        servers: int,
+    ) -> Optional[QueueSlot]:
+        """
+        Starts serving the request if its turn has come.
+
+        Returns None if the request is no longer queued, a slot with
+        the assigned server (None while waiting) otherwise.
+        """
+
+        def poll(state: dict) -> Optional[QueueSlot]:
+            now = time.time()
+            self._prune(state, now)
+            waiting = 0
+            for entry in state['entries']:
+                if entry['id'] == ticket:
+                    if entry['started'] is None and not waiting:
+                        server = self._idle_server(state, servers)
+                        if server is not None:
+                            entry['started'] = now
+                            entry['server'] = server
+                    return QueueSlot(waiting, entry['server'])
+                if entry['started'] is None:
+                    waiting += 1
+            return None
+
+        return await self._update(name, poll)
+
+    async def _dequeue(
+        self, name: str, ticket: str, held: Optional[float]
+    ):
+        def dequeue(state: dict):
+            state['entries'] = [
+                entry for entry in state['entries'] if entry['id'] != ticket
+            ]
+            if held is not None:
+                service_time = state['service_time']
+                state['service_time'] = (
+                    held
+                    if not service_time
+                    else service_time
+                    + SERVICE_TIME_WEIGHT * (held - service_time)
+                )
+
+        await self._update(name, dequeue)
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self,
+        name: str,
+        timeout: Optional[float] = None,
+        servers: int = 1,
+    ) -> AsyncIterator[QueueSlot]:
+        """
+        Waits for the turn in the queue and holds a server.
+
+        Every process must use the same number of servers for the queue.
+
+        Raises
+        ------
+        QueueRejectedError
+            If the queue is full or the request can't be served in time.
+        LockTimeoutError
+            If the turn hasn't come before the timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        ticket = uuid.uuid4().hex
+        started = None
+        try:
+            arrival = await self._enqueue(name, ticket, deadline, servers)
+            interval = self._poll_interval
+            while True:
+                slot = await self._poll(name, ticket, servers)
+                if slot is not None and slot.server is not None:
+                    break
+                if slot is None or (
+                    deadline is not None and time.time() >= deadline
+                ):
+                    raise LockTimeoutError(
+                        f'queue of {name} was not served in {timeout} seconds'
+                    )
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, self._max_poll_interval)
+            started = time.monotonic()
+            yield QueueSlot(arrival, slot.server)
+        finally:
+            held = None if started is None else time.monotonic() - started
+            await self._dequeue(name, ticket, held)
+
+    async def mark_down(self, name: str, server: int, seconds: float):
+        """Stops assigning the server to requests for the given time."""
+
+        def mark(state: dict):
+            state['down'][str(server)] = time.time() + seconds
+
+        await self._update(name, mark)
+
+    async def depth(self, name: str) -> int:
+        """Returns number of requests in the queue including the served one."""
+
+        def count(state: dict) -> int:
+            self._prune(state, time.time())
+            return len(state['entries'])
+
+        return await self._update(name, count)
@@ -0,0 +1,291 @@
+"""
+Results of idempotent requests shared by worker processes.
+"""
+
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Optional, TypeVar
+
+from sign.errors import IdempotencyConflictError, IdempotencyMismatchError
+from sign.utils.fifo_queue import pid_alive
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# seconds between scans of the store for expired requests
+SWEEP_INTERVAL = 60
+
+
+def request_fingerprint(*parts: Any) -> str:
+    """Returns SHA-256 of the request parameters and content hashes."""
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+class IdempotentRequest:
+    """
+    Request claimed in the store.
+
+    A request is either executed (``replayed`` is False) and its result
+    is stored with ``complete``, or it is a retry of a completed request
+    and the stored result is returned by ``replay``.
+    """
+
+    def __init__(
+        self,
+        store: 'IdempotencyStore',
+        name: Optional[str],
+        ticket: Optional[str],
+        entry: Optional[dict] = None,
+    ):
+        self._store = store
+        self._name = name
+        self._ticket = ticket
+        self._entry = entry
+        self.completed = False
+
+    @property
+    def replayed(self) -> bool:
+        return self._entry is not None
+
+    def replay(self, fingerprint: str) -> Any:
+        """
+        Returns the stored result of the original request.
+
+        Raises
+        ------
+        IdempotencyMismatchError
+            If the original request had other parameters or content.
+        """
+        if self._entry['fingerprint'] != fingerprint:
+            raise IdempotencyMismatchError(
+                'Idempotency-Key was used for another request'
+            )
+        return self._entry['result']
+
+    async def complete(self, fingerprint: str, result: Any):
+        """Stores the result for retries of the request."""
+        if self._name is None or self.replayed:
+            return
+        await self._store._complete(
+            self._name, self._ticket, fingerprint, result
+        )
+        self.completed = True
+
+
+class IdempotencyStore:
+    """
+    Short-lived store of completed requests keyed by Idempotency-Key.
+
+    Every key is a small JSON file in the store directory, flocked only
+    while it is rewritten, so all worker processes of the host share the
+    results. The first request with a key claims it, retries arriving
+    while it runs poll until it completes and then get its result. A key
+    is released if its request fails, so the next retry runs again.
+    Claims of dead processes and results older than the TTL are ignored.
+
+    Usage:
+        store = IdempotencyStore('/tmp/sign-file-idempotency', ttl=600)
+        async with store.claim(key, timeout=60) as request:
+            if request.replayed:
+                return request.replay(fingerprint)
+            result = sign()
+            await request.complete(fingerprint, result)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float,
+        poll_interval: float = 0.05,
+        max_poll_interval: float = 0.5,
+    ):
+        self._path = Path(path)
+        self._ttl = ttl
+        self._poll_interval = poll_interval
+        self._max_poll_interval = max_poll_interval
+        self._last_sweep = 0.0
+        self._sweep: Optional[asyncio.Future] = None
+
+    def _entry_path(self, name: str) -> Path:
+        return Path(self._path, f'{name}.json')
+
+    def _open_locked(self, path: Path) -> int:
+        """Opens and flocks the file which is currently at the path."""
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            # removed by the sweep while waiting for the lock
+            os.close(fd)
+
+    def _update(self, name: str, update: Callable[[dict], T]) -> T:
+        self._path.mkdir(exist_ok=True, parents=True)
+        fd = self._open_locked(self._entry_path(name))
+        try:
+            size = os.fstat(fd).st_size
+            data = os.pread(fd, size, 0) if size else b''
+            try:
+                entry = json.loads(data) if data else {}
+            except ValueError:
+                logger.warning('Discarding corrupted idempotency entry')
+                entry = {}
+            before = dict(entry)
+            result = update(entry)
+            if entry != before:
+                data = json.dumps(entry).encode()
+                os.pwrite(fd, data, 0)
+                os.ftruncate(fd, len(data))
+            return result
+        finally:
+            os.close(fd)
+
+    async def _update_async(
+        self, name: str, update: Callable[[dict], T]
+    ) -> T:
+        # waiting for the flock and the file IO block, so they run in a
+        # worker thread like the IO of SignatureCache
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._update, name, update)
+
+    def _expired(self, entry: dict, now: float) -> bool:
+        if not entry:
+            return True
+        if entry['result'] is None:
+            # a running request may outlast the TTL, e.g. gpg waiting
+            # for a card
+            return not pid_alive(entry['pid'])
+        return entry['created'] + self._ttl < now
+
+    async def _try_claim(self, name: str, ticket: str) -> Optional[dict]:
+        """
+        Claims the key unless another request holds it.
+
+        Returns None if the key is claimed by this request, the entry
+        of the other request otherwise.
+        """
+
+        def claim(entry: dict) -> Optional[dict]:
+            now = time.time()
+            if not self._expired(entry, now):
+                return dict(entry)
+            entry.clear()
+            entry.update({
+                'ticket': ticket,
+                'pid': os.getpid(),
+                'created': now,
+                'fingerprint': None,
+                'result': None,
+            })
+            return None
+
+        return await self._update_async(name, claim)
+
+    async def _complete(
+        self, name: str, ticket: str, fingerprint: str, result
+    ):
+        def complete(entry: dict):
+            if entry.get('ticket') == ticket:
+                entry['fingerprint'] = fingerprint
+                entry['result'] = result
+                # retries get the result for the whole TTL
+                entry['created'] = time.time()
+
+        await self._update_async(name, complete)
+        self._schedule_sweep()
+
+    async def _release(self, name: str, ticket: str):
+        def release(entry: dict):
+            if entry.get('ticket') == ticket:
+                entry.clear()
+
+        await self._update_async(name, release)
+
+    def _sweep_expired(self):
+        now = time.time()
+        for path in self._path.glob('*.json'):
+            try:
+                fd = self._open_locked(path)
+            except FileNotFoundError:
+                continue
+            try:
+                size = os.fstat(fd).st_size
+                data = os.pread(fd, size, 0) if size else b''
+                try:
+                    entry = json.loads(data) if data else {}
+                except ValueError:
+                    entry = {}
+                if self._expired(entry, now):
+                    os.unlink(path)
+            finally:
+                os.close(fd)
+
+    async def _sweep_later(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._sweep_expired)
+        except OSError:
+            logger.exception('Failed to remove expired idempotency entries')
+
+    def _schedule_sweep(self):
+        if self._sweep is not None and not self._sweep.done():
+            return
+        if time.monotonic() - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = time.monotonic()
+        self._sweep = asyncio.ensure_future(self._sweep_later())
+
+    @contextlib.asynccontextmanager
+    async def claim(
+        self,
+        key: Optional[str],
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[IdempotentRequest]:
+        """
+        Claims the key or waits for the request holding it.
+
+        Without a key the request is simply executed.
+
+        Raises
+        ------
+        IdempotencyConflictError
+            If the request holding the key hasn't completed in time.
+        """
+        if key is None:
+            yield IdempotentRequest(self, None, None)
+            return
+        name = hashlib.sha256(key.encode()).hexdigest()
+        ticket = uuid.uuid4().hex
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = self._poll_interval
+        while True:
+            entry = await self._try_claim(name, ticket)
+            if entry is None or entry['result'] is not None:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                raise IdempotencyConflictError(
+                    'request with the same Idempotency-Key is in progress'
+                )
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self._max_poll_interval)
+        if entry is not None:
+            yield IdempotentRequest(self, name, ticket, entry)
+            return
+        request = IdempotentRequest(self, name, ticket)
+        try:
+            yield request
+        finally:
+            if not request.completed:
+                await self._release(name, ticket)
@@ -2,32 +2,203 @@
 Build System functions to work with locked files.
 """
 
+import asyncio
+import collections
 import contextlib
 import fcntl
+import logging
+import os
+import time
 from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+
+from sign.errors import LockTimeoutError
+
+logger = logging.getLogger(__name__)
 
 GPG_AGENT_LOCK_FILENAME = '.gpg-agent'
+SLOW_LOCK_SECONDS = 1
+
+
+class _FileLock:
+    """In-process state of one cached lock file."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.fd = None
+        self.pid = None
+        self.holders = 0
+        self.exclusive = False
+        self.flocked = False
+        self.waiters = collections.deque()
+        self.flock_guard = asyncio.Lock()
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def fileno(self) -> int:
+        # descriptors inherited through fork share the lock with the
+        # parent, so every process opens its own
+        if self.fd is None or self.pid != os.getpid():
+            self.path.parent.mkdir(exist_ok=True, parents=True)
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self.pid = os.getpid()
+        return self.fd
+
+    def grant(self):
+        """Wakes up waiters at the head of the queue compatible with holders."""
+        while self.waiters and not self.exclusive:
+            future, exclusive = self.waiters[0]
+            if future.done():
+                self.waiters.popleft()
+                continue
+            if exclusive and self.holders:
+                return
+            self.waiters.popleft()
+            self.holders += 1
+            self.exclusive = exclusive
+            future.set_result(None)
+            if exclusive:
+                return
+
+
+class AsyncLockManager:
+    """
+    Shared/exclusive file locks for coroutines.
+
+    Lock files are opened once per process and cached. Coroutines of one
+    process are queued in FIFO order, so exclusive waiters are not starved
+    by a stream of shared ones, and only then the cross-process flock is
+    taken with non-blocking attempts, so waiting never blocks the event
+    loop. Time spent waiting is accounted per lock file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        poll_interval: float = 0.01,
+        max_poll_interval: float = 0.2,
+    ):
+        self._path = Path(path)
+        self._poll_interval = poll_interval
+        self._max_poll_interval = max_poll_interval
+        self._locks: Dict[str, _FileLock] = {}
 
+    def _get(self, filename: str) -> _FileLock:
+        if filename not in self._locks:
+            self._locks[filename] = _FileLock(Path(self._path, filename))
+        return self._locks[filename]
 
-@contextlib.contextmanager
-def exclusive_lock(path: str, filename: str):
-    locks_dir = Path(path)
-    locks_dir.mkdir(exist_ok=True, parents=True)
-    with Path(locks_dir, filename).open('w+') as file:
-        fcntl.flock(file, fcntl.LOCK_EX)
+    async def _enqueue(
+        self,
+        lock: _FileLock,
+        exclusive: bool,
+        timeout: Optional[float],
+    ):
+        future = asyncio.get_running_loop().create_future()
+        lock.waiters.append((future, exclusive))
+        lock.grant()
         try:
-            yield
-        finally:
-            fcntl.flock(file, fcntl.LOCK_UN)
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # granted at the same moment the wait was interrupted
+                self._release(lock)
+            else:
+                future.cancel()
+                lock.grant()
+            raise
+
+    async def _flock(self, lock: _FileLock, operation: int, deadline):
+        interval = self._poll_interval
+        while True:
+            try:
+                fcntl.flock(lock.fileno(), operation | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                pass
+            if deadline is not None and time.monotonic() >= deadline:
+                raise asyncio.TimeoutError
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self._max_poll_interval)
 
+    def _release(self, lock: _FileLock):
+        lock.holders -= 1
+        if not lock.holders:
+            if lock.flocked:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+                lock.flocked = False
+            lock.exclusive = False
+        lock.grant()
 
-@contextlib.contextmanager
-def shared_lock(path: str, filename: str):
-    locks_dir = Path(path)
-    locks_dir.mkdir(exist_ok=True, parents=True)
-    with Path(locks_dir, filename).open('w+') as file:
-        fcntl.flock(file, fcntl.LOCK_SH)
+    @contextlib.asynccontextmanager
+    async def _acquire(
+        self,
+        filename: str,
+        exclusive: bool,
+        timeout: Optional[float],
+    ) -> AsyncIterator[None]:
+        lock = self._get(filename)
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        try:
+            await self._enqueue(lock, exclusive, timeout)
+            try:
+                async with lock.flock_guard:
+                    if not lock.flocked:
+                        operation = (
+                            fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+                        )
+                        await self._flock(lock, operation, deadline)
+                        lock.flocked = True
+            except BaseException:
+                self._release(lock)
+                raise
+        except asyncio.TimeoutError:
+            lock.timeouts += 1
+            raise LockTimeoutError(
+                f'lock {filename} was not acquired in {timeout} seconds'
+            )
+        waited = time.monotonic() - started
+        lock.acquired += 1
+        lock.wait_total += waited
+        lock.wait_max = max(lock.wait_max, waited)
+        if waited > SLOW_LOCK_SECONDS:
+            logger.info('Waited %.2f seconds for lock %s', waited, filename)
         try:
             yield
         finally:
-            fcntl.flock(file, fcntl.LOCK_UN)
+            self._release(lock)
+
+    def shared(self, filename: str, timeout: Optional[float] = None):
+        """Async context manager holding a shared lock on the file."""
+        return self._acquire(filename, False, timeout)
+
+    def exclusive(self, filename: str, timeout: Optional[float] = None):
+        """Async context manager holding an exclusive lock on the file."""
+        return self._acquire(filename, True, timeout)
+
+    def stats(self) -> Dict[str, dict]:
+        """Returns wait-time accounting for every lock file."""
+        return {
+            filename: {
+                'acquired': lock.acquired,
+                'timeouts': lock.timeouts,
+                'wait_total': lock.wait_total,
+                'wait_max': lock.wait_max,
+                'holders': lock.holders,
+                'waiting': len(lock.waiters),
+            }
+            for filename, lock in self._locks.items()
+        }
+
+
+_lock_managers: Dict[str, AsyncLockManager] = {}
+
+
+def get_lock_manager(path: str) -> AsyncLockManager:
+    """Returns process-wide lock manager for the locks directory."""
+    if path not in _lock_managers:
+        _lock_managers[path] = AsyncLockManager(path)
+    return _lock_managers[path]
@@ -0,0 +1,170 @@
+"""
+SHA-2 hashes resumable from an exported intermediate state.
+
+hashlib can't export or import the internal state of a hash, so a hash
+started by a client is finished here in pure Python. Only the last few
+blocks are processed this way, the bulk of the data is hashed by the
+client.
+"""
+
+import math
+import struct
+from dataclasses import dataclass
+from typing import List
+
+SHA2_ALGORITHMS = ('SHA256', 'SHA384', 'SHA512')
+
+
+def _primes(count: int) -> List[int]:
+    primes = []
+    candidate = 2
+    while len(primes) < count:
+        if all(candidate % prime for prime in primes):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+def _icbrt(value: int) -> int:
+    root = 1 << (value.bit_length() // 3 + 1)
+    while True:
+        better = (2 * root + value // (root * root)) // 3
+        if better >= root:
+            return root
+        root = better
+
+
+def _fraction_bits(values: List[int], bits: int, root: int) -> List[int]:
+    """First bits of fractional parts of square or cube roots (FIPS 180-4)."""
+    mask = (1 << bits) - 1
+    if root == 2:
+        return [math.isqrt(value << (2 * bits)) & mask for value in values]
+    return [_icbrt(value << (3 * bits)) & mask for value in values]
+
+
+_PRIMES = _primes(80)
+_K32 = _fraction_bits(_PRIMES[:64], 32, 3)
+_K64 = _fraction_bits(_PRIMES, 64, 3)
+_IV = {
+    'SHA256': _fraction_bits(_PRIMES[:8], 32, 2),
+    'SHA384': _fraction_bits(_PRIMES[8:16], 64, 2),
+    'SHA512': _fraction_bits(_PRIMES[:8], 64, 2),
+}
+
+
+@dataclass
+class HashState:
+    algorithm: str
+    # chaining value, the eight state words in big-endian order
+    state: bytes
+    # number of bytes processed into the state, a multiple of block size
+    length: int
+    # bytes after the last processed block
+    tail: bytes = b''
+
+
+class Sha2:
+    """
+    SHA-256, SHA-384 and SHA-512 with exportable state.
+
+    Usage:
+        hasher = Sha2('SHA256', state)
+        hasher.update(trailer)
+        digest = hasher.digest()
+    """
+
+    def __init__(self, algorithm: str = 'SHA256', state: HashState = None):
+        algorithm = algorithm.upper()
+        if algorithm not in SHA2_ALGORITHMS:
+            raise ValueError(f'unsupported hash algorithm: {algorithm}')
+        wide = algorithm != 'SHA256'
+        self.algorithm = algorithm
+        self._word_size = 8 if wide else 4
+        self._block_size = 128 if wide else 64
+        self._word_format = '>8Q' if wide else '>8L'
+        self._rounds = _K64 if wide else _K32
+        self._mask = (1 << 64) - 1 if wide else (1 << 32) - 1
+        self._sigmas = (
+            ((28, 34, 39), (14, 18, 41), (1, 8, 7), (19, 61, 6))
+            if wide
+            else ((2, 13, 22), (6, 11, 25), (7, 18, 3), (17, 19, 10))
+        )
+        if state is None:
+            self._words = list(_IV[algorithm])
+            self._length = 0
+            self._tail = b''
+            return
+        if state.algorithm.upper() != algorithm:
+            raise ValueError('hash state of another algorithm')
+        if (
+            len(state.state) != 8 * self._word_size
+            or state.length % self._block_size
+            or len(state.tail) >= self._block_size
+        ):
+            raise ValueError(f'malformed {algorithm} state')
+        self._words = list(struct.unpack(self._word_format, state.state))
+        self._length = state.length
+        self._tail = bytes(state.tail)
+
+    def _rotr(self, value: int, shift: int) -> int:
+        bits = self._word_size * 8
+        return ((value >> shift) | (value << (bits - shift))) & self._mask
+
+    def _compress(self, block: bytes):
+        mask = self._mask
+        rotr = self._rotr
+        (s0a, s0b, s0c), (s1a, s1b, s1c), (g0a, g0b, g0c), (g1a, g1b, g1c) = (
+            self._sigmas
+        )
+        count = len(self._rounds)
+        w = list(struct.unpack(f'>16{self._word_format[-1]}', block))
+        for i in range(16, count):
+            x, y = w[i - 15], w[i - 2]
+            small0 = rotr(x, g0a) ^ rotr(x, g0b) ^ (x >> g0c)
+            small1 = rotr(y, g1a) ^ rotr(y, g1b) ^ (y >> g1c)
+            w.append((w[i - 16] + small0 + w[i - 7] + small1) & mask)
+        a, b, c, d, e, f, g, h = self._words
+        for i in range(count):
+            big1 = rotr(e, s1a) ^ rotr(e, s1b) ^ rotr(e, s1c)
+            choice = (e & f) ^ (~e & g)
+            t1 = (h + big1 + choice + self._rounds[i] + w[i]) & mask
+            big0 = rotr(a, s0a) ^ rotr(a, s0b) ^ rotr(a, s0c)
+            majority = (a & b) ^ (a & c) ^ (b & c)
+            t2 = (big0 + majority) & mask
+            h, g, f = g, f, e
+            e = (d + t1) & mask
+            d, c, b = c, b, a
+            a = (t1 + t2) & mask
+        self._words = [
+            (word + new) & mask
+            for word, new in zip(self._words, (a, b, c, d, e, f, g, h))
+        ]
+
+    def update(self, data: bytes):
+        data = self._tail + bytes(data)
+        blocks = len(data) - len(data) % self._block_size
+        for offset in range(0, blocks, self._block_size):
+            self._compress(data[offset:offset + self._block_size])
+        self._length += blocks
+        self._tail = data[blocks:]
+
+    def export(self) -> HashState:
+        """Returns the state, which another instance can resume from."""
+        return HashState(
+            self.algorithm,
+            struct.pack(self._word_format, *self._words),
+            self._length,
+            self._tail,
+        )
+
+    def digest(self) -> bytes:
+        resumed = Sha2(self.algorithm, self.export())
+        bit_length = (self._length + len(self._tail)) * 8
+        length_size = 2 * self._word_size
+        padding = b'\x80' + b'\x00' * (
+            (self._block_size - len(self._tail) - 1 - length_size)
+            % self._block_size
+        )
+        resumed.update(padding + bit_length.to_bytes(length_size, 'big'))
+        digest = struct.pack(self._word_format, *resumed._words)
+        return digest[:48] if self.algorithm == 'SHA384' else digest
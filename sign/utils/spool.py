@@ -0,0 +1,228 @@
+"""
+Temporary copies of uploaded files.
+"""
+
+import asyncio
+import fcntl
+import os
+import stat
+import tempfile
+import uuid
+from typing import AsyncIterator, Optional, Tuple
+
+from fastapi import UploadFile
+
+from sign.errors import FileTooBigError
+from sign.utils.hashing import get_hasher, hash_file
+
+SPOOL_BUFFER_SIZE = 1024 * 1024
+SPOOL_BACKENDS = ('disk', 'memfd')
+
+
+def _readinto(source, buffer: bytearray) -> int:
+    # SpooledTemporaryFile implements readinto only since Python 3.11
+    if hasattr(source, 'readinto'):
+        return source.readinto(buffer)
+    data = source.read(len(buffer))
+    buffer[:len(data)] = data
+    return len(data)
+
+
+async def iter_upload(
+    file: UploadFile,
+    chunk_size: int = SPOOL_BUFFER_SIZE,
+) -> AsyncIterator[bytes]:
+    """Yields the upload chunk by chunk and closes it."""
+    try:
+        while chunk := await file.read(chunk_size):
+            yield chunk
+    finally:
+        file.file.close()
+
+
+async def hash_upload(file: UploadFile) -> str:
+    """Returns SHA-256 of the upload and rewinds it."""
+    loop = asyncio.get_running_loop()
+    sha256 = await loop.run_in_executor(
+        None, lambda: hash_file(file.file, hasher=get_hasher())
+    )
+    await file.seek(0)
+    return sha256
+
+
+class UploadSpool:
+    """
+    Temporary file holding a copy of an upload.
+
+    The upload is copied in a single pass in a worker thread: SHA-256 is
+    computed while writing, one preallocated buffer is reused for every
+    chunk and there is no per-chunk flush. The file is
+    then sealed (made read-only) and its metadata is recorded, so that
+    ``verify_hash`` only has to re-read the file if it was modified.
+
+    With ``memory_threshold`` set, uploads start in an anonymous memory
+    file (memfd) which other processes open as ``/proc/<pid>/fd/<fd>``,
+    so small uploads never touch the disk. The content is moved to a
+    file in ``tmp_dir`` (which may be a tmpfs) once it grows past the
+    threshold. Systems without memfd always use ``tmp_dir``.
+
+    Usage:
+        async with UploadSpool(tmp_dir, max_size) as spool:
+            await spool.write_upload(file)  # or write_stream(chunks)
+            sign(spool.name)
+            hash_after = await spool.verify_hash()
+    """
+
+    def __init__(
+        self,
+        tmp_dir: str,
+        max_size: int,
+        buffer_size: int = SPOOL_BUFFER_SIZE,
+        memory_threshold: int = 0,
+    ):
+        self._tmp_dir = tmp_dir
+        self._max_size = max_size
+        self._buffer_size = buffer_size
+        self._memory_threshold = (
+            memory_threshold if hasattr(os, 'memfd_create') else 0
+        )
+        self._fd: Optional[int] = None
+        self._in_memory = False
+        self._stat: Optional[Tuple[int, int, int, int]] = None
+        self.name: Optional[str] = None
+        # name of the spool file for audit logs
+        self.label: Optional[str] = None
+        self.size = 0
+        self.sha256: Optional[str] = None
+
+    async def __aenter__(self) -> 'UploadSpool':
+        if self._memory_threshold:
+            self.label = f'memfd-{uuid.uuid4().hex}'
+            self._fd = os.memfd_create(
+                self.label, os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING
+            )
+            self.name = f'/proc/{os.getpid()}/fd/{self._fd}'
+            self._in_memory = True
+        else:
+            self._create_file()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        os.close(self._fd)
+        if not self._in_memory:
+            os.unlink(self.name)
+
+    def _create_file(self):
+        self._fd, self.name = tempfile.mkstemp(dir=self._tmp_dir)
+        self.label = os.path.basename(self.name)
+
+    def _spill(self):
+        """Moves the content of the memory file to a file in tmp_dir."""
+        memory_fd = self._fd
+        self._create_file()
+        self._in_memory = False
+        try:
+            copied = 0
+            while copied < self.size:
+                copied += os.sendfile(
+                    self._fd, memory_fd, copied, self.size - copied
+                )
+        finally:
+            os.close(memory_fd)
+
+    def _seal(self):
+        os.fchmod(self._fd, stat.S_IRUSR)
+        if self._in_memory:
+            # the kernel rejects any further change of the memory file
+            fcntl.fcntl(
+                self._fd,
+                fcntl.F_ADD_SEALS,
+                fcntl.F_SEAL_SEAL
+                | fcntl.F_SEAL_SHRINK
+                | fcntl.F_SEAL_GROW
+                | fcntl.F_SEAL_WRITE,
+            )
+
+    @staticmethod
+    def _fingerprint(st: os.stat_result) -> Tuple[int, int, int, int]:
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _append(self, hasher, data):
+        view = memoryview(data)
+        if self._in_memory and self.size + len(view) > self._memory_threshold:
+            self._spill()
+        hasher.update(view)
+        written = 0
+        while written < len(view):
+            written += os.write(self._fd, view[written:])
+        self.size += len(view)
+
+    def _finish(self, hasher):
+        self._seal()
+        self._stat = self._fingerprint(os.fstat(self._fd))
+        self.sha256 = hasher.hexdigest()
+
+    def _copy(self, source):
+        hasher = get_hasher()
+        buffer = bytearray(self._buffer_size)
+        view = memoryview(buffer)
+        while read := _readinto(source, buffer):
+            if self.size + read > self._max_size:
+                raise FileTooBigError
+            self._append(hasher, view[:read])
+        self._finish(hasher)
+
+    async def write_upload(self, file: UploadFile):
+        """
+        Copies the upload into the spool file and closes the upload.
+
+        Raises
+        ------
+        FileTooBigError
+            If the upload is bigger than the allowed size.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._copy, file.file)
+        finally:
+            file.file.close()
+
+    async def write_stream(self, chunks: AsyncIterator[bytes]):
+        """
+        Copies the streamed upload into the spool file.
+
+        Chunks are gathered up to the buffer size and written by a
+        worker thread, the size limit is checked as they arrive.
+
+        Raises
+        ------
+        FileTooBigError
+            If the upload is bigger than the allowed size.
+        """
+        loop = asyncio.get_running_loop()
+        hasher = get_hasher()
+        pending = bytearray()
+        async for chunk in chunks:
+            if self.size + len(pending) + len(chunk) > self._max_size:
+                raise FileTooBigError
+            pending += chunk
+            if len(pending) >= self._buffer_size:
+                await loop.run_in_executor(None, self._append, hasher, pending)
+                pending = bytearray()
+        if pending:
+            await loop.run_in_executor(None, self._append, hasher, pending)
+        await loop.run_in_executor(None, self._finish, hasher)
+
+    async def verify_hash(self) -> str:
+        """
+        Returns SHA-256 of the spool file content.
+
+        The file is re-hashed only if its inode, size or modification
+        time differ from the ones recorded after the copy.
+        """
+        if self._fingerprint(os.stat(self.name)) == self._stat:
+            return self.sha256
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, lambda: hash_file(self.name, hasher=get_hasher())
+        )
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from sign.api.multipart import iter_uploads
+from sign.errors import FileTooBigError
+
+BOUNDARY = 'boundary'
+
+
+def make_body(files):
+    body = b''
+    for name, filename, content in files:
+        body += (
+            f'--{BOUNDARY}\r\n'
+            f'Content-Disposition: form-data; name="{name}"; '
+            f'filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode() + content + b'\r\n'
+    return body + f'--{BOUNDARY}--\r\n'.encode()
+
+
+def make_request(body, chunk_size, received):
+    chunks = [
+        body[pos:pos + chunk_size] for pos in range(0, len(body), chunk_size)
+    ]
+
+    async def receive():
+        chunk = chunks.pop(0)
+        received.append(chunk)
+        return {
+            'type': 'http.request',
+            'body': chunk,
+            'more_body': bool(chunks),
+        }
+
+    scope = {
+        'type': 'http',
+        'method': 'POST',
+        'headers': [(
+            b'content-type',
+            f'multipart/form-data; boundary={BOUNDARY}'.encode(),
+        )],
+    }
+    return Request(scope, receive)
+
+
+def test_files_are_yielded_as_they_arrive():
+    """
+    Testing body with two files and a skipped field sent in small chunks
+    Expect that the first file is yielded before the second one is read
+    """
+    first = b'a' * 1000
+    second = b'b' * 1000
+    body = make_body([
+        ('files', 'first', first),
+        ('other', 'skipped', b'c' * 10),
+        ('files', 'second', second),
+    ])
+    received = []
+
+    async def main():
+        uploads = iter_uploads(make_request(body, 100, received), 'files', 2000)
+        upload = await uploads.__anext__()
+        assert upload.filename == 'first'
+        assert await upload.read() == first
+        assert sum(map(len, received)) < len(body) - len(second)
+        upload = await uploads.__anext__()
+        assert upload.filename == 'second'
+        assert await upload.read() == second
+        with pytest.raises(StopAsyncIteration):
+            await uploads.__anext__()
+
+    asyncio.run(main())
+
+
+def test_file_size_is_limited():
+    """
+    Testing file bigger than allowed
+    Expect that parsing stops with FileTooBigError
+    """
+    body = make_body([('files', 'big', b'a' * 1000)])
+
+    async def main():
+        uploads = iter_uploads(make_request(body, 100, []), 'files', 500)
+        with pytest.raises(FileTooBigError):
+            await uploads.__anext__()
+
+    asyncio.run(main())
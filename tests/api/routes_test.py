@@ -0,0 +1,169 @@
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from sign.api.dependencies import get_backend, get_current_user
+from sign.api.routes import router
+from sign.config import settings
+from sign.db.models import User
+from sign.errors import FileTooBigError
+
+KEYID = 'AB' * 8
+
+
+class FakeBackend:
+    def __init__(self, max_upload_bytes):
+        self.max_upload_bytes = max_upload_bytes
+        self.streamed = []
+        self.hashed = []
+
+    def key_exists(self, keyid):
+        return keyid == KEYID
+
+    async def sign_stream(
+        self, keyid, chunks, filename, detach_sign, digest_algo, timeout
+    ):
+        content = b''
+        async for chunk in chunks:
+            content += chunk
+            if len(content) > self.max_upload_bytes:
+                raise FileTooBigError
+        self.streamed.append((filename, content))
+        return f'signature of {content.decode()}'
+
+    async def sign_hash(
+        self, keyid, digest_algo, hash_state, digest, creation_time, filename
+    ):
+        self.hashed.append((hash_state, digest, creation_time))
+        return 'signature'
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    monkeypatch.setattr(settings, 'max_upload_bytes', 10)
+    return FakeBackend(max_upload_bytes=10)
+
+
+@pytest.fixture
+def client(backend):
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_current_user] = lambda: User(
+        id=1, email='user@example.com'
+    )
+    app.dependency_overrides[get_backend] = lambda: backend
+    return TestClient(app)
+
+
+def chunked(*chunks):
+    # a generator body is sent without Content-Length
+    yield from chunks
+
+
+def test_stream_is_signed(client, backend):
+    """
+    Testing /sign-stream with a body sent in chunks
+    Expect the signature of the whole body
+    """
+    response = client.post(
+        '/sign-stream',
+        params={'keyid': KEYID, 'filename': 'file'},
+        content=chunked(b'da', b'ta'),
+        headers={'Content-Type': 'application/octet-stream'},
+    )
+    assert response.status_code == 200
+    assert response.text == 'signature of data'
+    assert backend.streamed == [('file', b'data')]
+
+
+@pytest.mark.parametrize('body', [b'x' * 11, chunked(b'x' * 6, b'x' * 6)])
+def test_too_big_stream_is_rejected(client, backend, body):
+    """
+    Testing /sign-stream with a body over max_upload_bytes, announced by
+    Content-Length or found while it is streamed
+    Expect 413
+    """
+    response = client.post(
+        '/sign-stream',
+        params={'keyid': KEYID},
+        content=body,
+        headers={'Content-Type': 'application/octet-stream'},
+    )
+    assert response.status_code == 413
+    assert not backend.streamed
+
+
+def test_stream_with_missing_key_is_rejected(client, backend):
+    """
+    Testing /sign-stream with a key which does not exist
+    Expect 400
+    """
+    response = client.post(
+        '/sign-stream',
+        params={'keyid': 'CD' * 8},
+        content=b'data',
+        headers={'Content-Type': 'application/octet-stream'},
+    )
+    assert response.status_code == 400
+    assert not backend.streamed
+
+
+def test_digest_is_signed(client, backend, monkeypatch):
+    """
+    Testing /sign-digest with a final digest made for the current time
+    Expect that the digest is signed
+    """
+    monkeypatch.setattr(settings, 'sign_digest_allow_raw', True)
+    response = client.post('/sign-digest', json={
+        'keyid': KEYID,
+        'digest': 'ab' * 32,
+        'creation_time': int(time.time()),
+    })
+    assert response.status_code == 200
+    assert backend.hashed[0][1] == bytes.fromhex('ab' * 32)
+
+
+def test_digest_is_forbidden(client, backend, monkeypatch):
+    """
+    Testing /sign-digest with a final digest while they are disabled
+    Expect 403
+    """
+    monkeypatch.setattr(settings, 'sign_digest_allow_raw', False)
+    response = client.post('/sign-digest', json={
+        'keyid': KEYID,
+        'digest': 'ab' * 32,
+        'creation_time': int(time.time()),
+    })
+    assert response.status_code == 403
+    assert not backend.hashed
+
+
+@pytest.mark.parametrize('skew', [None, 3601, -3601])
+def test_digest_creation_time_is_checked(client, backend, monkeypatch, skew):
+    """
+    Testing /sign-digest with a final digest without creation_time or
+    made for a time too far from now
+    Expect 400
+    """
+    monkeypatch.setattr(settings, 'sign_digest_allow_raw', True)
+    sign_request = {'keyid': KEYID, 'digest': 'ab' * 32}
+    if skew is not None:
+        sign_request['creation_time'] = int(time.time()) + skew
+    response = client.post('/sign-digest', json=sign_request)
+    assert response.status_code == 400
+    assert not backend.hashed
+
+
+def test_malformed_hash_state_is_rejected(client, backend):
+    """
+    Testing /sign-digest with a hash state which is not hex encoded
+    Expect 400
+    """
+    response = client.post('/sign-digest', json={
+        'keyid': KEYID,
+        'hash_state': {'state': 'not hex', 'length': 64},
+    })
+    assert response.status_code == 400
+    assert not backend.hashed
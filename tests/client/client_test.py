@@ -0,0 +1,65 @@
+import asyncio
+import hashlib
+
+from starlette.requests import Request
+
+from sign.api.multipart import iter_uploads
+from sign.client.base import MultipartBody, file_hash_state
+from sign.utils.sha2 import Sha2
+
+
+def test_multipart_body_is_parsed_by_service(tmp_path):
+    """
+    Testing multipart body of two files streamed by the client
+    Expect that the service parses the same files back
+    """
+    files = {'first.rpm': b'a' * 5000, 'second "x".rpm': b'b\r\n--' * 100}
+    paths = []
+    for name, content in files.items():
+        path = tmp_path / name
+        path.write_bytes(content)
+        paths.append(str(path))
+    multipart = MultipartBody('files', paths)
+    body = b''.join(multipart)
+    assert len(body) == len(multipart)
+    chunks = [body[pos:pos + 1000] for pos in range(0, len(body), 1000)]
+
+    async def receive():
+        chunk = chunks.pop(0)
+        return {
+            'type': 'http.request',
+            'body': chunk,
+            'more_body': bool(chunks),
+        }
+
+    request = Request(
+        {
+            'type': 'http',
+            'method': 'POST',
+            'headers': [(b'content-type', multipart.content_type.encode())],
+        },
+        receive,
+    )
+
+    async def main():
+        return [
+            await upload.read()
+            async for upload in iter_uploads(request, 'files', 10000)
+        ]
+
+    assert asyncio.run(main()) == list(files.values())
+
+
+def test_file_hash_state_is_resumed_to_file_digest(tmp_path):
+    """
+    Testing hash state of a file whose size isn't a multiple of the block
+    Expect that the state resumed on the service gives the file's digest
+    """
+    content = bytes(range(256)) * 1001
+    path = tmp_path / 'file'
+    path.write_bytes(content)
+    for algorithm in ('SHA256', 'SHA512'):
+        state = file_hash_state(str(path), algorithm, chunk_size=1000)
+        assert state.length + len(state.tail) == len(content)
+        expected = hashlib.new(algorithm, content).digest()
+        assert Sha2(algorithm, state).digest() == expected
@@ -0,0 +1,155 @@
+import asyncio
+import io
+from datetime import datetime, timezone
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa, utils
+from fastapi import UploadFile
+
+from sign.kms import digest_signer, kms
+from sign.kms.pgp_wrapper import compute_pgp_hash
+
+FINGERPRINT = 'AB' * 20
+CREATED = datetime(2024, 1, 1, tzinfo=timezone.utc)
+PRIVATE_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+HASHES = {32: hashes.SHA256(), 48: hashes.SHA384(), 64: hashes.SHA512()}
+
+
+class FakeKMSClient:
+    def __init__(self):
+        self.digests = []
+
+    def describe_key(self, KeyId):
+        return {'KeyMetadata': {'KeyState': 'Enabled'}}
+
+    def get_public_key(self, KeyId):
+        return {'PublicKey': PRIVATE_KEY.public_key().public_bytes(
+            serialization.Encoding.DER,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )}
+
+    def sign(self, KeyId, Message, MessageType, SigningAlgorithm):
+        self.digests.append(Message)
+        return {'Signature': PRIVATE_KEY.sign(
+            Message,
+            padding.PKCS1v15(),
+            utils.Prehashed(HASHES[len(Message)]),
+        )}
+
+
+def test_streamed_document_digest(monkeypatch):
+    """
+    Testing detached signing of an upload and of a stream in small chunks
+    Expect that both sign the digest of the whole content
+    """
+    client = FakeKMSClient()
+    monkeypatch.setattr(kms.boto3, 'client', lambda *args, **kwargs: client)
+    monkeypatch.setattr(
+        digest_signer, 'signature_time', lambda window: CREATED
+    )
+    backend = kms.KMS(['key'], {'key': FINGERPRINT}, region='us-east-1')
+    content = bytes(range(256)) * 1000
+
+    async def chunks():
+        for pos in range(0, len(content), 1000):
+            yield content[pos:pos + 1000]
+
+    async def main():
+        upload = UploadFile(file=io.BytesIO(content), filename='file')
+        await backend.sign('key', upload, digest_algo='SHA512')
+        await backend.sign_stream('key', chunks(), digest_algo='SHA512')
+
+    asyncio.run(main())
+    expected = compute_pgp_hash(
+        content, 'SHA512', True, FINGERPRINT, CREATED
+    )[0]
+    assert client.digests == [expected, expected]
+
+
+def test_throttled_signing_is_retried(monkeypatch):
+    """
+    Testing KMS throttling the first signing requests
+    Expect that they are retried and the key's limit is lowered
+    """
+    client = FakeKMSClient()
+    sign = client.sign
+    throttled = []
+
+    def throttling_sign(**kwargs):
+        if len(throttled) < 2:
+            throttled.append(kwargs['KeyId'])
+            raise ClientError(
+                {'Error': {'Code': 'ThrottlingException'}}, 'Sign'
+            )
+        return sign(**kwargs)
+
+    client.sign = throttling_sign
+    monkeypatch.setattr(kms.boto3, 'client', lambda *args, **kwargs: client)
+    monkeypatch.setattr(kms, 'RETRY_BASE_DELAY', 0.001)
+    backend = kms.KMS(['key'], {'key': FINGERPRINT}, max_workers=4)
+
+    async def main():
+        upload = UploadFile(file=io.BytesIO(b'data'), filename='file')
+        return await backend.sign('key', upload)
+
+    assert asyncio.run(main()).startswith('-----BEGIN PGP SIGNATURE-----')
+    assert len(client.digests) == 1
+    assert backend.concurrency_limit('key') == 2
+
+
+def test_invalid_signature_is_rejected(monkeypatch):
+    """
+    Testing KMS returning a corrupted signature
+    Expect that it is not wrapped and signing fails
+    """
+    client = FakeKMSClient()
+    sign = client.sign
+
+    def corrupted_sign(**kwargs):
+        signature = sign(**kwargs)['Signature']
+        return {'Signature': bytes([signature[0] ^ 1]) + signature[1:]}
+
+    client.sign = corrupted_sign
+    monkeypatch.setattr(kms.boto3, 'client', lambda *args, **kwargs: client)
+    backend = kms.KMS(['key'], {'key': FINGERPRINT})
+
+    async def main():
+        upload = UploadFile(file=io.BytesIO(b'data'), filename='file')
+        with pytest.raises(RuntimeError, match='invalid signature'):
+            await backend.sign('key', upload)
+        await backend.close()
+
+    asyncio.run(main())
+
+
+def test_unreachable_kms_is_audited(monkeypatch):
+    """
+    Testing KMS which can't be connected to
+    Expect that signing fails with RuntimeError and the failure is audited
+    """
+    client = FakeKMSClient()
+
+    def unreachable_sign(**kwargs):
+        raise EndpointConnectionError(endpoint_url='https://kms')
+
+    client.sign = unreachable_sign
+    monkeypatch.setattr(kms.boto3, 'client', lambda *args, **kwargs: client)
+    monkeypatch.setattr(kms, 'RETRY_BASE_DELAY', 0.001)
+    backend = kms.KMS(['key'], {'key': FINGERPRINT})
+    events = []
+    monkeypatch.setattr(
+        backend, '_log_signing_event', lambda *args: events.append(args)
+    )
+
+    async def main():
+        upload = UploadFile(file=io.BytesIO(b'data'), filename='file')
+        with pytest.raises(RuntimeError, match='KMS signing failed'):
+            await backend.sign('key', upload)
+        await backend.close()
+
+    asyncio.run(main())
+    assert [(filename, success) for filename, _, _, success in events] == [
+        ('file', False)
+    ]
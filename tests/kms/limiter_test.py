@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from sign.errors import LockTimeoutError
+from sign.kms.limiter import AIMDLimiter, ConcurrencyController
+
+
+def test_throttling_decreases_limit_once_per_round_trip():
+    """
+    Testing a round of concurrent requests all throttled by KMS
+    Expect that the limit is lowered once, not once per response
+    """
+    limiter = AIMDLimiter(max_limit=8)
+
+    async def main():
+        started = [await limiter.acquire() for _ in range(8)]
+        for time in started:
+            limiter.release(time, throttled=True)
+        assert limiter.limit == 6
+        # requests sent under the lowered limit lower it again
+        limiter.release(await limiter.acquire(), throttled=True)
+        assert limiter.limit == 4
+
+    asyncio.run(main())
+    assert limiter.throttled == 9
+
+
+def test_excess_requests_wait_in_order():
+    """
+    Testing more requests of a key than its limit
+    Expect that they wait in FIFO order and time out without a slot
+    """
+    controller = ConcurrencyController(max_concurrency=2)
+    order = []
+
+    async def request(name, timeout=None):
+        async with controller.slot('key', timeout) as slot:
+            order.append(name)
+            await asyncio.sleep(0.05)
+            slot.latency = 0.05
+
+    async def main():
+        tasks = [
+            asyncio.ensure_future(request(name)) for name in range(5)
+        ]
+        await asyncio.sleep(0)
+        assert controller.depth('key') == 5
+        with pytest.raises(LockTimeoutError):
+            await request('late', timeout=0.01)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == [0, 1, 2, 3, 4]
+    assert controller.depth('key') == 0
+    assert controller.limit('key') == 2
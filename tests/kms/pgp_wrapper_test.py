@@ -0,0 +1,68 @@
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+from sign.kms.pgp_wrapper import wrap_signature_as_pgp
+from sign.utils.armor import crc24
+
+pgpy = pytest.importorskip('pgpy')
+
+FINGERPRINT = 'AB' * 20
+CREATED = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def test_crc24():
+    """
+    Testing CRC-24 of empty and short data
+    Expect the values of RFC 4880 implementation
+    """
+    assert crc24(b'') == 0xB704CE
+    assert crc24(b'123456789') == 0x21CF02
+
+
+@pytest.mark.parametrize('size', [1, 256, 512])
+@pytest.mark.parametrize('algorithm', ['SHA256', 'SHA512'])
+def test_detached_signature_matches_pgpy(size, algorithm):
+    """
+    Testing detached signatures with RSA signatures of various sizes
+    Expect that pgpy parses the packet and armors it the same way
+    """
+    armored = wrap_signature_as_pgp(
+        os.urandom(size),
+        b'',
+        algorithm,
+        True,
+        FINGERPRINT,
+        CREATED,
+        digest=b'\x12\x34',
+    )
+    signature = pgpy.PGPSignature.from_blob(armored)
+
+    assert str(signature) == armored
+    assert signature.signer == FINGERPRINT[-16:]
+    assert signature.created == CREATED
+    assert signature.hash_algorithm.name == algorithm
+    assert signature.type == pgpy.constants.SignatureType.BinaryDocument
+    assert signature.hash2 == b'\x12\x34'
+
+
+def test_cleartext_signature_matches_pgpy():
+    """
+    Testing cleartext message with dash-escaped lines
+    Expect that pgpy parses the text and the signature
+    """
+    armored = wrap_signature_as_pgp(
+        os.urandom(256),
+        b'first\n-second\n',
+        'SHA256',
+        False,
+        FINGERPRINT,
+        CREATED,
+    )
+    message = pgpy.PGPMessage.from_blob(armored)
+    (signature,) = message.signatures
+
+    assert message.message == 'first\n-second'
+    assert signature.type == pgpy.constants.SignatureType.CanonicalDocument
+    assert signature.signer == FINGERPRINT[-16:]
@@ -0,0 +1,120 @@
+import asyncio
+import base64
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa, utils
+from fastapi import UploadFile
+
+from sign.kms import kms
+
+FINGERPRINT = 'AB' * 20
+PRIVATE_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+PUBLIC_KEY = PRIVATE_KEY.public_key().public_bytes(
+    serialization.Encoding.DER,
+    serialization.PublicFormat.SubjectPublicKeyInfo,
+)
+HASHES = {32: hashes.SHA256(), 48: hashes.SHA384(), 64: hashes.SHA512()}
+
+
+def rsa_sign(digest: bytes) -> bytes:
+    return PRIVATE_KEY.sign(
+        digest, padding.PKCS1v15(), utils.Prehashed(HASHES[len(digest)])
+    )
+
+
+class StandIn(ThreadingHTTPServer):
+    """Local KMS answering key requests, and Sign after a delay."""
+
+    daemon_threads = True
+
+    def __init__(self, delay: float):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.delay = delay
+        self.signed = 0
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(
+            int(self.headers['Content-Length'])
+        ))
+        operation = self.headers['X-Amz-Target'].split('.')[-1]
+        if operation == 'DescribeKey':
+            body = {'KeyMetadata': {
+                'KeyId': request['KeyId'],
+                'KeyState': 'Enabled',
+                'MultiRegion': True,
+            }}
+        elif operation == 'GetPublicKey':
+            body = {
+                'KeyId': request['KeyId'],
+                'PublicKey': base64.b64encode(PUBLIC_KEY).decode(),
+            }
+        else:
+            time.sleep(self.server.delay)
+            self.server.signed += 1
+            signature = rsa_sign(base64.b64decode(request['Message']))
+            body = {
+                'KeyId': request['KeyId'],
+                'Signature': base64.b64encode(signature).decode(),
+                'SigningAlgorithm': request['SigningAlgorithm'],
+            }
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-amz-json-1.1')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def test_replica_routing_and_failover():
+    """
+    Testing a multi-region key with a fast and a slow regional replica
+    Expect that signing prefers the fast one and fails over when it
+    goes down
+    """
+    fast = StandIn(delay=0)
+    slow = StandIn(delay=0.05)
+    backend = kms.KMS(
+        ['mrk'],
+        {'mrk': FINGERPRINT},
+        access_key_id='key',
+        secret_access_key='secret',
+        replicas={'mrk': [
+            {'region': 'eu-west-1', 'kms_id': 'eu', 'endpoint_url': slow.url},
+            {'region': 'us-east-1', 'kms_id': 'us', 'endpoint_url': fast.url},
+        ]},
+    )
+
+    async def sign():
+        upload = UploadFile(file=io.BytesIO(b'data'), filename='file')
+        return await backend.sign('mrk', upload)
+
+    async def main():
+        for _ in range(20):
+            await sign()
+        assert fast.signed >= 18
+        fast.stop()
+        for _ in range(5):
+            await sign()
+        await backend.close()
+
+    try:
+        asyncio.run(main())
+    finally:
+        slow.stop()
+    assert slow.signed >= 5
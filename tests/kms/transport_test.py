@@ -0,0 +1,174 @@
+import asyncio
+import base64
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from botocore.credentials import Credentials
+from botocore.exceptions import ClientError
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa, utils
+from fastapi import UploadFile
+
+from sign.kms import kms
+from sign.kms.transport import AsyncKMSClient
+
+FINGERPRINT = 'AB' * 20
+PRIVATE_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+PUBLIC_KEY = PRIVATE_KEY.public_key().public_bytes(
+    serialization.Encoding.DER,
+    serialization.PublicFormat.SubjectPublicKeyInfo,
+)
+HASHES = {32: hashes.SHA256(), 48: hashes.SHA384(), 64: hashes.SHA512()}
+
+
+def rsa_sign(digest: bytes) -> bytes:
+    return PRIVATE_KEY.sign(
+        digest, padding.PKCS1v15(), utils.Prehashed(HASHES[len(digest)])
+    )
+
+
+class StubKMS(ThreadingHTTPServer):
+    """KMS-compatible stub signing after a delay, throttling key 'busy'."""
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, delay: float = 0):
+        super().__init__(('127.0.0.1', 0), StubKMSHandler)
+        self.delay = delay
+        self.connections = 0
+        self.requests = []
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubKMSHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def respond(self, status: int, body: dict):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-amz-json-1.1')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(
+            int(self.headers['Content-Length'])
+        ))
+        operation = self.headers['X-Amz-Target'].split('.')[-1]
+        self.server.requests.append((operation, dict(self.headers)))
+        if request['KeyId'] == 'busy':
+            self.respond(400, {
+                '__type': 'ThrottlingException',
+                'message': 'Rate exceeded',
+            })
+        elif operation == 'DescribeKey':
+            self.respond(200, {'KeyMetadata': {
+                'KeyId': request['KeyId'],
+                'KeyState': 'Enabled',
+            }})
+        elif operation == 'GetPublicKey':
+            self.respond(200, {
+                'KeyId': request['KeyId'],
+                'PublicKey': base64.b64encode(PUBLIC_KEY).decode(),
+            })
+        else:
+            time.sleep(self.server.delay)
+            signature = rsa_sign(base64.b64decode(request['Message']))
+            self.respond(200, {
+                'KeyId': request['KeyId'],
+                'Signature': base64.b64encode(signature).decode(),
+                'SigningAlgorithm': request['SigningAlgorithm'],
+            })
+
+
+def test_signed_requests_and_errors():
+    """
+    Testing Sign requests of the async client, one of them throttled
+    Expect SigV4 signed requests and the ClientError boto3 would raise
+    """
+    stub = StubKMS()
+    client = AsyncKMSClient(
+        Credentials('AKIDEXAMPLE', 'secret'), 'eu-west-1', stub.url
+    )
+
+    async def main():
+        response = await client.sign(
+            KeyId='key',
+            Message=b'\x00' * 32,
+            MessageType='DIGEST',
+            SigningAlgorithm='RSASSA_PKCS1_V1_5_SHA_256',
+        )
+        assert response['Signature'] == rsa_sign(b'\x00' * 32)
+        with pytest.raises(ClientError) as error:
+            await client.describe_key(KeyId='busy')
+        assert error.value.response['Error']['Code'] == 'ThrottlingException'
+        await client.close()
+
+    try:
+        asyncio.run(main())
+    finally:
+        stub.stop()
+    _, headers = stub.requests[0]
+    assert headers['Authorization'].startswith(
+        'AWS4-HMAC-SHA256 Credential=AKIDEXAMPLE/'
+    )
+    assert '/eu-west-1/kms/aws4_request' in headers['Authorization']
+    assert 'X-Amz-Date' in headers
+
+
+def test_concurrent_signs_on_pooled_connections():
+    """
+    Testing a batch of 200 files signed by KMS with the async transport
+    Expect that requests run concurrently on kept-alive connections
+    """
+    stub = StubKMS(delay=0.05)
+    backend = kms.KMS(
+        ['key'],
+        {'key': FINGERPRINT},
+        access_key_id='AKIDEXAMPLE',
+        secret_access_key='secret',
+        region='us-east-1',
+        endpoint_url=stub.url,
+        max_workers=100,
+        transport='async',
+    )
+
+    async def main():
+        files = [
+            UploadFile(file=io.BytesIO(b'%d' % i), filename=str(i))
+            for i in range(200)
+        ]
+        started = time.monotonic()
+        signatures = await backend.sign_batch('key', files)
+        elapsed = time.monotonic() - started
+        await backend.close()
+        return signatures, elapsed
+
+    try:
+        signatures, elapsed = asyncio.run(main())
+    finally:
+        stub.stop()
+    assert len(signatures) == 200
+    # 10 seconds one by one
+    assert elapsed < 2
+    # key requests of the boto3 client plus the pool of the async one
+    assert stub.connections <= 101
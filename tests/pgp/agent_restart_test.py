@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from sign.pgp.agent_restart import AgentRestartCoordinator
+
+
+def run_operations(policy, outcomes, delay=0.05, pause=0):
+    """Runs card operations one after another, returns the restarts."""
+    restarts = []
+
+    async def restart():
+        restarts.append(None)
+
+    async def main():
+        coordinator = AgentRestartCoordinator(restart, policy, delay)
+        for failed in outcomes:
+            with coordinator.operation() as operation:
+                operation.failed = failed
+            await asyncio.sleep(pause)
+        await asyncio.sleep(delay * 3)
+        await coordinator.close()
+
+    asyncio.run(main())
+    return len(restarts)
+
+
+def test_burst_restarts_once():
+    """
+    Testing a burst of successful operations with the burst policy
+    Expect a single restart once the burst is over
+    """
+    assert run_operations('burst', [False] * 5) == 1
+
+
+def test_always_restarts_after_every_operation():
+    """
+    Testing operations spread in time with the always policy
+    Expect a restart after every operation
+    """
+    assert run_operations('always', [False] * 3, pause=0.01) == 3
+
+
+def test_on_error_restarts_only_after_failures():
+    """
+    Testing successful and failed operations with the on_error policy
+    Expect a restart only after the failed one
+    """
+    assert run_operations('on_error', [False, False], pause=0.01) == 0
+    assert run_operations('on_error', [False, True], pause=0.01) == 1
+
+
+def test_exception_is_a_failure():
+    """
+    Testing an operation raising an exception
+    Expect an immediate restart and the exception propagated
+    """
+    restarts = []
+
+    async def restart():
+        restarts.append(None)
+
+    async def main():
+        coordinator = AgentRestartCoordinator(restart, 'on_error')
+        with pytest.raises(RuntimeError):
+            with coordinator.operation():
+                raise RuntimeError
+        await asyncio.sleep(0.01)
+        assert len(restarts) == 1
+        await coordinator.close()
+
+    asyncio.run(main())
+
+
+def test_close_performs_pending_restart():
+    """
+    Testing close while a burst restart waits for its delay
+    Expect the restart performed by close at once
+    """
+    restarts = []
+
+    async def restart():
+        restarts.append(None)
+
+    async def main():
+        coordinator = AgentRestartCoordinator(restart, 'burst', delay=60)
+        with coordinator.operation():
+            pass
+        await asyncio.wait_for(coordinator.close(), timeout=1)
+
+    asyncio.run(main())
+    assert len(restarts) == 1
+
+
+def test_unknown_policy():
+    """
+    Testing an unknown restart policy
+    Expect ValueError
+    """
+    with pytest.raises(ValueError):
+        AgentRestartCoordinator(lambda: None, 'never')
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from sign.pgp.agent import AgentConnection, assuan_escape, assuan_unescape
+from sign.pgp.errors import AgentError
+
+SIGNATURE = b'\x01%\n\r\xff' * 4
+
+
+class FakeWriter:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+def connection(response: bytes):
+    reader = asyncio.StreamReader()
+    reader.feed_data(response)
+    reader.feed_eof()
+    writer = FakeWriter()
+    return AgentConnection(reader, writer), writer
+
+
+def test_assuan_escaping():
+    """
+    Testing escaping of data lines
+    Expect percent, CR and LF escaped and restored by unescaping
+    """
+    data = b'100%\r\nend'
+    assert assuan_escape(data) == b'100%25%0D%0Aend'
+    assert assuan_unescape(assuan_escape(data)) == data
+    assert assuan_unescape(b'%7e%7E') == b'~~'
+
+
+def test_sign_digest_session():
+    """
+    Testing a signing session with a passphrase inquiry
+    Expect the passphrase sent as data and the escaped signature value
+    of the data lines returned
+    """
+    sig_val = b'(7:sig-val(3:rsa(1:s%d:' % len(SIGNATURE)
+    sig_val += SIGNATURE + b')))'
+    escaped = assuan_escape(sig_val)
+    response = b''.join((
+        b'OK\n' * 3,
+        b'S INQUIRE_MAXLEN 255\n',
+        b'INQUIRE PASSPHRASE\n',
+        b'# comment\n',
+        b'D ' + escaped[:10] + b'\n',
+        b'D ' + escaped[10:] + b'\n',
+        b'OK\n',
+    ))
+
+    async def main():
+        conn, writer = connection(response)
+        signature = await conn.sign_digest(
+            'AB' * 20, 'sha256', b'\xaa' * 32, passphrase='pass%word'
+        )
+        return conn, writer, signature
+
+    conn, writer, signature = asyncio.run(main())
+    assert signature == SIGNATURE
+    assert writer.data == b''.join((
+        b'RESET\n',
+        b'SIGKEY ' + b'AB' * 20 + b'\n',
+        b'SETHASH 8 ' + b'AA' * 32 + b'\n',
+        b'PKSIGN\n',
+        b'D pass%25word\n',
+        b'END\n',
+    ))
+    assert conn.uses == 1
+    assert not conn.broken
+
+
+def test_error_response():
+    """
+    Testing an ERR response and a connection closed by the agent
+    Expect AgentError with the error code, and a broken session
+    """
+
+    async def main():
+        conn, _ = connection(b'ERR 67108875 Bad passphrase <Pinentry>\n')
+        with pytest.raises(AgentError, match='Bad passphrase') as error:
+            await conn.transact('PKSIGN')
+        assert error.value.code == 67108875
+        assert not conn.broken
+        with pytest.raises(AgentError, match='closed'):
+            await conn.transact('NOP')
+        assert conn.broken
+
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+import pytest
+
+from sign.pgp.cards import DEFAULT_CARD, Card, parse_cards
+from sign.pgp.errors import ConfigurationError
+from sign.utils.locking import GPG_AGENT_LOCK_FILENAME
+
+KEYID = 'AB' * 8
+
+
+def test_cards_of_a_key_are_parsed():
+    """
+    Testing yubikey_cards listing two cards of one key
+    Expect that every card has its own GnuPG home and agent lock
+    """
+    cards = parse_cards({
+        KEYID: [
+            {'serial': 1111, 'homedir': '/gnupg/1111'},
+            {'serial': '2222', 'homedir': '/gnupg/2222'},
+        ],
+    })
+    assert cards == {KEYID: [
+        Card(serial='1111', homedir='/gnupg/1111'),
+        Card(serial='2222', homedir='/gnupg/2222'),
+    ]}
+    first, second = cards[KEYID]
+    assert first.env == {'GNUPGHOME': '/gnupg/1111'}
+    assert second.env == {'GNUPGHOME': '/gnupg/2222'}
+    assert first.agent_lock == f'{GPG_AGENT_LOCK_FILENAME}.1111'
+    assert second.agent_lock == f'{GPG_AGENT_LOCK_FILENAME}.2222'
+    assert DEFAULT_CARD.env is None
+    assert DEFAULT_CARD.agent_lock == GPG_AGENT_LOCK_FILENAME
+
+
+@pytest.mark.parametrize('config', [
+    {KEYID: []},
+    {KEYID: [{'homedir': '/gnupg/1111'}]},
+    {KEYID: [{'serial': '1111'}]},
+    {KEYID: [{'serial': '1111', 'homedir': ''}]},
+    {
+        KEYID: [{'serial': '1111', 'homedir': '/gnupg'}],
+        'CD' * 8: [{'serial': '2222', 'homedir': '/gnupg'}],
+    },
+])
+def test_malformed_cards_are_rejected(config):
+    """
+    Testing yubikey_cards without cards, serials or home directories,
+    and with a home directory shared by two cards
+    Expect ConfigurationError
+    """
+    with pytest.raises(ConfigurationError):
+        parse_cards(config)
+
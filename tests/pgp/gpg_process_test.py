@@ -0,0 +1,46 @@
+from sign.pgp.gpg_process import GPGResult, parse_status
+
+STDERR = b'''\
+gpg: using "ABCD" as default secret key for signing
+[GNUPG:] KEY_CONSIDERED ABCD 2
+[GNUPG:] PINENTRY_LAUNCHED 1234 loopback
+gpg: signing failed: Bad passphrase
+[GNUPG:] BAD_PASSPHRASE ABCD
+
+[GNUPG:] FAILURE sign 11
+'''
+
+
+def test_parse_status():
+    """
+    Testing gpg stderr with status lines, diagnostics and empty lines
+    Expect status keywords with their arguments and the other lines
+    as diagnostics
+    """
+    status, diagnostics = parse_status(STDERR)
+    assert status == [
+        ('KEY_CONSIDERED', 'ABCD 2'),
+        ('PINENTRY_LAUNCHED', '1234 loopback'),
+        ('BAD_PASSPHRASE', 'ABCD'),
+        ('FAILURE', 'sign 11'),
+    ]
+    assert diagnostics == [
+        'gpg: using "ABCD" as default secret key for signing',
+        'gpg: signing failed: Bad passphrase',
+    ]
+
+
+def test_failure_reason():
+    """
+    Testing failure reasons of failed gpg runs
+    Expect failure statuses first, then the last diagnostics, then
+    the exit code
+    """
+    status, diagnostics = parse_status(STDERR)
+    result = GPGResult(2, b'', status, diagnostics)
+    assert not result.signed
+    assert result.failure_reason() == 'BAD_PASSPHRASE ABCD; FAILURE sign 11'
+    result = GPGResult(2, b'', status[:2], ['a', 'b', 'c', 'd'])
+    assert result.failure_reason() == 'b; c; d'
+    assert GPGResult(2, b'').failure_reason() == 'exit code 2'
+    assert GPGResult(0, b'sig', [('SIG_CREATED', 'D')]).signed
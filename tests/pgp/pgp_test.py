@@ -0,0 +1,254 @@
+import asyncio
+import contextlib
+import io
+
+from fastapi import UploadFile
+
+from sign.config import settings
+from sign.pgp import pgp
+from sign.pgp.cards import DEFAULT_CARD
+from sign.utils.locking import GPG_AGENT_LOCK_FILENAME
+
+KEYID = 'AB' * 8
+FINGERPRINT = 'AB' * 20
+
+
+class FakePasswordDB:
+    def __init__(self, gpg, pgp_keys, *args):
+        self._PGPPasswordDB__keys = {keyid: {} for keyid in pgp_keys}
+
+    def ask_for_passwords(self):
+        pass
+
+    def get_password(self, keyid):
+        return ''
+
+    def get_signing_key(self, keyid):
+        return {
+            'keyid': keyid,
+            'fingerprint': FINGERPRINT,
+            'keygrip': '00' * 20,
+            'algo': pgp.RSA_ALGO,
+        }
+
+
+class FakeSysLog:
+    def __init__(self, tag_name):
+        pass
+
+    def sign_log(self, *args):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, on_sign):
+        self._on_sign = on_sign
+
+    async def sign_digest(self, keygrip, digest_algo, digest, passphrase):
+        await self._on_sign()
+        return b'\x01' * 256
+
+
+class FakeAgentPools:
+    def __init__(self, on_sign):
+        self._on_sign = on_sign
+
+    def get(self, keyid):
+        return self
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        yield FakeConnection(self._on_sign)
+
+    async def close(self):
+        pass
+
+
+def test_batch_with_queued_agent_restart(monkeypatch, tmp_path):
+    """
+    Testing an agent restart queued while a batch signs with the agent
+    Expect that the batch and the restart both finish
+    """
+    monkeypatch.setattr(settings, 'gpg_locks_dir', str(tmp_path))
+    monkeypatch.setattr(pgp, 'PGPPasswordDB', FakePasswordDB)
+    monkeypatch.setattr(pgp, 'SysLog', FakeSysLog)
+    monkeypatch.setattr(pgp, 'restart_gpg_agent', lambda homedir: None)
+    restarts = []
+
+    async def on_sign():
+        if not restarts:
+            # queued as an exclusive waiter while the file holds the lock
+            restarts.append(asyncio.ensure_future(backend._restart_gpg_agent()))
+        await asyncio.sleep(0.01)
+
+    backend = pgp.PGP(
+        keyring=str(tmp_path / 'pubring.kbx'),
+        gpg_binary='gpg',
+        pgp_keys=[KEYID],
+        max_upload_bytes=1000,
+        agent_pools=FakeAgentPools(on_sign),
+        signing_engine='agent',
+        sign_concurrency=1,
+    )
+    files = [
+        UploadFile(file=io.BytesIO(b'%d' % i), filename=str(i))
+        for i in range(3)
+    ]
+
+    async def main():
+        results = await asyncio.wait_for(
+            backend.sign_batch(KEYID, files), timeout=5
+        )
+        await asyncio.wait_for(restarts[0], timeout=5)
+        return results
+
+    results = asyncio.run(main())
+    assert [filename for filename, _ in results] == ['0', '1', '2']
+
+
+def test_slow_stream_does_not_block_agent_restart(monkeypatch, tmp_path):
+    """
+    Testing an agent restart while a slow client streams a body to gpg
+    Expect that the restart finishes before the body is received
+    """
+    monkeypatch.setattr(settings, 'gpg_locks_dir', str(tmp_path))
+    monkeypatch.setattr(pgp, 'PGPPasswordDB', FakePasswordDB)
+    monkeypatch.setattr(pgp, 'SysLog', FakeSysLog)
+    monkeypatch.setattr(pgp, 'restart_gpg_agent', lambda homedir: None)
+
+    async def gpg_sign_file(*args, **kwargs):
+        return pgp.GPGResult(0, b'signature', [('SIG_CREATED', '')])
+
+    monkeypatch.setattr(pgp, 'gpg_sign_file', gpg_sign_file)
+    backend = pgp.PGP(
+        keyring=str(tmp_path / 'pubring.kbx'),
+        gpg_binary='gpg',
+        pgp_keys=[KEYID],
+        max_upload_bytes=1000,
+        tmp_dir=str(tmp_path),
+        stream_uploads=True,
+    )
+    restarted = asyncio.Event()
+
+    async def chunks():
+        for _ in range(3):
+            yield b'data'
+            await asyncio.sleep(0.1)
+        assert restarted.is_set()
+
+    async def restart():
+        await asyncio.sleep(0.05)
+        await backend._restart_gpg_agent()
+        restarted.set()
+
+    async def main():
+        return await asyncio.wait_for(
+            asyncio.gather(backend.sign_stream(KEYID, chunks()), restart()),
+            timeout=5,
+        )
+
+    signature, _ = asyncio.run(main())
+    assert signature == 'signature'
+
+
+def test_batch_parts_share_key_concurrency(monkeypatch, tmp_path):
+    """
+    Testing batch parts of one key signed at the same time
+    Expect no more signatures in flight than the key concurrency
+    """
+    monkeypatch.setattr(settings, 'gpg_locks_dir', str(tmp_path))
+    monkeypatch.setattr(pgp, 'PGPPasswordDB', FakePasswordDB)
+    monkeypatch.setattr(pgp, 'SysLog', FakeSysLog)
+    in_flight = []
+    peak = []
+
+    async def on_sign():
+        in_flight.append(None)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.pop()
+
+    backend = pgp.PGP(
+        keyring=str(tmp_path / 'pubring.kbx'),
+        gpg_binary='gpg',
+        pgp_keys=[KEYID],
+        max_upload_bytes=1000,
+        agent_pools=FakeAgentPools(on_sign),
+        signing_engine='agent',
+        sign_concurrency=2,
+    )
+
+    async def main():
+        return await asyncio.gather(*(
+            backend.sign_batch_part(
+                KEYID, UploadFile(file=io.BytesIO(b'%d' % i), filename=str(i))
+            )
+            for i in range(6)
+        ))
+
+    assert len(asyncio.run(main())) == 6
+    assert max(peak) == 2
+
+
+def test_requests_are_spread_over_cards(monkeypatch, tmp_path):
+    """
+    Testing two requests at once for a key held by two cards
+    Expect that they sign at the same time on different cards, each
+    under the agent lock and with the GnuPG home of its card
+    """
+    monkeypatch.setattr(settings, 'gpg_locks_dir', str(tmp_path))
+    monkeypatch.setattr(pgp, 'PGPPasswordDB', FakePasswordDB)
+    monkeypatch.setattr(pgp, 'SysLog', FakeSysLog)
+    locks = []
+    envs = []
+    in_flight = []
+    peak = []
+
+    async def gpg_sign_file(*args, env=None, **kwargs):
+        envs.append(env)
+        in_flight.append(None)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.05)
+        in_flight.pop()
+        return pgp.GPGResult(0, b'signature', [('SIG_CREATED', '')])
+
+    monkeypatch.setattr(pgp, 'gpg_sign_file', gpg_sign_file)
+    backend = pgp.PGP(
+        keyring=str(tmp_path / 'pubring.kbx'),
+        gpg_binary='gpg',
+        pgp_keys=[KEYID],
+        max_upload_bytes=1000,
+        tmp_dir=str(tmp_path),
+        yubikey_cards={KEYID: [
+            {'serial': '1111', 'homedir': str(tmp_path / '1111')},
+            {'serial': '2222', 'homedir': str(tmp_path / '2222')},
+        ]},
+    )
+    agent_lock = backend._agent_lock
+
+    @contextlib.asynccontextmanager
+    async def recording_agent_lock(card=DEFAULT_CARD):
+        async with agent_lock(card):
+            locks.append(card.agent_lock)
+            yield
+
+    monkeypatch.setattr(backend, '_agent_lock', recording_agent_lock)
+
+    async def main():
+        return await asyncio.gather(*(
+            backend.sign(
+                KEYID, UploadFile(file=io.BytesIO(b'%d' % i), filename=str(i))
+            )
+            for i in range(2)
+        ))
+
+    assert asyncio.run(main()) == ['signature', 'signature']
+    assert sorted(locks) == [
+        f'{GPG_AGENT_LOCK_FILENAME}.1111',
+        f'{GPG_AGENT_LOCK_FILENAME}.2222',
+    ]
+    assert sorted(env['GNUPGHOME'] for env in envs) == [
+        str(tmp_path / '1111'),
+        str(tmp_path / '2222'),
+    ]
+    assert max(peak) == 2
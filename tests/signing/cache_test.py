@@ -0,0 +1,124 @@
+import asyncio
+import io
+import os
+import time
+
+import pytest
+from fastapi import UploadFile
+
+from sign.errors import FileTooBigError
+from sign.signing.cache import CachingBackend, SignatureCache
+from sign.utils.spool import UploadSpool
+
+
+class CountingBackend:
+    def __init__(self):
+        self.signed = []
+        self.audited = []
+
+    def audit_log(self, keyid, filename, file_hash):
+        self.audited.append((keyid, filename))
+
+    async def sign(self, keyid, file, detach_sign, digest_algo, timeout):
+        content = file.file.read()
+        self.signed.append(content)
+        return f'{keyid}:{detach_sign}:{digest_algo}:{content.decode()}'
+
+    async def sign_stream(
+        self, keyid, chunks, filename, detach_sign, digest_algo, timeout
+    ):
+        content = b''.join([chunk async for chunk in chunks])
+        self.signed.append(content)
+        return f'{keyid}:{detach_sign}:{digest_algo}:{content.decode()}'
+
+
+def upload(content: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(content), filename='file')
+
+
+async def stream(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+def test_repeated_content_is_signed_once(tmp_path):
+    """
+    Testing signing of the same content by two workers
+    Expect that the second worker gets the signature from the disk tier,
+    both hits are audited and other content or options are signed again
+    """
+    backend = CountingBackend()
+
+    def worker():
+        cache = SignatureCache(str(tmp_path), ttl=60)
+        return cache, CachingBackend(backend, cache, max_upload_bytes=100)
+
+    async def main():
+        first_cache, first = worker()
+        second_cache, second = worker()
+        signature = await first.sign('KEY', upload(b'data'))
+        assert await first.sign('KEY', upload(b'data')) == signature
+        assert await second.sign('KEY', upload(b'data')) == signature
+        await second.sign('KEY', upload(b'data'), detach_sign=False)
+        await second.sign('KEY', upload(b'other'))
+        await first_cache.close()
+        await second_cache.close()
+        return first_cache.stats(), second_cache.stats()
+
+    first_stats, second_stats = asyncio.run(main())
+    assert backend.signed == [b'data', b'data', b'other']
+    assert backend.audited == [('KEY', 'file'), ('KEY', 'file')]
+    assert first_stats['memory_hits'] == 1
+    assert second_stats['disk_hits'] == 1
+    assert second_stats['misses'] == 2
+
+
+def test_expired_and_excess_entries_are_evicted(tmp_path):
+    """
+    Testing eviction of the disk tier
+    Expect that expired entries and least recently used ones above
+    the size limit are removed
+    """
+    cache = SignatureCache(str(tmp_path), ttl=60, max_bytes=10)
+    now = time.time()
+    for key, age in (('aa1', 120), ('bb1', 30), ('cc1', 10)):
+        cache._write(key, 'signature')
+        path = cache._entry_path(key)
+        os.utime(path, (now - age, now - age))
+
+    assert cache._evict() == 2
+    assert [path.name for path in tmp_path.glob('*/*.asc')] == ['cc1.asc']
+
+
+def test_streamed_content_is_spooled_in_tmp_dir(monkeypatch, tmp_path):
+    """
+    Testing signing of the same stream twice and of a stream over the limit
+    Expect that the stream is signed once, the spool goes to tmp_dir and
+    is removed, and the stream over the limit is rejected
+    """
+    backend = CountingBackend()
+    spool_dir = tmp_path / 'spool'
+    spool_dir.mkdir()
+    cache = SignatureCache(str(tmp_path / 'cache'), ttl=60)
+    caching = CachingBackend(
+        backend, cache, max_upload_bytes=8, tmp_dir=str(spool_dir)
+    )
+    spooled = []
+    write_stream = UploadSpool.write_stream
+
+    async def spy(spool, chunks):
+        spooled.append(os.path.dirname(spool.name))
+        await write_stream(spool, chunks)
+
+    async def main():
+        signature = await caching.sign_stream('KEY', stream(b'da', b'ta'))
+        assert await caching.sign_stream('KEY', stream(b'data')) == signature
+        with pytest.raises(FileTooBigError):
+            await caching.sign_stream('KEY', stream(b'data', b'too big'))
+        await cache.close()
+
+    monkeypatch.setattr(UploadSpool, 'write_stream', spy)
+    asyncio.run(main())
+    assert backend.signed == [b'data']
+    assert spooled == [str(spool_dir)] * 3
+    assert not os.listdir(spool_dir)
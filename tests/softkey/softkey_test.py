@@ -0,0 +1,104 @@
+import asyncio
+import io
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from fastapi import UploadFile
+
+from sign.softkey import SoftKey
+
+pgpy = pytest.importorskip('pgpy')
+
+
+@pytest.fixture(scope='module')
+def pgp_key():
+    return pgpy.PGPKey.new(
+        pgpy.constants.PubKeyAlgorithm.RSAEncryptOrSign, 2048
+    )
+
+
+@pytest.fixture
+def key_file(tmp_path, pgp_key):
+    path = tmp_path / 'key.pem'
+    path.write_bytes(
+        pgp_key._key.keymaterial.__privkey__().private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.BestAvailableEncryption(b'secret'),
+        )
+    )
+    return str(path)
+
+
+@pytest.fixture
+def public_key_file(tmp_path, pgp_key):
+    path = tmp_path / 'key.asc'
+    path.write_text(str(pgp_key.pubkey))
+    return str(path)
+
+
+def test_signatures_verify_with_pgp_key(pgp_key, key_file, public_key_file):
+    """
+    Testing detached and cleartext signing in a signing process
+    Expect signatures verified by the public PGP key
+    """
+    fingerprint = str(pgp_key.fingerprint).replace(' ', '')
+    keyid = fingerprint[-16:]
+    backend = SoftKey(
+        {fingerprint: key_file},
+        {fingerprint: public_key_file},
+        pass_db_dev_mode=True,
+        pass_db_dev_pass='secret',
+        workers=1,
+    )
+    content = b'first\n-second\n'
+
+    async def main():
+        upload = UploadFile(file=io.BytesIO(content), filename='file')
+        detached = await backend.sign(keyid, upload)
+        cleartext = await backend.sign(
+            keyid, upload, detach_sign=False, digest_algo='SHA512'
+        )
+        await backend.close()
+        return detached, cleartext
+
+    detached, cleartext = asyncio.run(main())
+    assert backend.list_keys() == [keyid]
+    assert pgp_key.pubkey.verify(
+        content, pgpy.PGPSignature.from_blob(detached)
+    )
+    assert pgp_key.pubkey.verify(pgpy.PGPMessage.from_blob(cleartext))
+
+
+def test_invalid_password(key_file):
+    """
+    Testing a key file with a wrong development password
+    Expect that the backend does not start
+    """
+    with pytest.raises(ValueError, match='password is not valid'):
+        SoftKey(
+            {'AB' * 20: key_file},
+            {},
+            pass_db_dev_mode=True,
+            pass_db_dev_pass='wrong',
+        )
+
+
+def test_key_of_other_fingerprint(tmp_path, key_file):
+    """
+    Testing a key file configured with the public key of another key
+    Expect that the backend does not start
+    """
+    other_key = pgpy.PGPKey.new(
+        pgpy.constants.PubKeyAlgorithm.RSAEncryptOrSign, 1024
+    )
+    fingerprint = str(other_key.fingerprint).replace(' ', '')
+    public_key_file = tmp_path / 'other.gpg'
+    public_key_file.write_bytes(bytes(other_key.pubkey))
+    with pytest.raises(ValueError, match='does not match fingerprint'):
+        SoftKey(
+            {fingerprint: key_file},
+            {fingerprint: str(public_key_file)},
+            pass_db_dev_mode=True,
+            pass_db_dev_pass='secret',
+        )
@@ -0,0 +1,47 @@
+import pytest
+
+from sign.utils.cleartext import MAX_LINE_LENGTH, CleartextCanonicalizer
+
+# outputs and signed texts of gpg --clearsign
+DOCUMENTS = [
+    (b'', b'\n', b''),
+    (b'a', b'a\n', b'a'),
+    (b'a\n', b'a\n', b'a'),
+    (b'a\n\n', b'a\n\n', b'a\r\n'),
+    (b'a  \r\nb\t\n-c\n', b'a  \r\nb\t\n- -c\n', b'a\r\nb\r\n-c'),
+    (b'x\ry \r', b'x\ry \r\n', b'x\ry'),
+    (b'From me\n>From\n', b'- From me\n>From\n', b'From me\r\n>From'),
+    (
+        b'a' * (MAX_LINE_LENGTH - 2) + b'   -rest\nb',
+        b'a' * (MAX_LINE_LENGTH - 2) + b'  \nb\n',
+        b'a' * (MAX_LINE_LENGTH - 2) + b'\r\nb',
+    ),
+]
+
+
+class Collector:
+    def __init__(self):
+        self.data = b''
+
+    def update(self, data):
+        self.data += data
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 1000, 100000])
+@pytest.mark.parametrize(
+    'document, output, signed', DOCUMENTS, ids=range(len(DOCUMENTS))
+)
+def test_canonical_text_matches_gpg(document, output, signed, chunk_size):
+    """
+    Testing documents fed in chunks of various sizes
+    Expect the dash-escaped output and signed text gpg produces
+    """
+    hashed = Collector()
+    canonicalizer = CleartextCanonicalizer(hashed)
+    escaped = b''
+    for start in range(0, len(document), chunk_size):
+        escaped += canonicalizer.update(document[start:start + chunk_size])
+    escaped += canonicalizer.finish()
+
+    assert escaped == output
+    assert hashed.data == signed
@@ -0,0 +1,126 @@
+import asyncio
+import fcntl
+import os
+import threading
+
+import pytest
+
+from sign.errors import LockTimeoutError, QueueRejectedError
+from sign.utils.fifo_queue import FifoQueue
+
+
+def test_requests_are_served_in_arrival_order(tmp_path):
+    """
+    Testing requests of several queue instances (like worker processes)
+    Expect that they hold the slot one by one in arrival order
+    """
+    order = []
+
+    async def request(name, delay):
+        queue = FifoQueue(str(tmp_path))
+        async with queue.slot('key') as slot:
+            order.append((name, slot.position))
+            await asyncio.sleep(delay)
+
+    async def main():
+        tasks = []
+        for index in range(4):
+            tasks.append(asyncio.ensure_future(request(index, 0.1)))
+            await asyncio.sleep(0.005)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == [(0, 0), (1, 1), (2, 2), (3, 3)]
+    assert asyncio.run(FifoQueue(str(tmp_path)).depth('key')) == 0
+
+
+def test_requests_are_rejected(tmp_path):
+    """
+    Testing full queue, unreachable deadline and expired wait
+    Expect that requests are rejected and leave the queue
+    """
+    queue = FifoQueue(str(tmp_path), max_depth=2)
+
+    async def hold(delay):
+        async with queue.slot('key'):
+            await asyncio.sleep(delay)
+
+    async def request(timeout=None):
+        async with queue.slot('key', timeout=timeout):
+            pass
+
+    async def main():
+        # the key is held for about 0.1 seconds on average
+        await hold(0.1)
+        holder = asyncio.ensure_future(hold(0.4))
+        await asyncio.sleep(0.01)
+        with pytest.raises(QueueRejectedError):
+            await request(timeout=0.15)
+        with pytest.raises(LockTimeoutError):
+            await request(timeout=0.21)
+        assert await queue.depth('key') == 1
+
+        waiter = asyncio.ensure_future(request())
+        await asyncio.sleep(0.01)
+        with pytest.raises(QueueRejectedError) as error:
+            await request()
+        assert error.value.depth == 2
+        await asyncio.gather(holder, waiter)
+        assert await queue.depth('key') == 0
+
+    asyncio.run(main())
+
+
+def test_requests_are_spread_over_servers(tmp_path):
+    """
+    Testing queue served by two servers, one of them marked down later
+    Expect that requests run on both servers, then only on the healthy one
+    """
+    queue = FifoQueue(str(tmp_path))
+    servers = []
+    running = []
+
+    async def request():
+        async with queue.slot('key', servers=2) as slot:
+            servers.append(slot.server)
+            running.append(slot.server)
+            assert len(set(running)) == len(running)
+            await asyncio.sleep(0.02)
+            running.remove(slot.server)
+
+    async def main():
+        await asyncio.gather(*(request() for _ in range(4)))
+        assert sorted(servers) == [0, 0, 1, 1]
+        servers.clear()
+        await queue.mark_down('key', 0, 60)
+        await asyncio.gather(*(request() for _ in range(2)))
+        assert servers == [1, 1]
+
+    asyncio.run(main())
+
+
+def test_locked_queue_does_not_block_loop(tmp_path):
+    """
+    Testing a request for a queue flocked by another worker
+    Expect that the event loop keeps running while the request waits
+    """
+    queue = FifoQueue(str(tmp_path))
+    fd = os.open(tmp_path / 'key.queue', os.O_RDWR | os.O_CREAT)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(None)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        ticker = asyncio.ensure_future(tick())
+        threading.Timer(0.2, os.close, (fd,)).start()
+        async with queue.slot('key') as slot:
+            assert slot.position == 0
+        ticker.cancel()
+        assert await queue.depth('key') == 0
+
+    asyncio.run(main())
+    assert len(ticks) > 5
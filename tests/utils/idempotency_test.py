@@ -0,0 +1,121 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import threading
+
+import pytest
+
+from sign.errors import IdempotencyConflictError, IdempotencyMismatchError
+from sign.utils.idempotency import IdempotencyStore
+
+
+def test_retry_waits_for_original_request(tmp_path):
+    """
+    Testing retry arriving while the original request runs
+    Expect that the retry gets the stored result without running again
+    and a retry with other content is rejected
+    """
+    store = IdempotencyStore(str(tmp_path), ttl=60, poll_interval=0.01)
+    runs = []
+
+    async def handle(content, delay=0):
+        async with store.claim('key') as request:
+            if request.replayed:
+                return request.replay(content)
+            runs.append(content)
+            await asyncio.sleep(delay)
+            await request.complete(content, f'signature of {content}')
+            return f'signature of {content}'
+
+    async def main():
+        original = asyncio.ensure_future(handle('data', delay=0.1))
+        await asyncio.sleep(0.01)
+        retry = await handle('data')
+        assert await original == retry == 'signature of data'
+        with pytest.raises(IdempotencyMismatchError):
+            await handle('other')
+
+    asyncio.run(main())
+    assert runs == ['data']
+
+
+def test_failed_request_releases_key(tmp_path):
+    """
+    Testing retry of a failed request and of a request still running
+    Expect that the failed request is run again and a retry which can't
+    wait for a running one gets a conflict
+    """
+    store = IdempotencyStore(str(tmp_path), ttl=60, poll_interval=0.01)
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            async with store.claim('key'):
+                raise RuntimeError
+        async with store.claim('key') as request:
+            assert not request.replayed
+            with pytest.raises(IdempotencyConflictError):
+                async with store.claim('key', timeout=0.05):
+                    pass
+
+    asyncio.run(main())
+
+
+def test_locked_entry_does_not_block_loop(tmp_path):
+    """
+    Testing a claim of an entry flocked by another worker
+    Expect that the event loop keeps running while the claim waits
+    """
+    store = IdempotencyStore(str(tmp_path), ttl=60)
+    name = hashlib.sha256(b'key').hexdigest()
+    fd = os.open(tmp_path / f'{name}.json', os.O_RDWR | os.O_CREAT)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(None)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        ticker = asyncio.ensure_future(tick())
+        threading.Timer(0.2, os.close, (fd,)).start()
+        async with store.claim('key') as request:
+            assert not request.replayed
+        ticker.cancel()
+
+    asyncio.run(main())
+    assert len(ticks) > 5
+
+
+def test_running_request_outlasts_ttl(tmp_path):
+    """
+    Testing retry arriving after the TTL while the original request runs
+    Expect that the retry waits for the original request and gets its
+    result until the TTL passes after completion
+    """
+    store = IdempotencyStore(
+        str(tmp_path), ttl=0.2, poll_interval=0.01, max_poll_interval=0.02
+    )
+    runs = []
+
+    async def handle(content, delay=0):
+        async with store.claim('key') as request:
+            if request.replayed:
+                return request.replay(content)
+            runs.append(content)
+            await asyncio.sleep(delay)
+            await request.complete(content, f'signature of {content}')
+            return f'signature of {content}'
+
+    async def main():
+        original = asyncio.ensure_future(handle('data', delay=0.4))
+        await asyncio.sleep(0.3)
+        assert await handle('data') == 'signature of data'
+        await original
+        assert await handle('data') == 'signature of data'
+        await asyncio.sleep(0.3)
+        await handle('data')
+
+    asyncio.run(main())
+    assert runs == ['data', 'data']
@@ -0,0 +1,56 @@
+import asyncio
+import fcntl
+
+import pytest
+
+from sign.errors import LockTimeoutError
+from sign.utils.locking import AsyncLockManager
+
+
+def test_exclusive_waiter_is_not_starved(tmp_path):
+    """
+    Testing shared waiters queued after an exclusive waiter
+    Expect that they get the lock only after the exclusive one
+    """
+    manager = AsyncLockManager(str(tmp_path))
+    order = []
+
+    async def hold(name, exclusive, delay):
+        lock = manager.exclusive if exclusive else manager.shared
+        async with lock('key'):
+            order.append(name)
+            await asyncio.sleep(delay)
+
+    async def main():
+        first = asyncio.ensure_future(hold('shared-1', False, 0.05))
+        await asyncio.sleep(0)
+        writer = asyncio.ensure_future(hold('exclusive', True, 0.05))
+        await asyncio.sleep(0)
+        late = asyncio.ensure_future(hold('shared-2', False, 0))
+        await asyncio.gather(first, writer, late)
+
+    asyncio.run(main())
+    assert order == ['shared-1', 'exclusive', 'shared-2']
+
+
+def test_timeout_on_foreign_lock(tmp_path):
+    """
+    Testing lock held by another process (another open file description)
+    Expect that waiting stops after the timeout and is accounted
+    """
+    manager = AsyncLockManager(str(tmp_path))
+
+    async def main():
+        async with manager.shared('key', timeout=0.1):
+            pass
+
+    with open(tmp_path / 'key', 'w') as foreign:
+        fcntl.flock(foreign, fcntl.LOCK_EX)
+        with pytest.raises(LockTimeoutError):
+            asyncio.run(main())
+    asyncio.run(main())
+
+    stats = manager.stats()['key']
+    assert stats['timeouts'] == 1
+    assert stats['acquired'] == 1
+    assert stats['holders'] == 0
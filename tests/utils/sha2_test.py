@@ -0,0 +1,35 @@
+import hashlib
+import os
+
+import pytest
+
+from sign.utils.sha2 import Sha2
+
+
+@pytest.mark.parametrize('algorithm', ['SHA256', 'SHA384', 'SHA512'])
+@pytest.mark.parametrize('size', [0, 55, 64, 111, 128, 1000])
+def test_resumed_hash_matches_hashlib(algorithm, size):
+    """
+    Testing hash resumed from the exported state of another instance
+    Expect that the digest equals the one of hashlib
+    """
+    data = os.urandom(size)
+    client = Sha2(algorithm)
+    client.update(data[:size // 2])
+    server = Sha2(algorithm, client.export())
+    server.update(data[size // 2:])
+
+    assert server.digest() == hashlib.new(algorithm, data).digest()
+
+
+def test_malformed_state_is_rejected():
+    """
+    Testing state of another algorithm and with a partial block
+    Expect that both are rejected
+    """
+    state = Sha2('SHA256').export()
+    with pytest.raises(ValueError):
+        Sha2('SHA512', state)
+    state.length = 10
+    with pytest.raises(ValueError):
+        Sha2('SHA256', state)
@@ -0,0 +1,87 @@
+import asyncio
+import hashlib
+import io
+import os
+
+import pytest
+from fastapi import UploadFile
+
+from sign.errors import FileTooBigError
+from sign.utils.spool import UploadSpool
+
+memfd = pytest.mark.skipif(
+    not hasattr(os, 'memfd_create'), reason='memfd is not available'
+)
+
+
+async def chunks(content: bytes, size: int = 3):
+    for pos in range(0, len(content), size):
+        yield content[pos:pos + size]
+
+
+@memfd
+def test_small_upload_stays_in_memory(tmp_path):
+    """
+    Testing spooling of an upload below the memory threshold
+    Expect a sealed memory file readable by its name and no file in
+    the tmp dir
+    """
+    content = b'signed content'
+
+    async def main():
+        async with UploadSpool(
+            str(tmp_path), 100, memory_threshold=50
+        ) as spool:
+            await spool.write_stream(chunks(content))
+            assert spool.name.startswith('/proc/')
+            assert spool.label.startswith('memfd-')
+            assert os.listdir(tmp_path) == []
+            with open(spool.name, 'rb') as f:
+                assert f.read() == content
+            with pytest.raises(PermissionError):
+                os.write(spool._fd, b'x')
+            return spool.sha256, await spool.verify_hash()
+
+    hash_before, hash_after = asyncio.run(main())
+    assert hash_before == hash_after == hashlib.sha256(content).hexdigest()
+
+
+@memfd
+def test_big_upload_spills_to_disk(tmp_path):
+    """
+    Testing spooling of an upload above the memory threshold
+    Expect the content moved to a file in the tmp dir, removed on exit
+    """
+    content = bytes(range(256)) * 4
+
+    async def main():
+        async with UploadSpool(
+            str(tmp_path), 2048, buffer_size=100, memory_threshold=300
+        ) as spool:
+            await spool.write_upload(
+                UploadFile(file=io.BytesIO(content), filename='file')
+            )
+            assert os.path.dirname(spool.name) == str(tmp_path)
+            with open(spool.name, 'rb') as f:
+                assert f.read() == content
+            return spool.sha256
+
+    assert asyncio.run(main()) == hashlib.sha256(content).hexdigest()
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('memory_threshold', [0, 50])
+def test_too_big_upload(tmp_path, memory_threshold):
+    """
+    Testing a streamed upload over the size limit
+    Expect FileTooBigError
+    """
+
+    async def main():
+        async with UploadSpool(
+            str(tmp_path), 10, memory_threshold=memory_threshold
+        ) as spool:
+            await spool.write_stream(chunks(b'x' * 11))
+
+    with pytest.raises(FileTooBigError):
+        asyncio.run(main())